@@ -0,0 +1,499 @@
+"""
+Non-GUI BPM analysis pipeline shared by the Tk app and the batch engine.
+
+Each file goes through: decode (ffmpeg) -> beat tracking (a backend from
+backends.py, aubio by default) -> tempo estimation (tempo.py) -> tag
+write (taglib). With key detection
+enabled the same decoded buffers also feed a chroma accumulator (key.py),
+and BPM and KEY are written to the file in one tag write.
+"""
+
+import logging
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+import taglib
+
+from backends import DEFAULT_BACKEND, Backend, get_backend, select_backend
+from key import MIN_KEY_CONFIDENCE, ChromaAccumulator, estimate_key
+from profiles import ANALYSIS_PROFILES
+from scanner import AUDIO_EXTENSIONS, DEFAULT_EXCLUDES, scan
+from tagging import BPM_TOLERANCE, TagWriter, format_bpm
+from tempo import LONG_MIX_SECONDS, MAX_BPM, MIN_BPM, MIN_CONFIDENCE, estimate_tempo, tempo_curve
+
+possible_ffmpeg_paths = ['ffmpeg', 'C:\\ffmpeg\\bin\\ffmpeg.exe']
+
+ffmpeg_path = 'ffmpeg'
+for path in possible_ffmpeg_paths:
+    if os.path.isfile(path):
+        ffmpeg_path = path
+        break
+
+# CREATE_NO_WINDOW only exists on Windows
+creationflags = getattr(subprocess, 'CREATE_NO_WINDOW', 0)
+
+# every file is decoded to mono float32 at this rate before beat tracking
+ANALYSIS_SAMPLE_RATE = 44100
+TEMPO_METHOD = "default"
+# bytes of ffmpeg's error output kept for DecodeError
+STDERR_TAIL = 4096
+
+# 'full' decodes the whole track, 'windows' only a few evenly spaced
+# segments, 'converge' stops once the running BPM estimate settles
+ANALYSIS_MODES = ('full', 'windows', 'converge')
+WINDOW_SECONDS = 30.0
+WINDOW_COUNT = 3
+CONVERGE_TOLERANCE = 0.5
+CONVERGE_MIN_SECONDS = 45.0
+CONVERGE_CHECK_SECONDS = 10.0
+
+logger = logging.getLogger()
+logger.setLevel(logging.DEBUG)
+
+
+class DecodeError(Exception):
+    pass
+
+
+@dataclass
+class FileResult:
+    path: str
+    status: str = 'ok'
+    bpm: Optional[float] = None
+    beat_count: int = 0
+    confidence: Optional[float] = None
+    error: Optional[str] = None
+    cached: bool = False
+    tag_written: Optional[bool] = None
+    seconds: float = 0.0
+    audio_seconds: float = 0.0
+    # seconds spent per stage: decode, beat_tracking, tempo_estimate, tagging
+    timings: Dict[str, float] = field(default_factory=dict)
+    beats: Optional[np.ndarray] = field(default=None, repr=False)
+    candidates: Optional[list] = field(default=None, repr=False)
+    key: Optional[str] = None
+    key_confidence: Optional[float] = None
+    # the copy with identical audio whose analysis this result reuses
+    duplicate_of: Optional[str] = None
+    # (start seconds, BPM) per segment, for long mixes only
+    tempo_curve: Optional[list] = field(default=None, repr=False)
+    # the tempo backend that found the beats (None when they came from the cache)
+    backend: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status == 'ok'
+
+
+def get_metadata(file_path) -> tuple:
+    try:
+        with taglib.File(file_path) as f:
+            artist = next(iter(f.tags.get('ARTIST', [])), None)
+            title = next(iter(f.tags.get('TITLE', [])), None)
+            bpm = next(iter(f.tags.get('BPM', [])), None)
+            metadata = f.tags
+        return artist, title, bpm, metadata
+    except Exception as e:
+        log_error(f"Failed to read metadata from {file_path}: {e}")
+        return None, None, None, {}
+
+def tag_music_file(file_path, metadata: Dict):
+    try:
+        metadata = {key.lower(): value for key, value in metadata.items()}
+        with taglib.File(file_path, save_on_exit=True) as f:
+            f.tags = {key.lower(): value for key, value in f.tags.items()}
+            for key, value in metadata.items():
+                if isinstance(value, list):
+                    value = ', '.join(map(str, value))
+                f.tags[key] = [value]
+            f.save()
+    except Exception as e:
+        log_error(f"Failed to tag {file_path}: {e}")
+
+def process_directory(directory, extensions=AUDIO_EXTENSIONS, excludes=DEFAULT_EXCLUDES):
+    return list(scan([directory], extensions, excludes))
+
+def ensure_local(file_path):
+    return os.path.exists(file_path) and os.access(file_path, os.R_OK)
+
+
+def convert_mp3_to_wav(mp3_path, wav_path):
+    try:
+        subprocess.run([ffmpeg_path,
+                         "-i", mp3_path, wav_path, "-y"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, creationflags=creationflags)
+    except Exception as e:
+        log_error(f"Failed to convert {mp3_path} to WAV: {e}")
+        return False
+    logger.info(f"Converted {mp3_path} to WAV")
+    return True
+
+def set_window_and_hop_sizes(sample_rate, task='beat'):
+    if task == 'pitch':
+        win_s = 4096 if sample_rate >= 44100 else 2048
+        hop_s = win_s // 4
+    elif task == 'onset':
+        win_s = 1024 if sample_rate >= 44100 else 512
+        hop_s = win_s // 2
+    elif task == 'beat':
+        # keep the window around 46 ms whatever the rate
+        win_s = 2048 if sample_rate >= 44100 else 1024 if sample_rate >= 22050 else 512
+        hop_s = win_s // 2
+    elif task == 'mfcc':
+        win_s = 4096 if sample_rate >= 44100 else 2048
+        hop_s = win_s // 4
+    else:
+        raise ValueError("Unknown task")
+    return win_s, hop_s
+
+def compute(file_path: str, bpm: float, tolerance: float = BPM_TOLERANCE) -> Optional[bool]:
+    return TagWriter(tolerance).update_bpm(file_path, bpm)
+
+def tag_fields(result: 'FileResult') -> Dict[str, str]:
+    """The tags a result writes: BPM, plus KEY when a key was detected."""
+    fields = {'BPM': format_bpm(result.bpm)}
+    if result.key:
+        fields['KEY'] = result.key
+    return fields
+
+def get_temp_file(extension=".wav"):
+    return os.path.join(tempfile.gettempdir(), f"temp{extension}")
+
+def has_permission(file_path):
+    return os.path.exists(file_path) and os.access(file_path, os.R_OK) and os.access(file_path, os.W_OK)
+
+def delete_temp_file(path):
+    try:
+        if os.path.exists(path):
+            os.remove(path)
+    except Exception as e:
+        log_error(f"Failed to delete temporary file {path}: {e}")
+
+def log_error(message):
+    logger.error(message)
+
+
+def _drain(pipe, tail: bytearray):
+    """Read `pipe` to the end so ffmpeg never blocks writing to it, keeping the last STDERR_TAIL bytes."""
+    for chunk in iter(lambda: pipe.read(STDERR_TAIL), b''):
+        tail += chunk
+        del tail[:-STDERR_TAIL]
+
+
+def stream_pcm(audio_path: str, sample_rate: int, hop_s: int, start: Optional[float] = None,
+               duration: Optional[float] = None) -> Iterator[Tuple[np.ndarray, int]]:
+    """
+    Decode `audio_path` with ffmpeg to mono float32 PCM on a pipe and yield
+    `(samples, read)` in `hop_s`-sized buffers, like `aubio.source` does.
+    The last buffer is zero-padded to `hop_s` and `read` holds the real count.
+    `start`/`duration` (seconds) decode only part of the file; ffmpeg seeks
+    to `start` directly instead of decoding up to it. ffmpeg's error output
+    is drained on a thread while the audio is read: a damaged file can fill
+    the stderr pipe before its audio ends, which would block ffmpeg.
+    """
+    cmd = [ffmpeg_path, "-v", "error", "-nostdin"]
+    if start is not None:
+        cmd += ["-ss", f"{start:.3f}"]
+    cmd += ["-i", audio_path]
+    if duration is not None:
+        cmd += ["-t", f"{duration:.3f}"]
+    cmd += ["-f", "f32le", "-acodec", "pcm_f32le", "-ac", "1", "-ar", str(sample_rate), "pipe:1"]
+    hop_bytes = hop_s * 4
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            bufsize=hop_bytes * 64, creationflags=creationflags)
+    errors = bytearray()
+    drain = threading.Thread(target=_drain, args=(proc.stderr, errors), daemon=True)
+    drain.start()
+    total = 0
+    try:
+        while True:
+            data = proc.stdout.read(hop_bytes)
+            read = len(data) // 4
+            if read == 0:
+                break
+            samples = np.frombuffer(data, dtype=np.float32, count=read)
+            if read < hop_s:
+                samples = np.concatenate((samples, np.zeros(hop_s - read, dtype=np.float32)))
+            total += read
+            yield samples, read
+            if read < hop_s:
+                break
+    finally:
+        proc.stdout.close()
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+        drain.join()
+        proc.stderr.close()
+        stderr = errors.decode(errors="replace").strip()
+    if total == 0:
+        raise DecodeError(stderr or f"ffmpeg produced no audio for {audio_path}")
+
+def probe_duration(audio_path: str) -> Optional[float]:
+    """Duration in seconds as reported by ffmpeg, or None if it cannot tell."""
+    proc = subprocess.run([ffmpeg_path, "-nostdin", "-hide_banner", "-i", audio_path],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, creationflags=creationflags)
+    match = re.search(rb"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", proc.stderr)
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+def window_segments(duration: Optional[float], window_s: float, count: int) -> list:
+    """Evenly spaced `(start, length)` windows; one full-track segment for short or unknown tracks."""
+    if duration is None or duration <= window_s * count:
+        return [(None, None)]
+    return [((duration - window_s) * (i + 1) / (count + 1), window_s) for i in range(count)]
+
+def profile_params(profile: str = 'full', **kwargs) -> Dict:
+    """analysis_params() for one of ANALYSIS_PROFILES."""
+    if profile not in ANALYSIS_PROFILES:
+        raise ValueError(f"Unknown analysis profile {profile!r}")
+    return analysis_params(ANALYSIS_PROFILES[profile], **kwargs)
+
+def analysis_params(sample_rate: int = ANALYSIS_SAMPLE_RATE, method: str = TEMPO_METHOD,
+                    min_bpm: float = MIN_BPM, max_bpm: float = MAX_BPM,
+                    min_confidence: float = MIN_CONFIDENCE, mode: str = 'full',
+                    window_s: float = WINDOW_SECONDS, windows: int = WINDOW_COUNT,
+                    converge_tolerance: float = CONVERGE_TOLERANCE, detect_key: bool = False,
+                    min_key_confidence: float = MIN_KEY_CONFIDENCE, backend: str = DEFAULT_BACKEND,
+                    genre_backends: Sequence[Tuple[str, str]] = ()) -> Dict:
+    """
+    Settings that determine the beats, BPM and key found for a file.
+    `genre_backends` are (genre, backend) rules tried against the GENRE tag
+    before falling back to `backend`.
+    """
+    if mode not in ANALYSIS_MODES:
+        raise ValueError(f"Unknown analysis mode {mode!r}")
+    for name in {backend, *(rule[1] for rule in genre_backends)}:
+        if not get_backend(name).available():
+            raise ValueError(f"Tempo backend {name!r} needs {', '.join(get_backend(name).requires)} installed")
+    win_s, hop_s = set_window_and_hop_sizes(sample_rate, 'beat')
+    params = {'samplerate': sample_rate, 'win_s': win_s, 'hop_s': hop_s, 'method': method,
+              'min_bpm': min_bpm, 'max_bpm': max_bpm, 'min_confidence': min_confidence, 'mode': mode}
+    if mode == 'windows':
+        params.update(window_s=window_s, windows=windows)
+    elif mode == 'converge':
+        params.update(converge_tolerance=converge_tolerance)
+    if detect_key:
+        # only present when enabled, so BPM-only cache entries stay valid
+        params.update(key=True, min_key_confidence=min_key_confidence)
+    # likewise only stored when they differ from the default aubio tracker
+    if backend != DEFAULT_BACKEND:
+        params['backend'] = backend
+    if genre_backends:
+        params['genre_backends'] = [[genre.lower(), name] for genre, name in genre_backends]
+    return params
+
+# params that decide which beats are found; the others (BPM range and
+# confidence floor) only change what is made of the beats
+DETECTION_PARAMS = ('samplerate', 'win_s', 'hop_s', 'method', 'mode', 'window_s', 'windows',
+                    'converge_tolerance', 'backend', 'genre_backends')
+
+def same_detection(stored: Dict, params: Dict) -> bool:
+    """Whether beats detected under `stored` params are the ones `params` would detect."""
+    return all(stored.get(name) == params.get(name) for name in DETECTION_PARAMS)
+
+class BeatBuffer:
+    """
+    Beat times collected in a float32 array that doubles when full, so a
+    long mix costs 4 bytes per beat instead of a Python float each.
+    """
+
+    def __init__(self, capacity: int = 1024):
+        self._data = np.empty(capacity, dtype=np.float32)
+        self.size = 0
+
+    def _reserve(self, count: int):
+        if self.size + count > len(self._data):
+            grown = np.empty(max(len(self._data) * 2, self.size + count), dtype=np.float32)
+            grown[:self.size] = self._data[:self.size]
+            self._data = grown
+
+    def append(self, seconds: float):
+        self._reserve(1)
+        self._data[self.size] = seconds
+        self.size += 1
+
+    def extend(self, seconds: np.ndarray):
+        seconds = np.asarray(seconds, dtype=np.float32)
+        self._reserve(len(seconds))
+        self._data[self.size:self.size + len(seconds)] = seconds
+        self.size += len(seconds)
+
+    def view(self) -> np.ndarray:
+        return self._data[:self.size]
+
+    def array(self) -> np.ndarray:
+        """A copy trimmed to the beats found, so the spare capacity is freed."""
+        return self._data[:self.size].copy()
+
+
+def choose_backend(audio_path: str, params: Dict) -> Backend:
+    """select_backend(), except that a whole-array backend never gets a long mix in full."""
+    backend = select_backend(audio_path, params)
+    if not backend.streaming and params.get('mode', 'full') != 'windows':
+        duration = probe_duration(audio_path)
+        if duration is None or duration >= LONG_MIX_SECONDS:
+            backend = get_backend(DEFAULT_BACKEND)
+    return backend
+
+def detect_beats(audio_path: str, params: Optional[Dict] = None,
+                 timings: Optional[Dict[str, float]] = None,
+                 chroma: Optional[ChromaAccumulator] = None,
+                 backend: Optional[Backend] = None) -> Tuple[np.ndarray, float]:
+    """
+    Return the beat times in seconds and how many seconds of audio were analyzed.
+    Time spent decoding, beat tracking and on chroma is added to `timings`
+    when given. The decoded samples are also fed to `chroma` when given.
+    A whole-array `backend` gets each segment once it is fully decoded, and
+    'converge' mode then decodes the whole track.
+    """
+    params = params or analysis_params()
+    backend = backend or choose_backend(audio_path, params)
+    started = time.perf_counter()
+    tracking = 0.0
+    chroma_time = 0.0
+    sample_rate, hop_s = params['samplerate'], params['hop_s']
+    mode = params.get('mode', 'full')
+    if mode == 'windows':
+        segments = window_segments(probe_duration(audio_path), params['window_s'], params['windows'])
+    else:
+        segments = [(None, None)]
+
+    beats = BeatBuffer()
+    analyzed = 0
+    for start, length in segments:
+        # a fresh tracker per segment; its beat times are relative to the segment start
+        track = backend.tracker(params) if backend.streaming else None
+        chunks = []
+        offset = start or 0.0
+        read_total = 0
+        next_check = CONVERGE_MIN_SECONDS * sample_rate
+        last_bpm = None
+        stream = stream_pcm(audio_path, sample_rate, hop_s, start, length)
+        try:
+            for samples, read in stream:
+                if track is not None:
+                    tick = time.perf_counter()
+                    beat = track(samples)
+                    if beat is not None:
+                        beats.append(offset + beat)
+                    tracking += time.perf_counter() - tick
+                else:
+                    chunks.append(samples[:read])
+                if chroma is not None:
+                    tick = time.perf_counter()
+                    chroma.add(samples[:read])
+                    chroma_time += time.perf_counter() - tick
+                read_total += read
+                if mode == 'converge' and track is not None and read_total >= next_check:
+                    bpm = estimate_tempo(beats.view(), params['min_bpm'], params['max_bpm']).bpm
+                    if bpm is not None and last_bpm is not None \
+                            and abs(bpm - last_bpm) <= params['converge_tolerance']:
+                        break
+                    last_bpm = bpm
+                    next_check += CONVERGE_CHECK_SECONDS * sample_rate
+        finally:
+            stream.close()
+        if chunks:
+            tick = time.perf_counter()
+            beats.extend(offset + backend.beats(np.concatenate(chunks), params))
+            tracking += time.perf_counter() - tick
+        analyzed += read_total
+    if timings is not None:
+        # decoding and tracking interleave on the pipe; whatever was not tracking was decode
+        timings['beat_tracking'] = timings.get('beat_tracking', 0.0) + tracking
+        if chroma is not None:
+            timings['chroma'] = timings.get('chroma', 0.0) + chroma_time
+        timings['decode'] = timings.get('decode', 0.0) + time.perf_counter() - started - tracking - chroma_time
+    return beats.array(), analyzed / sample_rate
+
+def bpm_from_beats(beats: np.ndarray) -> Optional[float]:
+    if len(beats) < 2:
+        return None
+    intervals = np.diff(beats)
+    return float(np.median(60.0 / intervals))
+
+def _finish(result: FileResult, beats: np.ndarray, write_tags: bool, tolerance: float,
+            params: Dict) -> FileResult:
+    result.beats = beats
+    result.beat_count = len(beats)
+    start = time.perf_counter()
+    estimate = estimate_tempo(beats, params['min_bpm'], params['max_bpm'])
+    result.timings['tempo_estimate'] = time.perf_counter() - start
+    if estimate.bpm is None:
+        result.status = 'no_beats'
+        return result
+    result.bpm = estimate.bpm
+    result.confidence = estimate.confidence
+    result.candidates = estimate.candidates
+    if len(beats) and beats[-1] >= LONG_MIX_SECONDS:
+        result.tempo_curve = tempo_curve(beats, min_bpm=params['min_bpm'], max_bpm=params['max_bpm'])
+    if not estimate.is_confident(params['min_confidence']):
+        # flag for review instead of tagging a tempo we are unsure about
+        result.status = 'low_confidence'
+        return result
+    if write_tags:
+        start = time.perf_counter()
+        result.tag_written = TagWriter(tolerance).update(result.path, tag_fields(result))
+        result.timings['tagging'] = time.perf_counter() - start
+    return result
+
+def _set_key(result: FileResult, chroma: ChromaAccumulator, params: Dict):
+    start = time.perf_counter()
+    estimate = estimate_key(chroma.chroma if chroma.frames else None)
+    result.timings['key_estimate'] = time.perf_counter() - start
+    result.key_confidence = estimate.confidence if estimate.key else None
+    # an atonal track (or a drum loop) gets no KEY rather than a guess
+    if estimate.is_confident(params['min_key_confidence']):
+        result.key = estimate.key
+
+def analyze_file(mp3_path: str, write_tags: bool = True, params: Optional[Dict] = None,
+                 tolerance: float = BPM_TOLERANCE) -> FileResult:
+    """Run one file through decode -> beat tracking -> BPM -> tag write."""
+    result = FileResult(mp3_path)
+    if not has_permission(mp3_path):
+        result.status = 'unreadable'
+        result.error = "File does not exist or permission denied"
+        return result
+
+    params = params or analysis_params()
+    start = time.perf_counter()
+    try:
+        chroma = ChromaAccumulator(params['samplerate']) if params.get('key') else None
+        backend = choose_backend(mp3_path, params)
+        result.backend = backend.name
+        beats, result.audio_seconds = detect_beats(mp3_path, params, result.timings, chroma, backend)
+        if chroma is not None:
+            _set_key(result, chroma, params)
+        _finish(result, beats, write_tags, tolerance, params)
+    except DecodeError as e:
+        result.status = 'error'
+        result.error = f"ffmpeg error: {e}"
+    except Exception as e:
+        result.status = 'error'
+        result.error = f"General error: {e}"
+    result.seconds = time.perf_counter() - start
+    return result
+
+def apply_cached_beats(mp3_path: str, beats: np.ndarray, write_tags: bool = True,
+                       params: Optional[Dict] = None, tolerance: float = BPM_TOLERANCE,
+                       key: Optional[str] = None, key_confidence: Optional[float] = None) -> FileResult:
+    """Recompute the BPM from previously detected beats (and key), skipping the decode."""
+    result = FileResult(mp3_path, cached=True, key=key, key_confidence=key_confidence)
+    params = params or analysis_params()
+    start = time.perf_counter()
+    try:
+        _finish(result, beats, write_tags, tolerance, params)
+    except Exception as e:
+        result.status = 'error'
+        result.error = f"General error: {e}"
+    result.seconds = time.perf_counter() - start
+    return result
@@ -0,0 +1,192 @@
+"""
+Beat tracking backends behind one interface.
+
+A backend turns decoded mono float32 audio into beat times in seconds.
+Streaming backends (aubio's tempo tracker, with any of its onset
+methods) are fed each PCM buffer as it is decoded and keep memory flat.
+Whole-array backends (librosa's `beat_track`) get the complete decoded
+signal at once and run vectorized over it. That needs the whole track in
+memory, so long mixes always fall back to the default streaming backend.
+
+Backends are registered by name in `BACKENDS`; third-party ones
+subclass `StreamingBackend` or `ArrayBackend` and are added with
+`register_backend`. Which backend analyzes a file is decided
+by `select_backend` from the analysis params: the run's backend, unless
+a genre rule matches the file's GENRE tag. The run's backend can also be
+picked from a `benchmark.py --backends --save` report by `best_backend`:
+the most accurate one that is at least a given factor as fast as the
+default. The libraries behind a backend are imported the first time it
+is used, in the worker processes.
+
+The desktop app always tracks with the default backend, so it is built
+without the libraries of the others: `python backends.py` prints the
+PyInstaller `--exclude-module` flags for them, following `BACKENDS`.
+"""
+
+import importlib.util
+import logging
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_BACKEND = 'aubio'
+# onset detection functions of aubio's tempo tracker; 'default' is specflux
+AUBIO_METHODS = ('default', 'specflux', 'hfc', 'complex', 'phase', 'energy', 'kl', 'mkl', 'specdiff', 'wphase')
+LIBROSA_HOP = 512
+# in requirements.txt (mostly for librosa) but never imported by the desktop app
+APP_UNUSED_MODULES = ('numba', 'llvmlite', 'scipy', 'sklearn', 'soundfile', 'soxr', 'pydub', 'openpyxl',
+                      'ffmpeg', 'sqlalchemy')
+
+# returns the time of a beat found in the buffer (relative to the stream start), if any
+Tracker = Callable[[np.ndarray], Optional[float]]
+
+
+class Backend(ABC):
+    name = ''
+    streaming = True
+    requires: Tuple[str, ...] = ()
+
+    def available(self) -> bool:
+        return all(importlib.util.find_spec(module) is not None for module in self.requires)
+
+
+class StreamingBackend(Backend):
+    """Fed every decoded buffer in turn through the tracker it returns."""
+    streaming = True
+
+    @abstractmethod
+    def tracker(self, params: Dict) -> Tracker:
+        ...
+
+
+class ArrayBackend(Backend):
+    """Given the whole decoded signal at once."""
+    streaming = False
+
+    @abstractmethod
+    def beats(self, audio: np.ndarray, params: Dict) -> np.ndarray:
+        ...
+
+
+class AubioBackend(StreamingBackend):
+    requires = ('aubio',)
+
+    def __init__(self, method: Optional[str] = None):
+        # None uses params['method'], which is how plain 'aubio' always worked
+        self.method = method
+        self.name = f'aubio-{method}' if method else 'aubio'
+
+    def tracker(self, params: Dict) -> Tracker:
+        import aubio
+        tempo_o = aubio.tempo(self.method or params['method'], params['win_s'], params['hop_s'],
+                              params['samplerate'])
+
+        def track(samples: np.ndarray) -> Optional[float]:
+            return tempo_o.get_last_s() if tempo_o(samples) else None
+
+        return track
+
+
+class LibrosaBackend(ArrayBackend):
+    name = 'librosa'
+    requires = ('librosa',)
+
+    def beats(self, audio: np.ndarray, params: Dict) -> np.ndarray:
+        import librosa
+        _, beats = librosa.beat.beat_track(y=audio, sr=params['samplerate'], hop_length=LIBROSA_HOP,
+                                           units='time')
+        return np.asarray(beats, dtype=np.float32)
+
+
+BACKENDS: Dict[str, Backend] = {}
+
+
+def register_backend(backend: Backend):
+    """Add `backend` under its name; incomplete backends already fail to instantiate."""
+    if not isinstance(backend, (StreamingBackend, ArrayBackend)):
+        raise TypeError(f"{type(backend).__name__} must subclass StreamingBackend or ArrayBackend")
+    if not backend.name:
+        raise ValueError(f"{type(backend).__name__} has no name")
+    BACKENDS[backend.name] = backend
+
+
+for _method in AUBIO_METHODS[1:]:
+    register_backend(AubioBackend(_method))
+register_backend(AubioBackend())
+register_backend(LibrosaBackend())
+
+
+def get_backend(name: str) -> Backend:
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown tempo backend {name!r}; choose from {', '.join(sorted(BACKENDS))}") from None
+
+
+def available_backends() -> List[str]:
+    return sorted(name for name, backend in BACKENDS.items() if backend.available())
+
+
+def best_backend(reports: Dict[str, Dict], min_speedup: float = 0.0) -> str:
+    """
+    The installed backend with the most fixtures within 1 BPM (then the
+    fewest octave errors) among those at least `min_speedup` times as fast
+    as the default one in a benchmark report.
+    """
+    ranked = [(report['bpm_error']['within_1bpm'], -report['bpm_error']['octave_errors'],
+               report.get('speedup', 0.0), name)
+              for name, report in reports.items()
+              if 'bpm_error' in report and report.get('speedup', 0.0) >= min_speedup
+              and name in BACKENDS and BACKENDS[name].available()]
+    return max(ranked)[-1] if ranked else DEFAULT_BACKEND
+
+
+def parse_genre_rule(value: str) -> Tuple[str, str]:
+    """'GENRE=BACKEND' as given on the command line."""
+    genre, sep, backend = value.partition("=")
+    if not sep or not genre:
+        raise ValueError(f"Genre rule must look like GENRE=BACKEND, got {value!r}")
+    get_backend(backend)
+    return genre.lower(), backend
+
+
+def read_genre(path: str) -> str:
+    import taglib
+    try:
+        with taglib.File(path) as f:
+            return " ".join(f.tags.get('GENRE', [])).lower()
+    except Exception:
+        return ""
+
+
+def select_backend(path: str, params: Dict) -> Backend:
+    """
+    The backend for `path`: the first rule in params['genre_backends']
+    whose genre occurs in the file's GENRE tag, else params['backend'].
+    An unavailable backend falls back to the default one.
+    """
+    name = params.get('backend', DEFAULT_BACKEND)
+    rules = params.get('genre_backends')
+    if rules:
+        genre = read_genre(path)
+        for pattern, backend in rules:
+            if pattern in genre:
+                name = backend
+                break
+    backend = get_backend(name)
+    if not backend.available():
+        logging.warning(f"Tempo backend {name} is not installed, using {DEFAULT_BACKEND} for {path}")
+        backend = get_backend(DEFAULT_BACKEND)
+    return backend
+
+
+def app_excludes() -> List[str]:
+    """Modules the desktop app is built without: every backend's libraries but the default one's."""
+    needed = set(get_backend(DEFAULT_BACKEND).requires)
+    backend_modules = {module for backend in BACKENDS.values() for module in backend.requires}
+    return sorted((backend_modules - needed) | set(APP_UNUSED_MODULES))
+
+
+if __name__ == "__main__":
+    print(" ".join(f"--exclude-module {module}" for module in app_excludes()))
@@ -0,0 +1,307 @@
+"""
+Per-track beat grids kept after analysis, and their export formats.
+
+All beat times live in one append-only float32 file that is read through
+`np.memmap`, so a store with millions of beats can be queried without
+loading it. A small SQLite index maps each path (and optionally a
+fingerprint) to its slice of that file together with the BPM and the
+first beat offset. Replacing a track's grid appends a new slice; the old
+one stays as garbage until `compact()` rewrites the data file. Several
+processes (e.g. runs sharing a job journal) can write to one store: each
+append takes an exclusive lock on the data file, reads the offset from
+its size and commits the index row before releasing it, so every row
+points into data that is on disk.
+
+Grids can be exported as CSV, or as the protobuf blobs Mixxx keeps in
+`library.beats` (BeatGrid-2.0 for a constant grid, BeatMap-1.0 for every
+beat). The blobs are encoded directly from the protobuf wire format,
+so no protobuf package is needed. Each grid records the analysis mode
+it came from: beats of a `windows` or `converge` run cover only parts of
+the track, so such grids are only exported as constant grids.
+"""
+
+import csv
+import os
+import sqlite3
+import struct
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import IO, Iterator, Optional, Sequence
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+DATA_FILE = "beats.f32"
+INDEX_FILE = "index.sqlite"
+# Mixxx stores beat positions as interleaved stereo samples (frames * 2)
+MIXXX_CHANNELS = 2
+MIXXX_BEATGRID = "BeatGrid-2.0"
+MIXXX_BEATMAP = "BeatMap-1.0"
+
+
+def default_store_path() -> str:
+    return os.path.join(os.path.expanduser("~"), ".bpm_tagger", "beats")
+
+
+@contextmanager
+def _locked(f):
+    """Hold an exclusive lock on the open file `f` between processes."""
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        return
+    # msvcrt locks a byte range; the first byte serves as the lock for the whole file
+    position = f.tell()
+    f.seek(0)
+    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+    try:
+        yield
+    finally:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        f.seek(position)
+
+
+@dataclass
+class BeatGrid:
+    path: str
+    bpm: Optional[float]
+    first_beat: float
+    # a read-only view into the store's memory map, or any float32 array
+    beats: np.ndarray
+    # analysis mode the beats came from; only 'full' covers the whole track
+    mode: str = 'full'
+
+    @property
+    def partial(self) -> bool:
+        """Beats of a few windows (or the start) of the track only, with gaps elsewhere."""
+        return self.mode != 'full'
+
+    def between(self, start: float, end: float) -> np.ndarray:
+        """Beat times in [start, end) seconds."""
+        lo, hi = np.searchsorted(self.beats, (start, end))
+        return self.beats[lo:hi]
+
+
+class BeatStore:
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or default_store_path()
+        os.makedirs(self.directory, exist_ok=True)
+        self.data_path = os.path.join(self.directory, DATA_FILE)
+        self.conn = sqlite3.connect(os.path.join(self.directory, INDEX_FILE))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS grids (
+                path TEXT PRIMARY KEY,
+                fingerprint TEXT,
+                offset INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                bpm REAL,
+                first_beat REAL,
+                updated REAL,
+                mode TEXT NOT NULL DEFAULT 'full'
+            )"""
+        )
+        # stores written before grids recorded their mode
+        if 'mode' not in {column[1] for column in self.conn.execute("PRAGMA table_info(grids)")}:
+            self.conn.execute("ALTER TABLE grids ADD COLUMN mode TEXT NOT NULL DEFAULT 'full'")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS grids_fingerprint ON grids (fingerprint)")
+        self.conn.commit()
+        self._data = open(self.data_path, 'ab')
+        self._map: Optional[np.memmap] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
+            self._data.close()
+            self._map = None
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM grids").fetchone()[0]
+
+    def __contains__(self, path: str) -> bool:
+        return self.conn.execute("SELECT 1 FROM grids WHERE path = ?", (path,)).fetchone() is not None
+
+    def _replaced(self) -> bool:
+        # compact() in another process swaps in a new data file
+        try:
+            return os.stat(self.data_path).st_ino != os.fstat(self._data.fileno()).st_ino
+        except OSError:
+            return True
+
+    def _reopen_if_replaced(self):
+        if self._replaced():
+            self._data.close()
+            self._data = open(self.data_path, 'ab')
+            self._map = None
+
+    @contextmanager
+    def _data_locked(self):
+        """
+        Lock the current data file. A compact() in another process can
+        replace it while we wait for the lock; the lock on the old file
+        then guards nothing, so the new file is opened and locked instead.
+        """
+        while True:
+            self._reopen_if_replaced()
+            with _locked(self._data):
+                if not self._replaced():
+                    yield
+                    return
+
+    def put(self, path: str, bpm: Optional[float], beats: np.ndarray, fingerprint: Optional[str] = None,
+            mode: str = 'full'):
+        """Store (or replace) the beat grid of `path`, found in analysis `mode`."""
+        beats = np.ascontiguousarray(beats, dtype=np.float32)
+        # another process may have appended since our last write, so the
+        # offset comes from the file size, read and written under the lock
+        with self._data_locked():
+            size = os.fstat(self._data.fileno()).st_size
+            if size % 4:
+                # a torn write from a crashed process; keep the slices aligned
+                self._data.write(b'\0' * (4 - size % 4))
+                size += 4 - size % 4
+            offset = size // 4
+            self._data.write(beats.tobytes())
+            self._data.flush()
+            first_beat = float(beats[0]) if len(beats) else 0.0
+            self.conn.execute("INSERT OR REPLACE INTO grids "
+                              "(path, fingerprint, offset, count, bpm, first_beat, updated, mode) "
+                              "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                              (path, fingerprint, offset, len(beats), bpm, first_beat, time.time(), mode))
+            self.conn.commit()
+
+    def flush(self):
+        self.conn.commit()
+
+    def _beats(self, offset: int, count: int) -> np.ndarray:
+        if self._map is None or offset + count > len(self._map):
+            size = os.path.getsize(self.data_path) // 4
+            if size == 0:
+                return np.zeros(0, dtype=np.float32)
+            self._map = np.memmap(self.data_path, dtype=np.float32, mode='r', shape=(size,))
+        return self._map[offset:offset + count]
+
+    def _grid(self, row) -> BeatGrid:
+        path, offset, count, bpm, first_beat, mode = row
+        return BeatGrid(path, bpm, first_beat, self._beats(offset, count), mode)
+
+    def get(self, path: str) -> Optional[BeatGrid]:
+        row = self.conn.execute("SELECT path, offset, count, bpm, first_beat, mode FROM grids WHERE path = ?",
+                                (path,)).fetchone()
+        return self._grid(row) if row else None
+
+    def find(self, fingerprint: str) -> Optional[BeatGrid]:
+        """The grid of any track stored with `fingerprint`."""
+        row = self.conn.execute("SELECT path, offset, count, bpm, first_beat, mode FROM grids "
+                                "WHERE fingerprint = ? LIMIT 1", (fingerprint,)).fetchone()
+        return self._grid(row) if row else None
+
+    def grids(self, prefix: Optional[str] = None) -> Iterator[BeatGrid]:
+        """All grids in path order, optionally only those under `prefix`."""
+        query = "SELECT path, offset, count, bpm, first_beat, mode FROM grids"
+        args = ()
+        if prefix:
+            query += " WHERE path >= ? AND path < ?"
+            args = (prefix, prefix + "\uffff")
+        for row in self.conn.execute(query + " ORDER BY path", args).fetchall():
+            yield self._grid(row)
+
+    def remove(self, path: str):
+        self.conn.execute("DELETE FROM grids WHERE path = ?", (path,))
+        self.conn.commit()
+
+    def compact(self) -> int:
+        """
+        Rewrite the data file without replaced or removed slices; returns the
+        bytes freed. Writers in other processes wait on the lock meanwhile
+        and append to the new file afterwards.
+        """
+        self.flush()
+        with self._data_locked():
+            before = os.path.getsize(self.data_path)
+            rows = self.conn.execute("SELECT path, offset, count FROM grids ORDER BY offset").fetchall()
+            tmp_path = self.data_path + ".tmp"
+            updates = []
+            with open(tmp_path, 'wb') as out:
+                position = 0
+                for path, offset, count in rows:
+                    out.write(np.asarray(self._beats(offset, count)).tobytes())
+                    updates.append((position, path))
+                    position += count
+            self._map = None
+            os.replace(tmp_path, self.data_path)
+            self.conn.executemany("UPDATE grids SET offset = ? WHERE path = ?", updates)
+            self.conn.commit()
+        self._data.close()
+        self._data = open(self.data_path, 'ab')
+        return before - os.path.getsize(self.data_path)
+
+
+def write_csv(grids: Iterator[BeatGrid], out: IO[str]) -> int:
+    """
+    Write grids in long format (path, bpm, beat number, seconds), one row
+    per beat, streaming so the whole store never has to be in memory.
+    """
+    writer = csv.writer(out)
+    writer.writerow(("path", "bpm", "beat", "seconds"))
+    rows = 0
+    for grid in grids:
+        bpm = round(grid.bpm, 2) if grid.bpm is not None else ""
+        for number, seconds in enumerate(grid.beats.tolist(), 1):
+            writer.writerow((grid.path, bpm, number, f"{seconds:.4f}"))
+        rows += len(grid.beats)
+    return rows
+
+
+def _varint(value: int) -> bytes:
+    value &= (1 << 64) - 1  # negative int32 values are encoded as 10-byte varints
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _message(field: int, payload: bytes) -> bytes:
+    return _varint(field << 3 | 2) + _varint(len(payload)) + payload
+
+
+def _beat(seconds: float, sample_rate: int) -> bytes:
+    # Beat { int32 frame_position = 1; }
+    return b'\x08' + _varint(int(round(seconds * sample_rate)) * MIXXX_CHANNELS)
+
+
+def mixxx_beatgrid(grid: BeatGrid, sample_rate: int) -> bytes:
+    """BeatGrid { Bpm bpm = 1 { double bpm = 1 }; Beat first_beat = 2 } for a constant tempo."""
+    if grid.bpm is None:
+        raise ValueError(f"{grid.path} has no BPM")
+    return (_message(1, b'\x09' + struct.pack('<d', grid.bpm))
+            + _message(2, _beat(grid.first_beat, sample_rate)))
+
+
+def mixxx_beatmap(beats: Sequence[float], sample_rate: int) -> bytes:
+    """BeatMap { repeated Beat beat = 1 } with every detected beat."""
+    return b''.join(_message(1, _beat(seconds, sample_rate)) for seconds in np.asarray(beats).tolist())
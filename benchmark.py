@@ -0,0 +1,437 @@
+"""
+Benchmark for the BPM pipeline using synthetic fixtures with known tempo.
+
+    python benchmark.py                          # run and print a report
+    python benchmark.py --save baseline.json     # record a baseline
+    python benchmark.py --compare baseline.json  # fail on regressions
+    python benchmark.py --profiles               # speed/accuracy per analysis profile
+    python benchmark.py --startup                # import time of the GUI and engine
+    python benchmark.py --backends               # speed/accuracy per tempo backend
+
+Fixtures (click tracks and drum loops) are generated offline with NumPy
+and encoded to MP3 with the local ffmpeg. Every stage of the classic
+pipeline is timed separately (convert_mp3_to_wav, aubio source setup, the
+tempo loop, the median BPM, tag_music_file) next to the streaming
+end-to-end path, and the report has files/sec, per-stage p50/p95
+latency, peak RSS and BPM error against the ground truth.
+
+`--startup` needs no fixtures: it imports the GUI module and the engine
+in fresh interpreters with `-X importtime` and reports the median import
+time, the heaviest imports and which heavy libraries got loaded.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from typing import Dict, List, Optional
+
+import aubio
+import numpy as np
+
+from analysis import (ANALYSIS_PROFILES, analysis_params, analyze_file, bpm_from_beats, convert_mp3_to_wav,
+                      creationflags, delete_temp_file, ffmpeg_path, profile_params, set_window_and_hop_sizes,
+                      tag_music_file)
+from backends import BACKENDS, DEFAULT_BACKEND
+from tempo import estimate_tempo
+
+FIXTURE_BPMS = (85, 95, 110, 120, 124, 128, 140, 150, 174)
+FIXTURE_KINDS = ('click', 'drums')
+FIXTURE_SECONDS = 30.0
+FIXTURE_RATE = 44100
+REGRESSION_THRESHOLD = 0.10
+STARTUP_MODULES = ('main', 'engine')
+HEAVY_MODULES = ('numpy', 'aubio', 'taglib', 'sqlite3', 'librosa', 'numba', 'scipy', 'sklearn')
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def _decay(length: int, rate: float) -> np.ndarray:
+    return np.exp(-np.arange(length) / FIXTURE_RATE * rate)
+
+
+def synth_fixture(kind: str, bpm: float, seconds: float = FIXTURE_SECONDS, seed: int = 0) -> np.ndarray:
+    """Mono float32 audio with events exactly on the beat grid of `bpm`."""
+    rng = np.random.default_rng(seed)
+    out = np.zeros(int(seconds * FIXTURE_RATE), dtype=np.float64)
+    period = 60.0 / bpm
+    t = np.arange(int(0.15 * FIXTURE_RATE)) / FIXTURE_RATE
+    if kind == 'click':
+        click = np.sin(2 * np.pi * 1000 * t[:int(0.03 * FIXTURE_RATE)]) * _decay(int(0.03 * FIXTURE_RATE), 80)
+        events = [(np.arange(0, seconds, period), click)]
+    elif kind == 'drums':
+        kick = np.sin(2 * np.pi * (50 + 100 * np.exp(-t * 30)) * t) * _decay(len(t), 12)
+        snare = rng.normal(0, 0.6, len(t)) * _decay(len(t), 25)
+        hat = rng.normal(0, 0.25, int(0.05 * FIXTURE_RATE)) * _decay(int(0.05 * FIXTURE_RATE), 60)
+        beats = np.arange(0, seconds, period)
+        events = [(beats, kick), (beats[1::2], snare), (np.arange(period / 2, seconds, period), hat)]
+    else:
+        raise ValueError(f"Unknown fixture kind {kind!r}")
+    for times, sound in events:
+        for start in (times * FIXTURE_RATE).astype(int):
+            end = min(start + len(sound), len(out))
+            out[start:end] += sound[:end - start]
+    out += rng.normal(0, 0.003, len(out))
+    return (out / np.abs(out).max() * 0.9).astype(np.float32)
+
+
+def write_wav(path: str, samples: np.ndarray):
+    with wave.open(path, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(FIXTURE_RATE)
+        w.writeframes((samples * 32767).astype('<i2').tobytes())
+
+
+def generate_fixtures(directory: str, bpms=FIXTURE_BPMS, kinds=FIXTURE_KINDS,
+                      seconds: float = FIXTURE_SECONDS) -> List[Dict]:
+    """Write `<kind>_<bpm>.mp3` fixtures (reusing existing ones) and return their ground truth."""
+    os.makedirs(directory, exist_ok=True)
+    fixtures = []
+    for kind in kinds:
+        for i, bpm in enumerate(bpms):
+            mp3_path = os.path.join(directory, f"{kind}_{bpm}.mp3")
+            if not os.path.exists(mp3_path):
+                wav_path = mp3_path[:-4] + ".wav"
+                write_wav(wav_path, synth_fixture(kind, bpm, seconds, seed=i))
+                subprocess.run([ffmpeg_path, "-v", "error", "-y", "-i", wav_path, "-b:a", "192k", mp3_path],
+                               check=True, creationflags=creationflags)
+                os.remove(wav_path)
+            fixtures.append({'path': mp3_path, 'kind': kind, 'bpm': float(bpm)})
+    return fixtures
+
+
+def peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    scale = 1 if sys.platform == 'darwin' else 1024  # ru_maxrss is bytes on macOS, KiB on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) * scale / (1024 * 1024)
+
+
+def time_stages(mp3_path: str, wav_path: str) -> Dict[str, float]:
+    """Time each stage of the classic temp-WAV pipeline for one file."""
+    timings = {}
+    start = time.perf_counter()
+    convert_mp3_to_wav(mp3_path, wav_path)
+    timings['convert_mp3_to_wav'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    s = aubio.source(wav_path)
+    sample_rate = s.samplerate
+    win_s, hop_s = set_window_and_hop_sizes(sample_rate, 'beat')
+    tempo_o = aubio.tempo("default", win_s, hop_s, sample_rate)
+    s = aubio.source(wav_path, sample_rate, hop_s)
+    timings['aubio_setup'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    beats = []
+    while True:
+        samples, read = s()
+        if tempo_o(samples):
+            beats.append(tempo_o.get_last_s())
+        if read < hop_s:
+            break
+    del s
+    timings['tempo_loop'] = time.perf_counter() - start
+
+    beats = np.array(beats)
+    start = time.perf_counter()
+    bpm_from_beats(beats)
+    timings['median_bpm'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    estimate_tempo(beats)
+    timings['estimate_tempo'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    tag_music_file(mp3_path, {'BPM': '0'})
+    timings['tag_music_file'] = time.perf_counter() - start
+    delete_temp_file(wav_path)
+    return timings
+
+
+def bpm_error(estimated: Optional[float], truth: float) -> Dict:
+    if estimated is None:
+        return {'abs': None, 'octave': False}
+    ratio = estimated / truth
+    octave = any(abs(ratio - r) < 0.03 for r in (0.5, 2.0, 2.0 / 3, 1.5))
+    return {'abs': abs(estimated - truth), 'octave': octave}
+
+
+def summarize_errors(errors: List[Dict]) -> Dict:
+    values = np.array([e['abs'] for e in errors if e['abs'] is not None])
+    return {
+        'detected': int(len(values)),
+        'mean_abs': float(values.mean()) if len(values) else None,
+        'median_abs': float(np.median(values)) if len(values) else None,
+        'within_1bpm': float((values <= 1.0).sum() / len(errors)) if errors else 0.0,
+        'octave_errors': int(sum(e['octave'] for e in errors)),
+    }
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    values = np.array(values) * 1000
+    return {'p50_ms': float(np.percentile(values, 50)), 'p95_ms': float(np.percentile(values, 95)),
+            'mean_ms': float(values.mean())}
+
+
+def run_benchmark(fixtures: List[Dict], params: Optional[Dict] = None, rounds: int = 1) -> Dict:
+    params = params or analysis_params()
+    scratch = tempfile.mkdtemp(prefix="bpm-bench-")
+    stages: Dict[str, List[float]] = {}
+    errors = []
+    try:
+        copies = []
+        for fixture in fixtures:
+            copy = os.path.join(scratch, os.path.basename(fixture['path']))
+            shutil.copy(fixture['path'], copy)
+            copies.append(copy)
+
+        for _ in range(rounds):
+            for copy in copies:
+                for name, seconds in time_stages(copy, os.path.join(scratch, "stage.wav")).items():
+                    stages.setdefault(name, []).append(seconds)
+
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for fixture, copy in zip(fixtures, copies):
+                result = analyze_file(copy, write_tags=True, params=params)
+                stages.setdefault('streaming_end_to_end', []).append(result.seconds)
+                errors.append(bpm_error(result.bpm, fixture['bpm']))
+        elapsed = time.perf_counter() - start
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    return {
+        'fixtures': len(fixtures),
+        'rounds': rounds,
+        'params': params,
+        'files_per_sec': len(fixtures) * rounds / elapsed,
+        'stages': {name: percentiles(values) for name, values in stages.items()},
+        'peak_rss_mb': peak_rss_mb(),
+        'bpm_error': summarize_errors(errors),
+    }
+
+
+def compare_profiles(fixtures: List[Dict], rounds: int = 1) -> Dict[str, Dict]:
+    """
+    Run the streaming path once per analysis profile and measure speed and
+    accuracy, plus how often each profile agrees with the full-rate result.
+    """
+    reports = {}
+    full_bpms = None
+    for name in ANALYSIS_PROFILES:
+        params = profile_params(name)
+        bpms, seconds, errors = [], [], []
+        for _ in range(rounds):
+            for fixture in fixtures:
+                result = analyze_file(fixture['path'], write_tags=False, params=params)
+                bpms.append(result.bpm)
+                seconds.append(result.seconds)
+                errors.append(bpm_error(result.bpm, fixture['bpm']))
+        if full_bpms is None:
+            full_bpms = bpms
+        agree = [a is not None and b is not None and abs(a - b) <= 1.0 for a, b in zip(bpms, full_bpms)]
+        reports[name] = {
+            'samplerate': params['samplerate'],
+            'files_per_sec': len(seconds) / sum(seconds),
+            'latency': percentiles(seconds),
+            'bpm_error': summarize_errors(errors),
+            'agrees_with_full': sum(agree) / len(agree),
+        }
+    full_speed = reports['full']['files_per_sec']
+    for report in reports.values():
+        report['speedup'] = report['files_per_sec'] / full_speed
+    return reports
+
+
+def compare_backends(fixtures: List[Dict], rounds: int = 1, names: Optional[List[str]] = None) -> Dict[str, Dict]:
+    """
+    Run the streaming path once per tempo backend and measure throughput and
+    accuracy against the fixtures; backends that are not installed are skipped.
+    """
+    reports = {}
+    for name in names or sorted(BACKENDS):
+        if not BACKENDS[name].available():
+            reports[name] = {'skipped': 'not installed'}
+            continue
+        params = analysis_params(backend=name)
+        seconds, errors = [], []
+        for _ in range(rounds):
+            for fixture in fixtures:
+                result = analyze_file(fixture['path'], write_tags=False, params=params)
+                seconds.append(result.seconds)
+                errors.append(bpm_error(result.bpm, fixture['bpm']))
+        reports[name] = {
+            'files_per_sec': len(seconds) / sum(seconds),
+            'latency': percentiles(seconds),
+            'bpm_error': summarize_errors(errors),
+        }
+    default_speed = reports.get(DEFAULT_BACKEND, {}).get('files_per_sec')
+    for report in reports.values():
+        if default_speed and 'files_per_sec' in report:
+            report['speedup'] = report['files_per_sec'] / default_speed
+    return reports
+
+
+def print_backends(reports: Dict[str, Dict]):
+    print(f"{'backend':<18}{'files/s':>9}{'speedup':>9}{'p50 ms':>9}{'<=1 BPM':>9}{'octave':>8}{'median':>8}")
+    for name, report in reports.items():
+        if 'skipped' in report:
+            print(f"{name:<18}{report['skipped']:>9}")
+            continue
+        errors = report['bpm_error']
+        median = f"{errors['median_abs']:.2f}" if errors['median_abs'] is not None else "-"
+        print(f"{name:<18}{report['files_per_sec']:>9.2f}{report.get('speedup', 0):>8.2f}x"
+              f"{report['latency']['p50_ms']:>9.1f}{errors['within_1bpm']:>9.0%}{errors['octave_errors']:>8}"
+              f"{median:>8}")
+
+
+def print_profiles(reports: Dict[str, Dict]):
+    print(f"{'profile':<10}{'rate':>8}{'files/s':>9}{'speedup':>9}{'p50 ms':>9}"
+          f"{'<=1 BPM':>9}{'octave':>8}{'= full':>8}")
+    for name, report in reports.items():
+        errors = report['bpm_error']
+        print(f"{name:<10}{report['samplerate']:>8}{report['files_per_sec']:>9.2f}{report['speedup']:>8.2f}x"
+              f"{report['latency']['p50_ms']:>9.1f}{errors['within_1bpm']:>9.0%}{errors['octave_errors']:>8}"
+              f"{report['agrees_with_full']:>8.0%}")
+
+
+def import_times(module: str) -> Dict[str, float]:
+    """Cumulative import time in ms of every module loaded by `import module` in a fresh interpreter."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    times = {}
+    for line in proc.stderr.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            times[fields[2].strip()] = int(fields[1]) / 1000.0
+    return times
+
+
+def measure_startup(rounds: int = 1, modules=STARTUP_MODULES, top: int = 5) -> Dict[str, Dict]:
+    reports = {}
+    for module in modules:
+        runs = [import_times(module) for _ in range(max(rounds, 1))]
+        last = runs[-1]
+        heaviest = sorted(((name, ms) for name, ms in last.items() if name != module and "." not in name),
+                          key=lambda item: item[1], reverse=True)[:top]
+        reports[module] = {
+            'import_ms': float(np.median([run[module] for run in runs])),
+            'heaviest': [[name, round(ms, 1)] for name, ms in heaviest],
+            'loads': [name for name in HEAVY_MODULES if name in last],
+        }
+    return reports
+
+
+def print_startup(reports: Dict[str, Dict]):
+    for module, report in reports.items():
+        print(f"import {module}: {report['import_ms']:.1f} ms (median), "
+              f"loads {', '.join(report['loads']) or 'no heavy modules'}")
+        for name, ms in report['heaviest']:
+            print(f"  {name:<28}{ms:>8.1f} ms")
+
+
+def compare(report: Dict, baseline: Dict, threshold: float = REGRESSION_THRESHOLD) -> List[str]:
+    """Return human-readable regressions of `report` against `baseline`."""
+    regressions = []
+    if report['files_per_sec'] < baseline['files_per_sec'] * (1 - threshold):
+        regressions.append(f"files/sec {baseline['files_per_sec']:.2f} -> {report['files_per_sec']:.2f}")
+    for name, stats in report['stages'].items():
+        old = baseline['stages'].get(name)
+        if old and stats['p50_ms'] > old['p50_ms'] * (1 + threshold):
+            regressions.append(f"{name} p50 {old['p50_ms']:.1f}ms -> {stats['p50_ms']:.1f}ms")
+    old_within, new_within = baseline['bpm_error']['within_1bpm'], report['bpm_error']['within_1bpm']
+    if new_within < old_within - 1e-9:
+        regressions.append(f"accuracy within 1 BPM {old_within:.2%} -> {new_within:.2%}")
+    return regressions
+
+
+def print_report(report: Dict):
+    print(f"{report['fixtures']} fixtures x {report['rounds']} rounds: {report['files_per_sec']:.2f} files/sec")
+    print(f"{'stage':<24}{'p50 ms':>10}{'p95 ms':>10}{'mean ms':>10}")
+    for name, stats in report['stages'].items():
+        print(f"{name:<24}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['mean_ms']:>10.1f}")
+    if report['peak_rss_mb'] is not None:
+        print(f"peak RSS: {report['peak_rss_mb']:.1f} MB")
+    errors = report['bpm_error']
+    print(f"BPM error: detected {errors['detected']}/{report['fixtures'] * report['rounds']}, "
+          f"median {errors['median_abs']}, within 1 BPM {errors['within_1bpm']:.0%}, "
+          f"octave errors {errors['octave_errors']}")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark the BPM pipeline on synthetic fixtures.")
+    parser.add_argument("--fixtures", default=os.path.join(tempfile.gettempdir(), "bpm-tagger-fixtures"),
+                        help="Directory for generated fixtures (reused between runs)")
+    parser.add_argument("--seconds", type=float, default=FIXTURE_SECONDS, help="Length of each fixture")
+    parser.add_argument("--rounds", type=int, default=1, help="Times to run over the fixtures")
+    parser.add_argument("--save", help="Write the report as a JSON baseline")
+    parser.add_argument("--compare", help="Compare against a JSON baseline and exit 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="Relative slowdown tolerated before flagging a regression")
+    parser.add_argument("--profiles", action="store_true",
+                        help="Compare speed and accuracy of the analysis profiles instead")
+    parser.add_argument("--backends", nargs="*", default=None, metavar="BACKEND",
+                        help="Compare speed and accuracy of the tempo backends instead (default: all)")
+    parser.add_argument("--startup", action="store_true",
+                        help="Measure the import time of the GUI and the engine instead (uses --rounds)")
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.startup:
+        reports = measure_startup(args.rounds)
+        print_startup(reports)
+        if args.save:
+            with open(args.save, 'w') as f:
+                json.dump(reports, f, indent=2)
+        return 0
+    fixtures = generate_fixtures(args.fixtures, seconds=args.seconds)
+    if args.profiles:
+        reports = compare_profiles(fixtures, args.rounds)
+        print_profiles(reports)
+        if args.save:
+            with open(args.save, 'w') as f:
+                json.dump(reports, f, indent=2)
+        return 0
+    if args.backends is not None:
+        unknown = [name for name in args.backends if name not in BACKENDS]
+        if unknown:
+            print(f"unknown backends: {', '.join(unknown)}", file=sys.stderr)
+            return 2
+        reports = compare_backends(fixtures, args.rounds, args.backends)
+        print_backends(reports)
+        if args.save:
+            with open(args.save, 'w') as f:
+                json.dump(reports, f, indent=2)
+        return 0
+    report = run_benchmark(fixtures, rounds=args.rounds)
+    print_report(report)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for line in regressions:
+            print(f"REGRESSION: {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+"""
+Persistent analysis cache so re-runs only analyze new or changed files.
+
+Entries live in a SQLite table keyed by path. A file is considered
+unchanged when its size and mtime match (and, when enabled, a content
+hash). Each entry keeps the detected beat times as float32 together with
+the analysis parameters, so a change of the BPM range or confidence
+floor only needs the BPM to be recomputed from the stored beats instead
+of decoding again; a change of the detection settings (decode rate,
+mode, backend, see `analysis.DETECTION_PARAMS`) does decode again. The
+detected key is kept too, since it cannot be recomputed from the beats.
+Entries can carry an audio fingerprint, so a new copy of an analyzed
+track is found by `find` and reuses its beats.
+A read-only cache answers lookups but never records anything, for dry runs.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import numpy as np
+
+from analysis import FileResult
+
+COMMIT_EVERY = 100
+# bump when the table layout changes; older caches are discarded
+SCHEMA_VERSION = 4
+
+
+def default_cache_path() -> str:
+    return os.path.join(os.path.expanduser("~"), ".bpm_tagger", "analysis_cache.sqlite")
+
+
+def content_hash(file_path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@dataclass
+class CacheEntry:
+    path: str
+    size: int
+    mtime_ns: int
+    content_hash: Optional[str]
+    params: Dict
+    status: str
+    bpm: Optional[float]
+    confidence: Optional[float]
+    beats: np.ndarray
+    tagged: bool
+    key: Optional[str] = None
+    key_confidence: Optional[float] = None
+
+
+class AnalysisCache:
+    def __init__(self, db_path: Optional[str] = None, use_content_hash: bool = False,
+                 readonly: bool = False):
+        self.db_path = db_path or default_cache_path()
+        self.use_content_hash = use_content_hash
+        self.readonly = readonly
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self.conn.execute("DROP TABLE IF EXISTS analysis")
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS analysis (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                content_hash TEXT,
+                params TEXT NOT NULL,
+                status TEXT NOT NULL,
+                bpm REAL,
+                confidence REAL,
+                beats BLOB,
+                tagged INTEGER NOT NULL DEFAULT 0,
+                key TEXT,
+                key_confidence REAL,
+                fingerprint TEXT
+            )"""
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS analysis_fingerprint ON analysis (fingerprint)")
+        self.conn.commit()
+        self._uncommitted = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.commit()
+            self.conn.close()
+            self.conn = None
+
+    def lookup(self, path: str) -> Optional[CacheEntry]:
+        """Return the cached entry for `path` if the file is unchanged."""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        row = self.conn.execute(
+            "SELECT size, mtime_ns, content_hash, params, status, bpm, confidence, beats, tagged, "
+            "key, key_confidence FROM analysis WHERE path = ?", (path,)
+        ).fetchone()
+        if row is None:
+            return None
+        size, mtime_ns, digest, params, status, bpm, confidence, beats, tagged, key, key_confidence = row
+        if size != st.st_size:
+            return None
+        if mtime_ns != st.st_mtime_ns:
+            # touched but possibly identical; only a content hash can tell
+            if not (self.use_content_hash and digest and digest == content_hash(path)):
+                return None
+            if not self.readonly:
+                self.conn.execute("UPDATE analysis SET mtime_ns = ? WHERE path = ?", (st.st_mtime_ns, path))
+                self._maybe_commit()
+        return CacheEntry(path, size, st.st_mtime_ns, digest, json.loads(params), status, bpm, confidence,
+                          np.frombuffer(beats or b'', dtype=np.float32), bool(tagged), key, key_confidence)
+
+    def find(self, fingerprint: str, exclude: Optional[str] = None) -> Optional[CacheEntry]:
+        """An entry of another file with the same audio, without checking that file."""
+        row = self.conn.execute(
+            "SELECT path, size, mtime_ns, content_hash, params, status, bpm, confidence, beats, tagged, "
+            "key, key_confidence FROM analysis WHERE fingerprint = ? AND path != ? LIMIT 1",
+            (fingerprint, exclude or "")
+        ).fetchone()
+        if row is None:
+            return None
+        path, size, mtime_ns, digest, params, status, bpm, confidence, beats, tagged, key, key_confidence = row
+        return CacheEntry(path, size, mtime_ns, digest, json.loads(params), status, bpm, confidence,
+                          np.frombuffer(beats or b'', dtype=np.float32), bool(tagged), key, key_confidence)
+
+    def bpm_index(self) -> Dict[str, tuple]:
+        """{path: (status, bpm, confidence)} for every entry, in one query and without stat calls."""
+        return {path: (status, bpm, confidence) for path, status, bpm, confidence
+                in self.conn.execute("SELECT path, status, bpm, confidence FROM analysis")}
+
+    def store(self, result: FileResult, params: Dict, tagged: bool = True, fingerprint: Optional[str] = None):
+        """Record a finished analysis; call after any tag write so the fingerprint is current."""
+        if self.readonly or result.beats is None:
+            return
+        try:
+            st = os.stat(result.path)
+        except OSError:
+            return
+        digest = content_hash(result.path) if self.use_content_hash else None
+        self.conn.execute(
+            "INSERT OR REPLACE INTO analysis "
+            "(path, size, mtime_ns, content_hash, params, status, bpm, confidence, beats, tagged, "
+            "key, key_confidence, fingerprint) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (result.path, st.st_size, st.st_mtime_ns, digest, json.dumps(params, sort_keys=True),
+             result.status, result.bpm, result.confidence,
+             np.asarray(result.beats, dtype=np.float32).tobytes(), int(tagged),
+             result.key, result.key_confidence, fingerprint)
+        )
+        self._maybe_commit()
+
+    def refresh(self, path: str, tagged: bool = False):
+        """
+        Update the stored fingerprint after the file was modified (e.g. a
+        deferred tag write); `tagged` also marks its tags as written.
+        """
+        if self.readonly:
+            return
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        digest = content_hash(path) if self.use_content_hash else None
+        self.conn.execute("UPDATE analysis SET size = ?, mtime_ns = ?, content_hash = ?, "
+                          "tagged = MAX(tagged, ?) WHERE path = ?",
+                          (st.st_size, st.st_mtime_ns, digest, int(tagged), path))
+        self._maybe_commit()
+
+    def settle(self, path: str, bpm: float):
+        """
+        Record a BPM decided elsewhere (e.g. by reconcile.py) that is now in
+        the file's BPM tag, so the next run serves it as a hit instead of
+        analyzing the re-tagged file again and writing its own BPM back.
+        """
+        if self.readonly:
+            return
+        self.refresh(path, tagged=True)
+        self.conn.execute("UPDATE analysis SET status = 'ok', bpm = ? WHERE path = ?", (bpm, path))
+        self._maybe_commit()
+
+    def _maybe_commit(self):
+        self._uncommitted += 1
+        if self._uncommitted >= COMMIT_EVERY:
+            self.conn.commit()
+            self._uncommitted = 0
@@ -0,0 +1,300 @@
+"""
+Headless command line and library API for the BPM tagger.
+
+    python cli.py analyze ~/Music --workers 4 > results.jsonl
+    python cli.py export-beats --output beats.csv
+
+prints one JSON object per file (path, status, bpm, key, beat count, timing,
+seconds of audio analyzed, errors). The same run is available from Python:
+
+    from cli import analyze
+    for record in analyze(["~/Music"], dry_run=True):
+        print(record["bpm"])
+
+With `--journal jobs.sqlite` every file is checkpointed: rerunning the same
+command resumes an interrupted run, and several processes started with the
+same journal share the work. `--dedupe` analyzes each set of files with
+identical audio once and tags every copy; `--duplicates-report` lists them.
+`--max-rss 1G` keeps the process tree (workers and decoders included)
+under a memory budget by starting fewer files at once. `--backend` picks
+the beat tracker (see backends.py), and `--genre-backend jazz=librosa`
+overrides it for files whose GENRE tag matches.
+
+Nothing here imports tkinter, so it runs on servers, in cron and in
+containers without a display.
+"""
+
+import argparse
+import json
+import logging
+import sys
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+
+from analysis import ANALYSIS_MODES, ANALYSIS_PROFILES, WINDOW_COUNT, WINDOW_SECONDS, FileResult, profile_params
+from backends import BACKENDS, DEFAULT_BACKEND, best_backend, parse_genre_rule
+from beatgrid import BeatStore, default_store_path, write_csv
+from cache import AnalysisCache
+from engine import default_workers, iter_batch, iter_journal
+from fingerprint import DuplicateGroups
+from journal import MAX_ATTEMPTS, JobJournal, JournalInUseError
+from memory import MemoryBudget, parse_size
+from key import MIN_KEY_CONFIDENCE
+from metrics import Metrics, profile
+from scanner import AUDIO_EXTENSIONS, DEFAULT_EXCLUDES, scan
+from tagging import BPM_TOLERANCE, TagWriter
+from tempo import MAX_BPM, MIN_BPM, MIN_CONFIDENCE
+
+
+def expand_paths(paths: Iterable[str], extensions: Sequence[str] = AUDIO_EXTENSIONS,
+                 excludes: Sequence[str] = DEFAULT_EXCLUDES,
+                 stop_event: Optional[threading.Event] = None,
+                 dir_excludes: Sequence[str] = ()) -> Iterator[str]:
+    """Expand directories into the audio files they contain, while they are being scanned."""
+    return scan(paths, extensions, excludes, stop_event=stop_event, dir_excludes=dir_excludes)
+
+
+def result_record(result: FileResult) -> Dict:
+    return {
+        'path': result.path,
+        'status': result.status,
+        'bpm': result.bpm,
+        'beat_count': result.beat_count,
+        'confidence': result.confidence,
+        'candidates': result.candidates,
+        'key': result.key,
+        'key_confidence': result.key_confidence,
+        'cached': result.cached,
+        'backend': result.backend,
+        'duplicate_of': result.duplicate_of,
+        'tag_written': result.tag_written,
+        'seconds': round(result.seconds, 4),
+        'audio_seconds': round(result.audio_seconds, 2),
+        'tempo_curve': result.tempo_curve,
+        'error': result.error,
+    }
+
+
+def analyze(paths: Iterable[str], workers: Optional[int] = None, dry_run: bool = False,
+            write_tags: bool = True, batch_tags: bool = False, tolerance: float = BPM_TOLERANCE,
+            cache_path: Optional[str] = None, use_cache: bool = True,
+            stop_event: Optional[threading.Event] = None,
+            tag_writer: Optional[TagWriter] = None, params: Optional[Dict] = None,
+            metrics: Optional[Metrics] = None, extensions: Sequence[str] = AUDIO_EXTENSIONS,
+            excludes: Sequence[str] = DEFAULT_EXCLUDES, journal_path: Optional[str] = None,
+            max_attempts: int = MAX_ATTEMPTS, beat_store_path: Optional[str] = None,
+            duplicates: Optional[DuplicateGroups] = None,
+            budget: Optional[MemoryBudget] = None, dir_excludes: Sequence[str] = ()) -> Iterator[Dict]:
+    """
+    Analyze files and directories and yield one record per file, in order.
+    `dry_run` analyzes without writing tags or updating the cache. With a
+    `journal_path` the run is resumable and failed files are retried, and
+    records come in completion order of the claimed jobs. With a
+    `beat_store_path` the beat grid of every analyzed file is kept. With
+    `duplicates`, copies of the same audio are analyzed once and collected
+    there. A `budget` bounds the memory of the run.
+    """
+    paths = list(paths)
+    write_tags = write_tags and not dry_run
+    tag_writer = tag_writer or TagWriter(tolerance, batch=batch_tags)
+    cache = AnalysisCache(cache_path, readonly=dry_run) if use_cache else None
+    journal = JobJournal(journal_path, max_attempts) if journal_path else None
+    beat_store = BeatStore(beat_store_path) if beat_store_path and not dry_run else None
+    results = None
+    try:
+        found = expand_paths(paths, extensions, excludes, stop_event, dir_excludes)
+        if journal is not None:
+            if journal.begin(paths):
+                logging.info(f"Resuming run: {journal.counts()}")
+            results = iter_journal(journal, found, workers, stop_event, write_tags, params,
+                                   cache=cache, tag_writer=tag_writer, metrics=metrics, beat_store=beat_store,
+                                   duplicates=duplicates, budget=budget)
+        else:
+            results = iter_batch(found, workers, stop_event, write_tags, params,
+                                 cache=cache, tag_writer=tag_writer, metrics=metrics, beat_store=beat_store,
+                                 duplicates=duplicates, budget=budget)
+        for result in results:
+            yield result_record(result)
+    finally:
+        # a caller that stops early leaves the batch suspended; its cleanup
+        # (batch tag flush, cache refresh) needs the stores still open
+        if results is not None:
+            results.close()
+        if beat_store is not None:
+            beat_store.close()
+        if journal is not None:
+            journal.close()
+        if cache is not None:
+            cache.close()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="bpm-tagger", description="Detect and tag the BPM of music files.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    analyze_parser = subparsers.add_parser("analyze", help="Analyze files or directories and print JSON lines")
+    analyze_parser.add_argument("paths", nargs="+", help="Audio files or directories to scan")
+    analyze_parser.add_argument("-j", "--workers", type=int, default=default_workers(),
+                                help="Number of worker processes (default: %(default)s)")
+    analyze_parser.add_argument("--dry-run", action="store_true",
+                                help="Analyze only; do not write tags or update the cache")
+    analyze_parser.add_argument("--no-write-tags", dest="write_tags", action="store_false",
+                                help="Do not write BPM tags to the files")
+    analyze_parser.add_argument("--batch-tags", action="store_true",
+                                help="Write all tags together at the end of the run")
+    analyze_parser.add_argument("--tolerance", type=float, default=BPM_TOLERANCE,
+                                help="Skip the tag write when the stored BPM is within this value")
+    analyze_parser.add_argument("--cache", dest="cache_path", default=None,
+                                help="Path of the analysis cache database")
+    analyze_parser.add_argument("--no-cache", dest="use_cache", action="store_false",
+                                help="Analyze every file, ignoring the cache")
+    analyze_parser.add_argument("--min-bpm", type=float, default=MIN_BPM,
+                                help="Lower end of the BPM range tempos are folded into (default: %(default)s)")
+    analyze_parser.add_argument("--max-bpm", type=float, default=MAX_BPM,
+                                help="Upper end of the BPM range (default: %(default)s)")
+    analyze_parser.add_argument("--min-confidence", type=float, default=MIN_CONFIDENCE,
+                                help="Files below this confidence are flagged instead of tagged (default: %(default)s)")
+    analyze_parser.add_argument("--key", dest="detect_key", action="store_true",
+                                help="Also detect the musical key and write it as KEY together with BPM")
+    analyze_parser.add_argument("--min-key-confidence", type=float, default=MIN_KEY_CONFIDENCE,
+                                help="Keys below this confidence are not written (default: %(default)s)")
+    analyze_parser.add_argument("--extensions", type=lambda value: tuple(value.split(",")),
+                                default=AUDIO_EXTENSIONS,
+                                help="Comma-separated file extensions to scan for (default: %(default)s)")
+    analyze_parser.add_argument("--exclude", dest="excludes", action="append", default=None,
+                                help="Glob of file names to skip; repeatable "
+                                     "(default: the built-in skip list)")
+    analyze_parser.add_argument("--exclude-dir", dest="dir_excludes", action="append", default=[],
+                                help="Glob of directory names whose whole subtree is skipped; repeatable")
+    analyze_parser.add_argument("--analysis-profile", choices=list(ANALYSIS_PROFILES), default='full',
+                                help="Decode rate for beat tracking: full (44.1 kHz), balanced (22.05 kHz) "
+                                     "or fast (11.025 kHz)")
+    analyze_parser.add_argument("--backend", choices=sorted(BACKENDS), default=DEFAULT_BACKEND,
+                                help="Beat tracking backend (default: %(default)s)")
+    analyze_parser.add_argument("--backend-report", default=None, metavar="JSON",
+                                help="Pick the backend from a 'benchmark.py --backends --save' report: the most "
+                                     "accurate one at least --min-speedup times as fast as the default")
+    analyze_parser.add_argument("--min-speedup", type=float, default=0.0,
+                                help="Speed floor for --backend-report, relative to the default backend")
+    analyze_parser.add_argument("--genre-backend", dest="genre_backends", action="append", type=parse_genre_rule,
+                                default=[], metavar="GENRE=BACKEND",
+                                help="Use BACKEND for files whose GENRE tag contains GENRE; repeatable, "
+                                     "the first match wins")
+    analyze_parser.add_argument("--mode", choices=ANALYSIS_MODES, default='full',
+                                help="Decode the whole track, a few windows of it, or until the BPM converges")
+    analyze_parser.add_argument("--window-seconds", type=float, default=WINDOW_SECONDS,
+                                help="Length of each window in 'windows' mode (default: %(default)s)")
+    analyze_parser.add_argument("--windows", type=int, default=WINDOW_COUNT,
+                                help="Number of windows in 'windows' mode (default: %(default)s)")
+    analyze_parser.add_argument("--journal", dest="journal_path", default=None,
+                                help="Checkpoint every file in this job journal so the run can be resumed")
+    analyze_parser.add_argument("--max-attempts", type=int, default=MAX_ATTEMPTS,
+                                help="Attempts per file before a journaled run gives up on it (default: %(default)s)")
+    analyze_parser.add_argument("--beat-store", dest="beat_store_path", nargs="?", const=default_store_path(),
+                                default=None,
+                                help="Keep the beat grid of every analyzed file in this store "
+                                     "(default location when given without a path)")
+    analyze_parser.add_argument("--dedupe", action="store_true",
+                                help="Fingerprint the audio data and analyze identical copies only once")
+    analyze_parser.add_argument("--duplicates-report", dest="duplicates_path", default=None,
+                                help="Write the groups of identical files to this CSV (implies --dedupe)")
+    analyze_parser.add_argument("--max-rss", type=parse_size, default=None, metavar="SIZE",
+                                help="Memory budget for the whole run, e.g. 512M or 2G; fewer files are "
+                                     "analyzed at once while it is exceeded")
+    analyze_parser.add_argument("--metrics", dest="metrics_path", default=None,
+                                help="Write run metrics to this file (Prometheus text for .prom, JSON otherwise)")
+    analyze_parser.add_argument("--profile", dest="profile_path", default=None,
+                                help="Dump cProfile stats of the coordinating process to this file")
+    analyze_parser.add_argument("-v", "--verbose", action="store_true",
+                                help="Log progress and a summary table to stderr")
+
+    export_parser = subparsers.add_parser("export-beats", help="Export stored beat grids as CSV")
+    export_parser.add_argument("--store", dest="beat_store_path", default=default_store_path(),
+                               help="Beat store to read (default: %(default)s)")
+    export_parser.add_argument("--prefix", default=None, help="Only export files whose path starts with this")
+    export_parser.add_argument("-o", "--output", default=None, help="CSV file to write (default: stdout)")
+    export_parser.add_argument("--compact", action="store_true",
+                               help="Reclaim the space of replaced grids before exporting")
+    export_parser.add_argument("-v", "--verbose", action="store_true", help="Log a summary to stderr")
+    return parser
+
+
+def run_analyze(args) -> int:
+    tag_writer = TagWriter(args.tolerance, batch=args.batch_tags)
+    metrics = Metrics()
+    duplicates = DuplicateGroups() if args.dedupe or args.duplicates_path else None
+    budget = MemoryBudget(args.max_rss) if args.max_rss else None
+    # a retried file is reported again; its last record counts
+    statuses = {}
+    if args.backend_report:
+        with open(args.backend_report) as f:
+            args.backend = best_backend(json.load(f), args.min_speedup)
+        logging.info(f"tempo backend: {args.backend}")
+    try:
+        params = profile_params(args.analysis_profile, min_bpm=args.min_bpm, max_bpm=args.max_bpm,
+                                min_confidence=args.min_confidence, mode=args.mode,
+                                window_s=args.window_seconds, windows=args.windows,
+                                detect_key=args.detect_key, min_key_confidence=args.min_key_confidence,
+                                backend=args.backend, genre_backends=args.genre_backends)
+    except ValueError as e:
+        # e.g. a backend whose library is not installed
+        logging.error(str(e))
+        return 2
+    records = analyze(args.paths, args.workers, args.dry_run, args.write_tags, args.batch_tags,
+                      args.tolerance, args.cache_path, args.use_cache, tag_writer=tag_writer,
+                      params=params, metrics=metrics, extensions=args.extensions,
+                      excludes=DEFAULT_EXCLUDES if args.excludes is None else args.excludes,
+                      journal_path=args.journal_path, max_attempts=args.max_attempts,
+                      beat_store_path=args.beat_store_path, duplicates=duplicates, budget=budget,
+                      dir_excludes=args.dir_excludes)
+    with profile(args.profile_path):
+        try:
+            for record in records:
+                statuses[record['path']] = record['status']
+                sys.stdout.write(json.dumps(record) + "\n")
+                sys.stdout.flush()
+        except JournalInUseError as e:
+            logging.error(str(e))
+            return 2
+    stats = tag_writer.stats()
+    logging.info(f"tags {stats['written']} written, {stats['skipped']} already current, {stats['failed']} failed")
+    logging.info("\n" + metrics.summary_table())
+    if budget is not None:
+        logging.info(f"memory: peak {budget.peak / (1 << 20):.0f} MB of {budget.limit / (1 << 20):.0f} MB, "
+                     f"{budget.throttled} submissions held back")
+    if duplicates is not None:
+        summary = duplicates.summary()
+        logging.info(f"duplicates: {summary['copies']} copies in {summary['groups']} groups")
+        if args.duplicates_path:
+            duplicates.write_report(args.duplicates_path)
+    if args.metrics_path:
+        metrics.write(args.metrics_path)
+    return 1 if any(status != 'ok' for status in statuses.values()) else 0
+
+
+def run_export_beats(args) -> int:
+    with BeatStore(args.beat_store_path) as store:
+        if args.compact:
+            logging.info(f"compacted beat store, {store.compact()} bytes freed")
+        if args.output:
+            with open(args.output, 'w', newline='') as out:
+                rows = write_csv(store.grids(args.prefix), out)
+        else:
+            rows = write_csv(store.grids(args.prefix), sys.stdout)
+    logging.info(f"exported {rows} beats")
+    return 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    if args.command == "analyze":
+        return run_analyze(args)
+    if args.command == "export-beats":
+        return run_export_beats(args)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
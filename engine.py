@@ -0,0 +1,342 @@
+"""
+Batch analysis engine that runs the BPM pipeline on a process pool.
+
+Usable without the Tk GUI:
+
+    from engine import iter_batch
+    for result in iter_batch(paths, workers=4):
+        ...
+
+Results come in input order. `run_batch` hands each one to a progress
+callback instead and keeps none, so a large library is never held in
+memory. A `threading.Event` passed as `stop_event` cancels the run
+between files.
+When an `AnalysisCache` is given, unchanged files are answered from the
+cache and only new or modified files are decoded. Tag writes follow the
+`TagWriter` passed in: immediate writes happen in the workers, batch
+writes are queued and flushed once the run ends. A `Metrics` object, if
+given, receives every result and the stage timings. A `BeatStore` keeps
+the beat grid of every analyzed file. With a `JobJournal`
+the run is checkpointed per file, resumable and retries failed files.
+With `DuplicateGroups`, files missing from the cache are fingerprinted
+first, on a few threads that read ahead of submission so the pool is not
+held up by one thread's reads; a copy of audio already being analyzed
+(or in the cache) reuses that analysis and only gets its own tag write. Under a `MemoryBudget` no
+new file is started while the process tree is over budget, and results
+are yielded without their beat arrays once those have been stored.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from analysis import FileResult, analysis_params, analyze_file, apply_cached_beats, same_detection, tag_fields
+from beatgrid import BeatStore
+from cache import AnalysisCache, CacheEntry
+from fingerprint import DuplicateGroups, audio_fingerprint
+from journal import JobJournal
+from memory import MemoryBudget
+from metrics import Metrics
+from tagging import TagWriter
+from tempo import LONG_MIX_SECONDS, tempo_curve
+
+ProgressCallback = Callable[[int, Optional[int], FileResult], None]
+# threads reading files for their fingerprints; reading is I/O bound
+FINGERPRINT_THREADS = 4
+
+
+def default_workers() -> int:
+    return max(1, (os.cpu_count() or 1) - 1)
+
+
+def _init_worker():
+    # Forked workers inherit the parent's handlers (including the Tk text
+    # handler), which must never be touched outside the GUI process.
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    handler = logging.StreamHandler()
+    handler.setLevel(logging.WARNING)
+    root.addHandler(handler)
+
+
+def _completed(result: FileResult) -> Future:
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+def _copy_of(future: Future, path: str, source: Optional[str] = None) -> Future:
+    """The result of `future` re-addressed to `path`, a copy of `source` (default: the analyzed file)."""
+    copy = Future()
+
+    def done(finished: Future):
+        if finished.cancelled():
+            copy.cancel()
+        elif finished.exception() is not None:
+            copy.set_exception(finished.exception())
+        else:
+            result = finished.result()
+            copy.set_result(FileResult(path, result.status, result.bpm, result.beat_count, result.confidence,
+                                       result.error, cached=result.cached, beats=result.beats,
+                                       candidates=result.candidates, key=result.key,
+                                       key_confidence=result.key_confidence, tempo_curve=result.tempo_curve,
+                                       backend=result.backend,
+                                       duplicate_of=source or result.duplicate_of or result.path))
+
+    future.add_done_callback(done)
+    return copy
+
+
+@dataclass
+class _Lookup:
+    """What is known about a path before it is submitted."""
+    entry: Optional[CacheEntry]
+    # (fingerprint, seconds spent reading), for uncached files when looking for copies
+    fingerprint: Optional[Future] = None
+
+
+def _timed_fingerprint(path: str) -> Tuple[Optional[str], float]:
+    start = time.perf_counter()
+    return audio_fingerprint(path), time.perf_counter() - start
+
+
+def _lookup(path: str, cache: Optional[AnalysisCache], duplicates: Optional[DuplicateGroups],
+            readers: Optional[ThreadPoolExecutor] = None) -> _Lookup:
+    entry = cache.lookup(path) if cache is not None else None
+    if entry is not None or duplicates is None:
+        return _Lookup(entry)
+    if readers is not None:
+        return _Lookup(None, readers.submit(_timed_fingerprint, path))
+    return _Lookup(None, _completed(_timed_fingerprint(path)))
+
+
+def _read_ahead(paths: Iterator[str], cache: Optional[AnalysisCache], duplicates: Optional[DuplicateGroups],
+                readers: Optional[ThreadPoolExecutor], ahead: int) -> Iterator[Tuple[str, _Lookup]]:
+    """Each path with its lookup, while the fingerprints of the next `ahead` paths are being read."""
+    queue = deque()
+    for path in paths:
+        queue.append((path, _lookup(path, cache, duplicates, readers)))
+        if len(queue) > ahead:
+            yield queue.popleft()
+    while queue:
+        yield queue.popleft()
+
+
+def _submit(executor: ProcessPoolExecutor, path: str, write_tags: bool, worker_writes: bool,
+            params: Dict, cache: Optional[AnalysisCache], tolerance: float,
+            duplicates: Optional[DuplicateGroups] = None, metrics: Optional[Metrics] = None,
+            lookup: Optional[_Lookup] = None) -> Future:
+    lookup = lookup or _lookup(path, cache, duplicates)
+    entry = lookup.entry
+    fingerprint = None
+    if lookup.fingerprint is not None:
+        fingerprint, seconds = lookup.fingerprint.result()
+        if metrics is not None:
+            metrics.add_time('fingerprint', seconds)
+        if fingerprint is not None:
+            leader = duplicates.leader(fingerprint)
+            if leader is None and cache is not None:
+                entry = cache.find(fingerprint, exclude=path)
+                # beats detected another way are no use to this run
+                if entry is not None and not same_detection(entry.params, params):
+                    entry = None
+                if entry is not None:
+                    duplicates.add(fingerprint, entry.path)
+            duplicates.add(fingerprint, path)
+            if leader is not None:
+                return _copy_of(leader, path)
+    # a copy's entry belongs to another file, so it is never a plain hit
+    # and its tags are written by the parent like any other copy's
+    copy = entry is not None and entry.path != path
+    # the key needs the audio; a cached key only counts if it was decided the same way
+    key_known = entry is not None and all(entry.params.get(name) == params.get(name)
+                                          for name in ('key', 'min_key_confidence'))
+    # other decode rates, windows, trackers or backends find other beats
+    if entry is None or not same_detection(entry.params, params) or (params.get('key') and not key_known):
+        future = executor.submit(analyze_file, path, worker_writes, params, tolerance)
+    elif not copy and entry.params == params and (entry.tagged or not write_tags):
+        curve = None
+        if len(entry.beats) and entry.beats[-1] >= LONG_MIX_SECONDS:
+            curve = tempo_curve(entry.beats, min_bpm=params['min_bpm'], max_bpm=params['max_bpm'])
+        return _completed(FileResult(path, entry.status, entry.bpm, len(entry.beats), entry.confidence,
+                                     cached=True, key=entry.key, key_confidence=entry.key_confidence,
+                                     tempo_curve=curve))
+    else:
+        # file unchanged and its beats detected the same way, but the BPM range
+        # or confidence floor differ (or its tags were never written): reuse them
+        key = (entry.key, entry.key_confidence) if params.get('key') else ()
+        future = executor.submit(apply_cached_beats, path, entry.beats, worker_writes and not copy, params,
+                                 tolerance, *key)
+        if copy:
+            future = _copy_of(future, path, entry.path)
+    if fingerprint is not None:
+        duplicates.lead(fingerprint, future)
+    return future
+
+
+def _keep_grid(beat_store: BeatStore, cache: Optional[AnalysisCache], result: FileResult, params: Dict,
+               fingerprint: Optional[str] = None):
+    beats = result.beats
+    if beats is None and cache is not None and result.path not in beat_store:
+        # plain cache hit analyzed before the store existed; the cache has its beats
+        entry = cache.lookup(result.path)
+        beats = entry.beats if entry is not None else None
+    if beats is not None and len(beats):
+        # cached beats are only reused when found in the same mode, so the run's mode is theirs
+        beat_store.put(result.path, result.bpm, beats, fingerprint, params.get('mode', 'full'))
+
+
+def iter_batch(paths: Iterable[str], workers: Optional[int] = None,
+               stop_event: Optional[threading.Event] = None,
+               write_tags: bool = True, params: Optional[Dict] = None,
+               cache: Optional[AnalysisCache] = None,
+               tag_writer: Optional[TagWriter] = None,
+               metrics: Optional[Metrics] = None,
+               beat_store: Optional[BeatStore] = None,
+               duplicates: Optional[DuplicateGroups] = None,
+               budget: Optional[MemoryBudget] = None) -> Iterator[FileResult]:
+    """Yield one FileResult per path, in input order."""
+    workers = workers or default_workers()
+    params = params or analysis_params()
+    tag_writer = tag_writer or TagWriter()
+    worker_writes = write_tags and not tag_writer.batch
+    # keep a bounded window of in-flight work so cancellation is prompt
+    # and results can be released in order without buffering the batch
+    max_pending = workers * 2
+    pending = deque()
+    readers = ThreadPoolExecutor(FINGERPRINT_THREADS) if duplicates is not None else None
+    paths = _read_ahead(iter(paths), cache, duplicates, readers, max_pending)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        try:
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < max_pending:
+                    if stop_event is not None and stop_event.is_set():
+                        exhausted = True
+                        break
+                    # over the memory budget, let in-flight files finish before starting more
+                    if budget is not None and pending and budget.exceeded():
+                        break
+                    path, lookup = next(paths, (None, None))
+                    if path is None:
+                        exhausted = True
+                        break
+                    pending.append(_submit(executor, path, write_tags, worker_writes, params, cache,
+                                           tag_writer.tolerance, duplicates, metrics, lookup))
+                if not pending:
+                    break
+                if stop_event is not None and stop_event.is_set():
+                    break
+                result = pending.popleft().result()
+                # beats is None for plain cache hits, which need no tag write
+                if result.ok and result.beats is not None:
+                    # copies are never tagged by a worker, the analysis ran for another file
+                    if worker_writes and result.duplicate_of is None:
+                        tag_writer.record(result.tag_written)
+                    elif write_tags:
+                        start = time.perf_counter()
+                        result.tag_written = tag_writer.update(result.path, tag_fields(result))
+                        result.timings['tagging'] = time.perf_counter() - start
+                fingerprint = duplicates.fingerprints.get(result.path) if duplicates is not None else None
+                if cache is not None and result.beats is not None:
+                    # a failed write leaves the file untagged for the next run to retry;
+                    # a queued one only counts once the flush below has written it
+                    tagged = write_tags and not (result.ok and (result.tag_written is None or
+                                                                (tag_writer.batch and result.tag_written)))
+                    cache.store(result, params, tagged=tagged, fingerprint=fingerprint)
+                if beat_store is not None:
+                    _keep_grid(beat_store, cache, result, params, fingerprint)
+                # later copies find a finished analysis in the cache; without one
+                # it is kept for them, unless the memory budget drops its beats
+                if fingerprint is not None and result.duplicate_of is None \
+                        and ((cache is not None and not cache.readonly) or budget is not None):
+                    duplicates.finish(result.path)
+                if metrics is not None:
+                    metrics.record_result(result)
+                if budget is not None:
+                    # stored in the cache and beat store by now; callers holding
+                    # on to every result should not hold every beat too
+                    result.beats = None
+                yield result
+        finally:
+            for future in pending:
+                future.cancel()
+            if readers is not None:
+                readers.shutdown(wait=False, cancel_futures=True)
+            start = time.perf_counter()
+            for path in tag_writer.flush():
+                if cache is not None:
+                    cache.refresh(path, tagged=True)
+            if metrics is not None and tag_writer.batch:
+                metrics.add_time('tag_flush', time.perf_counter() - start)
+            if beat_store is not None:
+                beat_store.flush()
+
+
+def iter_journal(journal: JobJournal, paths: Optional[Iterable[str]] = None,
+                 workers: Optional[int] = None,
+                 stop_event: Optional[threading.Event] = None,
+                 write_tags: bool = True, params: Optional[Dict] = None,
+                 cache: Optional[AnalysisCache] = None,
+                 tag_writer: Optional[TagWriter] = None,
+                 metrics: Optional[Metrics] = None,
+                 beat_store: Optional[BeatStore] = None,
+                 duplicates: Optional[DuplicateGroups] = None,
+                 budget: Optional[MemoryBudget] = None) -> Iterator[FileResult]:
+    """
+    Queue `paths` in the journal and yield results for the jobs this
+    process claims, recording each one. Failed files are retried after
+    their backoff until they run out of attempts or the run is stopped.
+    """
+    stop_event = stop_event or threading.Event()
+    while True:
+        try:
+            for result in iter_batch(journal.jobs(paths), workers, stop_event, write_tags, params,
+                                     cache, tag_writer, metrics, beat_store, duplicates, budget):
+                journal.record(result)
+                yield result
+        finally:
+            # in-flight jobs cancelled by a stop go back to pending
+            journal.release()
+        paths = None
+        wait = journal.next_retry()
+        if wait is None or stop_event.is_set():
+            return
+        if wait > 0:
+            logging.info(f"Retrying failed files in {wait:.0f}s")
+            if stop_event.wait(wait):
+                return
+
+
+def run_batch(paths: Iterable[str], workers: Optional[int] = None,
+              progress_callback: Optional[ProgressCallback] = None,
+              stop_event: Optional[threading.Event] = None,
+              write_tags: bool = True, params: Optional[Dict] = None,
+              cache: Optional[AnalysisCache] = None,
+              tag_writer: Optional[TagWriter] = None,
+              metrics: Optional[Metrics] = None,
+              journal: Optional[JobJournal] = None,
+              beat_store: Optional[BeatStore] = None,
+              duplicates: Optional[DuplicateGroups] = None,
+              budget: Optional[MemoryBudget] = None) -> int:
+    """Stream every result to `progress_callback`; returns how many files were processed."""
+    total = len(paths) if hasattr(paths, '__len__') and journal is None else None
+    done = 0
+    if journal is not None:
+        batch = iter_journal(journal, paths, workers, stop_event, write_tags, params, cache, tag_writer,
+                             metrics, beat_store, duplicates, budget)
+    else:
+        batch = iter_batch(paths, workers, stop_event, write_tags, params, cache, tag_writer, metrics,
+                           beat_store, duplicates, budget)
+    for result in batch:
+        done += 1
+        if progress_callback:
+            progress_callback(done, total, result)
+    return done
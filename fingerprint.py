@@ -0,0 +1,189 @@
+"""
+Content fingerprints of the audio data, ignoring tags, to find copies.
+
+Re-tagged copies of a track differ only in their metadata, so the hash
+covers just the byte range holding the audio: ID3v2 tags at the start
+and ID3v1/APEv2 tags at the end of MP3s are skipped, FLAC metadata blocks
+are skipped, and for WAV and MP4/M4A only the `data` chunk or `mdat`
+atom is hashed. Other formats are hashed whole, so there only
+byte-identical copies match. Reading and hashing is much cheaper than
+decoding, so the engine fingerprints files before analysis and beat
+tracks each group of copies once.
+"""
+
+import csv
+import hashlib
+import os
+import struct
+import threading
+from concurrent.futures import Future
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+CHUNK_SIZE = 1 << 20
+
+
+def _syncsafe(data: bytes) -> int:
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def _skip_id3v2(f: BinaryIO, start: int) -> int:
+    while True:
+        f.seek(start)
+        header = f.read(10)
+        if len(header) < 10 or header[:3] != b'ID3':
+            return start
+        footer = 10 if header[5] & 0x10 else 0
+        start += 10 + _syncsafe(header[6:10]) + footer
+
+
+def _skip_flac_metadata(f: BinaryIO, start: int) -> int:
+    start += 4  # 'fLaC'
+    while True:
+        f.seek(start)
+        header = f.read(4)
+        if len(header) < 4:
+            return start
+        start += 4 + int.from_bytes(header[1:4], 'big')
+        if header[0] & 0x80:  # last metadata block
+            return start
+
+
+def _find_chunk(f: BinaryIO, start: int, end: int, name: bytes, riff: bool) -> Optional[Tuple[int, int]]:
+    """Byte range of the WAV chunk (riff) or MP4 top-level atom called `name`."""
+    position = start
+    while position + 8 <= end:
+        f.seek(position)
+        header = f.read(8)
+        if riff:
+            kind, length = header[:4], struct.unpack('<I', header[4:])[0]
+            body, following = position + 8, position + 8 + length + (length & 1)
+        else:
+            length, kind = struct.unpack('>I', header[:4])[0], header[4:]
+            body = position + 8
+            if length == 1:
+                length = struct.unpack('>Q', f.read(8))[0]
+                body += 8
+            elif length == 0:
+                length = end - position
+            following = position + length
+            length -= body - position
+        if kind == name:
+            return body, min(body + length, end)
+        if following <= position:
+            return None
+        position = following
+    return None
+
+
+def _trailing_tags(f: BinaryIO, start: int, end: int) -> int:
+    """End of the audio once ID3v1 and APEv2 tags at the end of the file are cut off."""
+    while end - start >= 32:
+        f.seek(end - 32)
+        footer = f.read(32)
+        if footer[:8] == b'APETAGEX':
+            size, _, flags = struct.unpack('<III', footer[12:24])
+            end -= size + (32 if flags & 0x80000000 else 0)
+            continue
+        if end - start >= 128:
+            f.seek(end - 128)
+            if f.read(3) == b'TAG':
+                end -= 128
+                continue
+        return end
+    return end
+
+
+def audio_range(f: BinaryIO, size: int) -> Tuple[int, int]:
+    """The `(start, end)` byte offsets of the audio data in an open file."""
+    f.seek(0)
+    head = f.read(12)
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        return _find_chunk(f, 12, size, b'data', riff=True) or (0, size)
+    if head[4:8] == b'ftyp':
+        return _find_chunk(f, 0, size, b'mdat', riff=False) or (0, size)
+    start = _skip_id3v2(f, 0)
+    f.seek(start)
+    if f.read(4) == b'fLaC':
+        start = _skip_flac_metadata(f, start)
+    return start, _trailing_tags(f, start, size)
+
+
+def audio_fingerprint(path: str) -> Optional[str]:
+    """Hash of the audio data of `path`, or None when the file cannot be read."""
+    digest = hashlib.blake2b(digest_size=16)
+    try:
+        with open(path, 'rb') as f:
+            start, end = audio_range(f, os.fstat(f.fileno()).st_size)
+            if end <= start:
+                return None
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                digest.update(chunk)
+                remaining -= len(chunk)
+    except (OSError, struct.error):
+        return None
+    return digest.hexdigest()
+
+
+class DuplicateGroups:
+    """
+    Fingerprints seen during a run, which copy of each is being analyzed,
+    and the groups of copies for the report.
+    """
+
+    def __init__(self):
+        self.paths: Dict[str, List[str]] = {}
+        self.fingerprints: Dict[str, str] = {}
+        self._leaders: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def add(self, fingerprint: str, path: str):
+        with self._lock:
+            self.fingerprints[path] = fingerprint
+            group = self.paths.setdefault(fingerprint, [])
+            if path not in group:
+                group.append(path)
+
+    def leader(self, fingerprint: str) -> Optional[Future]:
+        """The analysis of an earlier copy in this run, if any."""
+        return self._leaders.get(fingerprint)
+
+    def lead(self, fingerprint: str, future: Future):
+        self._leaders.setdefault(fingerprint, future)
+
+    def finish(self, path: str):
+        """
+        Forget the finished analysis of `path`; later copies find it in the
+        cache, which also brings back `path` for their group. Until then a
+        file without copies is dropped, so only groups of copies are kept.
+        """
+        with self._lock:
+            fingerprint = self.fingerprints.get(path)
+            if fingerprint is None:
+                return
+            self._leaders.pop(fingerprint, None)
+            if self.paths.get(fingerprint) == [path]:
+                del self.paths[fingerprint]
+                del self.fingerprints[path]
+
+    def groups(self) -> Dict[str, List[str]]:
+        with self._lock:
+            return {fingerprint: list(paths) for fingerprint, paths in self.paths.items() if len(paths) > 1}
+
+    def summary(self) -> Dict[str, int]:
+        groups = self.groups()
+        return {'groups': len(groups), 'copies': sum(len(paths) - 1 for paths in groups.values())}
+
+    def write_report(self, path: str):
+        """CSV with one row per file in a duplicate group; the first file of a group was analyzed."""
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(("group", "fingerprint", "path", "analyzed"))
+            for number, (fingerprint, paths) in enumerate(sorted(self.groups().items(),
+                                                                 key=lambda item: item[1][0]), 1):
+                for i, file_path in enumerate(paths):
+                    writer.writerow((number, fingerprint, file_path, i == 0))
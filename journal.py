@@ -0,0 +1,242 @@
+"""
+Durable job journal so long runs can be resumed after a crash or close.
+
+Every file of a run is a row in a local SQLite table with a state
+(pending, running, done, failed), an attempt count and the last error.
+Files are claimed one at a time inside an immediate transaction, so
+several processes can work through the same journal without analyzing a
+file twice. Failed files go back to pending with an exponential backoff
+until they run out of attempts. A new run over the same roots resumes
+the unfinished jobs of the previous one instead of starting over. Each
+process using the journal keeps a heartbeat in `runs`; a run over other
+roots is refused while another live process is still working, so the
+journal is only ever cleared once nobody holds work in it.
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import time
+from typing import Dict, Iterable, Iterator, Optional, Sequence
+
+from analysis import FileResult
+
+STATES = ('pending', 'running', 'done', 'failed')
+MAX_ATTEMPTS = 3
+BACKOFF_SECONDS = 5.0
+# claims older than this are considered abandoned by their worker
+LEASE_SECONDS = 600.0
+# statuses worth another try; the rest are final answers about the file
+RETRY_STATUSES = ('error', 'unreadable')
+
+
+def default_journal_path() -> str:
+    return os.path.join(os.path.expanduser("~"), ".bpm_tagger", "jobs.sqlite")
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JournalInUseError(RuntimeError):
+    pass
+
+
+def _process_alive(pid: int) -> bool:
+    if os.name == 'nt':
+        return True  # os.kill would terminate the process; rely on the lease instead
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+class JobJournal:
+    def __init__(self, db_path: Optional[str] = None, max_attempts: int = MAX_ATTEMPTS,
+                 backoff: float = BACKOFF_SECONDS, lease: float = LEASE_SECONDS):
+        self.db_path = db_path or default_journal_path()
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.lease = lease
+        self.worker = worker_id()
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        # autocommit mode; transactions are opened explicitly where needed
+        self.conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                path TEXT PRIMARY KEY,
+                state TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                next_attempt REAL NOT NULL DEFAULT 0,
+                claimed_by TEXT,
+                claimed_at REAL,
+                updated REAL
+            )"""
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, next_attempt)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS runs (worker TEXT PRIMARY KEY, roots TEXT, heartbeat REAL)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.conn is not None:
+            self.release()
+            self.conn.execute("DELETE FROM runs WHERE worker = ?", (self.worker,))
+            self.conn.close()
+            self.conn = None
+
+    def _alive(self, worker: str, heartbeat: float) -> bool:
+        """Whether the run of `worker` may still be going: its process on this host, else its heartbeat."""
+        host, _, pid = worker.rpartition(":")
+        if os.name != 'nt' and host == self.worker.rsplit(":", 1)[0] and pid.isdigit():
+            return _process_alive(int(pid))
+        return heartbeat >= time.time() - self.lease
+
+    def begin(self, roots: Sequence[str]) -> bool:
+        """
+        Start a run over `roots`. Unfinished jobs of an earlier run over the
+        same roots are kept and resumed (returns True); otherwise the
+        journal is cleared. Raises JournalInUseError if another live process
+        is running over other roots.
+        """
+        key = json.dumps(sorted(os.path.abspath(os.path.expanduser(root)) for root in roots))
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            others = [(worker, run_roots) for worker, run_roots, heartbeat
+                      in self.conn.execute("SELECT worker, roots, heartbeat FROM runs WHERE worker != ?",
+                                           (self.worker,)).fetchall()
+                      if self._alive(worker, heartbeat)]
+            self.conn.execute("DELETE FROM runs WHERE worker NOT IN (%s)" % ",".join("?" * (len(others) + 1)),
+                              [self.worker] + [worker for worker, _ in others])
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'roots'").fetchone()
+            if row is not None and row[0] != key and others:
+                # clearing now would pull the queue from under a live run
+                worker, run_roots = others[0]
+                raise JournalInUseError(f"Job journal {self.db_path} is in use by {worker} "
+                                        f"for {', '.join(json.loads(run_roots))}")
+            unfinished = self.conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE state IN ('pending', 'running')").fetchone()[0]
+            resume = row is not None and row[0] == key and (unfinished > 0 or bool(others))
+            if not resume:
+                self.conn.execute("DELETE FROM jobs")
+                self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('roots', ?)", (key,))
+            self.conn.execute("INSERT OR REPLACE INTO runs (worker, roots, heartbeat) VALUES (?, ?, ?)",
+                              (self.worker, key, time.time()))
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        if resume:
+            self.recover()
+        return resume
+
+    def recover(self):
+        """Return jobs claimed by workers that died on this host to pending."""
+        host = self.worker.rsplit(":", 1)[0]
+        owners = [owner for (owner,) in self.conn.execute(
+            "SELECT DISTINCT claimed_by FROM jobs WHERE state = 'running'")]
+        for owner in owners:
+            owner_host, _, pid = (owner or "").rpartition(":")
+            if owner_host == host and pid.isdigit() and not _process_alive(int(pid)):
+                self.conn.execute("UPDATE jobs SET state = 'pending', claimed_by = NULL "
+                                  "WHERE state = 'running' AND claimed_by = ?", (owner,))
+
+    def add(self, paths: Iterable[str]) -> int:
+        """Queue `paths` as pending; paths already in the journal keep their state."""
+        now = time.time()
+        self.conn.execute("BEGIN")
+        cursor = self.conn.executemany("INSERT OR IGNORE INTO jobs (path, updated) VALUES (?, ?)",
+                                       ((path, now) for path in paths))
+        self.conn.execute("COMMIT")
+        return cursor.rowcount
+
+    def claim(self) -> Optional[str]:
+        """Claim the next runnable job for this worker, or return None."""
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute(
+                "SELECT path FROM jobs WHERE (state = 'pending' AND next_attempt <= ?) "
+                "OR (state = 'running' AND claimed_at < ?) ORDER BY rowid LIMIT 1",
+                (now, now - self.lease)
+            ).fetchone()
+            if row is not None:
+                self.conn.execute("UPDATE jobs SET state = 'running', claimed_by = ?, claimed_at = ?, "
+                                  "updated = ? WHERE path = ?", (self.worker, now, now, row[0]))
+            self.conn.execute("UPDATE runs SET heartbeat = ? WHERE worker = ?", (now, self.worker))
+            self.conn.execute("COMMIT")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        return row[0] if row is not None else None
+
+    def jobs(self, paths: Optional[Iterable[str]] = None, chunk: int = 64) -> Iterator[str]:
+        """
+        Queue `paths` as they arrive (e.g. from a running scan) and yield the
+        jobs this worker claims, until nothing is runnable right now.
+        """
+        if paths is not None:
+            buffer = []
+            for path in paths:
+                buffer.append(path)
+                if len(buffer) >= chunk:
+                    self.add(buffer)
+                    buffer = []
+                    claimed = self.claim()
+                    if claimed is not None:
+                        yield claimed
+            self.add(buffer)
+        while True:
+            claimed = self.claim()
+            if claimed is None:
+                return
+            yield claimed
+
+    def record(self, result: FileResult):
+        """Mark a claimed job done, or failed with a backoff before the next attempt."""
+        now = time.time()
+        self.conn.execute("UPDATE runs SET heartbeat = ? WHERE worker = ?", (now, self.worker))
+        if result.status not in RETRY_STATUSES:
+            self.conn.execute("UPDATE jobs SET state = 'done', attempts = attempts + 1, error = NULL, "
+                              "claimed_by = NULL, updated = ? WHERE path = ?", (now, result.path))
+            return
+        row = self.conn.execute("SELECT attempts FROM jobs WHERE path = ?", (result.path,)).fetchone()
+        attempts = (row[0] if row else 0) + 1
+        state = 'pending' if attempts < self.max_attempts else 'failed'
+        next_attempt = now + self.backoff * 2 ** (attempts - 1)
+        self.conn.execute("UPDATE jobs SET state = ?, attempts = ?, error = ?, next_attempt = ?, "
+                          "claimed_by = NULL, updated = ? WHERE path = ?",
+                          (state, attempts, result.error, next_attempt, now, result.path))
+
+    def release(self):
+        """Put jobs claimed by this worker but never recorded back to pending."""
+        self.conn.execute("UPDATE jobs SET state = 'pending', claimed_by = NULL "
+                          "WHERE state = 'running' AND claimed_by = ?", (self.worker,))
+
+    def next_retry(self) -> Optional[float]:
+        """Seconds until the earliest pending job becomes runnable, or None if none are pending."""
+        row = self.conn.execute("SELECT MIN(next_attempt) FROM jobs WHERE state = 'pending'").fetchone()
+        if row[0] is None:
+            return None
+        return max(0.0, row[0] - time.time())
+
+    def counts(self) -> Dict[str, int]:
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(self.conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"))
+        return counts
+
+    def failures(self) -> Dict[str, str]:
+        """Errors of the jobs that ran out of attempts, by path."""
+        return dict(self.conn.execute("SELECT path, error FROM jobs WHERE state = 'failed' ORDER BY path"))
@@ -0,0 +1,108 @@
+"""
+Musical key estimation from the audio decoded for beat tracking.
+
+`ChromaAccumulator` takes the same PCM buffers that are fed to the beat
+tracker and folds the spectrum of non-overlapping frames into a 12-bin
+pitch-class profile (chroma), so the key costs one FFT per ~0.4 s of
+audio on top of the decode that is happening anyway. `estimate_key`
+correlates the chroma with the Krumhansl-Kessler major and minor key
+profiles in all 12 transpositions; the best correlation is the key and
+its correlation coefficient is the confidence.
+
+librosa (in requirements.txt) has chroma features, but they take the
+whole signal at once and pull in numba and scipy, which the workers
+would pay for at startup and the frozen app in size (see the PyInstaller
+excludes in the README); a NumPy FFT over the streamed buffers costs
+neither.
+"""
+
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+PITCH_CLASSES = ('C', 'C#', 'D', 'Eb', 'E', 'F', 'F#', 'G', 'Ab', 'A', 'Bb', 'B')
+# Krumhansl & Kessler (1982) probe-tone ratings, tonic first
+MAJOR_PROFILE = (6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88)
+MINOR_PROFILE = (6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17)
+# roughly C2..C7; below that the frequency resolution cannot separate semitones
+MIN_FREQ = 65.0
+MAX_FREQ = 2100.0
+FRAME_SECONDS = 0.37
+# frames quieter than this (peak magnitude) do not vote
+SILENCE = 1e-3
+MIN_KEY_CONFIDENCE = 0.6
+TOP_CANDIDATES = 3
+
+
+@dataclass
+class KeyEstimate:
+    key: Optional[str] = None
+    confidence: float = 0.0
+    candidates: List[Tuple[str, float]] = field(default_factory=list)
+
+    def is_confident(self, min_confidence: float = MIN_KEY_CONFIDENCE) -> bool:
+        return self.key is not None and self.confidence >= min_confidence
+
+
+def key_name(tonic: int, minor: bool) -> str:
+    """Key in the notation Mixxx and most taggers use, e.g. 'Ab' or 'F#m'."""
+    return PITCH_CLASSES[tonic % 12] + ('m' if minor else '')
+
+
+class ChromaAccumulator:
+    def __init__(self, sample_rate: int):
+        # a power of two close to FRAME_SECONDS: ~2.7 Hz resolution at any rate
+        self.frame = 1 << int(np.round(np.log2(sample_rate * FRAME_SECONDS)))
+        freqs = np.fft.rfftfreq(self.frame, 1.0 / sample_rate)
+        band = (freqs >= MIN_FREQ) & (freqs <= min(MAX_FREQ, sample_rate / 2))
+        self._bins = np.flatnonzero(band)
+        self._classes = np.round(69 + 12 * np.log2(freqs[band] / 440.0)).astype(np.intp) % 12
+        self._window = np.hanning(self.frame).astype(np.float32)
+        self._buffer = np.zeros(self.frame, dtype=np.float32)
+        self._fill = 0
+        self.chroma = np.zeros(12)
+        self.frames = 0
+
+    def add(self, samples: np.ndarray):
+        """Feed the next block of mono samples (any length)."""
+        while len(samples):
+            take = min(len(samples), self.frame - self._fill)
+            self._buffer[self._fill:self._fill + take] = samples[:take]
+            self._fill += take
+            samples = samples[take:]
+            if self._fill == self.frame:
+                self._fill = 0
+                self._accumulate()
+
+    def _accumulate(self):
+        spectrum = np.abs(np.fft.rfft(self._buffer * self._window))[self._bins]
+        peak = spectrum.max() if len(spectrum) else 0.0
+        if peak * 2 / self.frame < SILENCE:
+            return
+        # each frame votes with equal weight, so loud passages do not dominate
+        frame_chroma = np.bincount(self._classes, weights=spectrum / peak, minlength=12)
+        self.chroma += frame_chroma / frame_chroma.sum()
+        self.frames += 1
+
+
+def _profiles() -> np.ndarray:
+    """The 24 key profiles (12 major, then 12 minor), z-normalized."""
+    rows = [np.roll(profile, tonic) for profile in (MAJOR_PROFILE, MINOR_PROFILE) for tonic in range(12)]
+    rows = np.array(rows, dtype=np.float64)
+    return (rows - rows.mean(axis=1, keepdims=True)) / rows.std(axis=1, keepdims=True)
+
+
+KEY_PROFILES = _profiles()
+
+
+def estimate_key(chroma: Optional[np.ndarray], top: int = TOP_CANDIDATES) -> KeyEstimate:
+    if chroma is None:
+        return KeyEstimate()
+    chroma = np.asarray(chroma, dtype=np.float64)
+    if len(chroma) != 12 or chroma.std() == 0:
+        return KeyEstimate()
+    scores = KEY_PROFILES @ ((chroma - chroma.mean()) / chroma.std()) / 12
+    order = np.argsort(scores)[::-1][:top]
+    candidates = [(key_name(i % 12, i >= 12), round(float(scores[i]), 3)) for i in order]
+    return KeyEstimate(candidates[0][0], candidates[0][1], candidates)
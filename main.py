@@ -1,169 +1,133 @@
-import subprocess
-import ffmpeg
-import aubio
-import numpy as np
-import os
-import taglib
+import importlib
+import importlib.util
+import multiprocessing
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-from typing import Dict
-import tempfile
 import logging
+import logging.handlers
+import os
+import queue
+import shutil
 import threading
 
-possible_ffmpeg_paths = ['ffmpeg', 'C:\\ffmpeg\\bin\\ffmpeg.exe']
+# Only the standard library and Tk are imported up front so the window
+# shows at once; the analysis stack (NumPy, aubio, taglib, SQLite stores)
+# is imported in the background while the user picks a directory. Worker
+# processes started with spawn re-import this module, so they stay light too.
+from profiles import ANALYSIS_PROFILES
+
+LOG_POLL_MS = 200
+LOG_BATCH_SIZE = 500
+# the widget keeps the latest lines only; everything goes to the log file
+MAX_LOG_LINES = 5000
+MAX_QUEUED_LINES = 20000
+MAX_LISTED_FAILURES = 200
+DATA_DIR = os.path.join(os.path.expanduser("~"), ".bpm_tagger")
+LOG_FILE = os.path.join(DATA_DIR, "bpm_tagger.log")
+LOG_FILE_BYTES = 5 << 20
+FAILED_FILES = os.path.join(DATA_DIR, "failed_files.txt")
+REQUIRED_MODULES = {'aubio': 'aubio', 'numpy': 'numpy', 'taglib': 'pytaglib'}
+# where analysis.py looks for the ffmpeg executable, checked without importing it
+FFMPEG_FALLBACK = 'C:\\ffmpeg\\bin\\ffmpeg.exe'
 
-for path in possible_ffmpeg_paths:
-    if os.path.isfile(path):
-        ffmpeg_path = path
-        break
+logger = logging.getLogger()
+# set here rather than by the analysis modules, which the preload thread
+# imports while the window may already be logging
+logger.setLevel(logging.DEBUG)
 
 class TextHandler(logging.Handler):
-    def __init__(self, text_widget):
+    """
+    Queue log records from any thread; `drain()` (called from the Tk
+    event loop via root.after) inserts them into the Text widget in one go.
+    Both the queue and the widget are bounded: lines beyond them are only
+    counted here, and the oldest lines are dropped from the widget.
+    """
+
+    def __init__(self, text_widget, max_lines=MAX_LOG_LINES, max_queued=MAX_QUEUED_LINES):
         logging.Handler.__init__(self)
         self.text_widget = text_widget
+        self.max_lines = max_lines
+        self.queue = queue.Queue(max_queued)
+        self.dropped = 0
 
     def emit(self, record):
-        msg = self.format(record)
-        self.text_widget.config(state=tk.NORMAL)
-        self.text_widget.insert(tk.END, msg + '\n')
-        self.text_widget.config(state=tk.DISABLED)
-        self.text_widget.see(tk.END)
-
-
-logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
-
-def get_metadata(file_path) -> tuple:
-    try:
-        with taglib.File(file_path) as f:
-            artist = next(iter(f.tags.get('ARTIST', [])), None)
-            title = next(iter(f.tags.get('TITLE', [])), None)
-            bpm = next(iter(f.tags.get('BPM', [])), None)
-            metadata = f.tags
-        return artist, title, bpm, metadata
-    except Exception as e:
-        log_error(f"Failed to read metadata from {file_path}: {e}")
-        return None, None, None, {}
-
-def tag_music_file(file_path, metadata: Dict):
-    try:
-        metadata = {key.lower(): value for key, value in metadata.items()}
-        with taglib.File(file_path, save_on_exit=True) as f:
-            f.tags = {key.lower(): value for key, value in f.tags.items()}
-            for key, value in metadata.items():
-                if isinstance(value, list):
-                    value = ', '.join(map(str, value))
-                f.tags[key] = [value]
-            f.save()
-    except Exception as e:
-        log_error(f"Failed to tag {file_path}: {e}")
-
-def process_directory(directory):
-    all_files = []
-    skip_files = ['desktop', 'Thumbs', 'order', 'Videos - Shortcut']
-    for root, dirs, files in os.walk(directory):
-        for name in files:
-            if name.lower().endswith(".mp3") and not any(skip_file in name for skip_file in skip_files):
-                full_path = os.path.join(root, name)
-                full_path = os.path.normpath(full_path)  # Normalize the path
-                if ensure_local(full_path):
-                    all_files.append(full_path)
-                else:
-                    log_error(f"File {full_path} is not available locally or cannot be accessed.")
-    return all_files
-
-def ensure_local(file_path):
-    return os.path.exists(file_path) and os.access(file_path, os.R_OK)
-
-
-def convert_mp3_to_wav(mp3_path, wav_path):
-    try:
-        subprocess.run([ffmpeg_path,
-                         "-i", mp3_path, wav_path, "-y"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, creationflags=subprocess.CREATE_NO_WINDOW)
-    except Exception as e:
-        log_error(f"Failed to convert {mp3_path} to WAV: {e}")
-        return False
-    logger.info(f"Converted {mp3_path} to WAV")
-    return True
+        try:
+            self.queue.put_nowait(self.format(record))
+        except queue.Full:
+            # emit runs under the handler lock
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def drain(self, limit=LOG_BATCH_SIZE):
+        lines = []
+        while len(lines) < limit:
+            try:
+                lines.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        if self.dropped:
+            with self.lock:
+                dropped, self.dropped = self.dropped, 0
+            lines.append(f"... {dropped} log lines not shown, see {LOG_FILE}")
+        if lines:
+            self.text_widget.config(state=tk.NORMAL)
+            self.text_widget.insert(tk.END, '\n'.join(lines) + '\n')
+            excess = int(self.text_widget.index('end-1c').split('.')[0]) - self.max_lines
+            if excess > 0:
+                self.text_widget.delete('1.0', f'{excess + 1}.0')
+            self.text_widget.config(state=tk.DISABLED)
+            self.text_widget.see(tk.END)
+
+
+def file_handler():
+    os.makedirs(DATA_DIR, exist_ok=True)
+    handler = logging.handlers.RotatingFileHandler(LOG_FILE, maxBytes=LOG_FILE_BYTES, backupCount=2,
+                                                   encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    return handler
 
-def set_window_and_hop_sizes(sample_rate, task='beat'):
-    if task == 'pitch':
-        win_s = 4096 if sample_rate >= 44100 else 2048
-        hop_s = win_s // 4
-    elif task == 'onset':
-        win_s = 1024 if sample_rate >= 44100 else 512
-        hop_s = win_s // 2
-    elif task == 'beat':
-        win_s = 2048 if sample_rate >= 44100 else 1024
-        hop_s = win_s // 2
-    elif task == 'mfcc':
-        win_s = 4096 if sample_rate >= 44100 else 2048
-        hop_s = win_s // 4
-    else:
-        raise ValueError("Unknown task")
-    return win_s, hop_s
-
-def compute(file_path: str, bpm: float):
-    bpm = round(bpm, 2)
-    _, _, _, metadata = get_metadata(file_path)
-    if metadata:
-        metadata['BPM'] = str(bpm)
-        tag_music_file(file_path, metadata)
-
-def get_temp_file(extension=".wav"):
-    return os.path.join(tempfile.gettempdir(), f"temp{extension}")
-
-def has_permission(file_path):
-    return os.path.exists(file_path) and os.access(file_path, os.R_OK) and os.access(file_path, os.W_OK)
-
-def delete_temp_file(path):
-    try:
-        if os.path.exists(path):
-            os.remove(path)
-    except Exception as e:
-        log_error(f"Failed to delete temporary file {path}: {e}")
-
-def log_error(message):
-    logger.error(message)
 
 def check_dependencies():
-    missing_dependencies = []
-    try:
-        import ffmpeg
-    except ImportError:
-        missing_dependencies.append('ffmpeg-python')
-    try:
-        import aubio
-    except ImportError:
-        missing_dependencies.append('aubio')
-    try:
-        import numpy
-    except ImportError:
-        missing_dependencies.append('numpy')
-    try:
-        import taglib
-    except ImportError:
-        missing_dependencies.append('pytaglib')
+    # find_spec locates a module without importing (and initializing) it
+    missing_dependencies = [package for module, package in REQUIRED_MODULES.items()
+                            if importlib.util.find_spec(module) is None]
+    # files are decoded by the ffmpeg executable, not a Python package
+    if shutil.which('ffmpeg') is None and not os.path.isfile('ffmpeg') and not os.path.isfile(FFMPEG_FALLBACK):
+        missing_dependencies.append('ffmpeg (executable)')
 
     if missing_dependencies:
         missing_str = ", ".join(missing_dependencies)
         messagebox.showerror("Missing Dependencies", f"The following dependencies are missing: {missing_str}")
-        log_error(f"Missing dependencies: {missing_str}")
+        logger.error(f"Missing dependencies: {missing_str}")
         return False
     return True
 
+
+def preload_analysis():
+    importlib.import_module('engine')
+
 class App:
     def __init__(self, root):
         self.root = root
         self.root.title("BPM TAGGER")
 
-        self.label = tk.Label(root, text="Select a directory containing MP3 files:")
+        self.label = tk.Label(root, text="Select a directory containing music files:")
         self.label.pack(pady=10)
 
         self.browse_button = tk.Button(root, text="Browse", command=self.browse_directory)
         self.browse_button.pack(pady=10)
 
+        # beat tracking at a lower sample rate is faster at a small accuracy cost
+        self.profile_var = tk.StringVar(root, value='full')
+        self.profile_frame = tk.Frame(root)
+        self.profile_frame.pack(pady=5)
+        tk.Label(self.profile_frame, text="Analysis profile:").pack(side=tk.LEFT)
+        tk.OptionMenu(self.profile_frame, self.profile_var, *ANALYSIS_PROFILES).pack(side=tk.LEFT)
+        # key detection reuses the decoded audio, so it adds little to a run
+        self.key_var = tk.BooleanVar(root, value=False)
+        tk.Checkbutton(self.profile_frame, text="Detect key", variable=self.key_var).pack(side=tk.LEFT, padx=10)
+
         self.progress = ttk.Progressbar(root, orient="horizontal", length=300, mode="determinate")
         self.progress.pack(pady=20)
 
@@ -185,18 +149,38 @@ class App:
         self.scrollbar.config(command=self.log_text.yview)
 
         self.log_text.insert(tk.END, "Log Output:\n")
-        text_handler = TextHandler(self.log_text)
-        text_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-        logger.addHandler(text_handler)
+        self.text_handler = TextHandler(self.log_text)
+        self.text_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        logger.addHandler(self.text_handler)
+        logger.addHandler(file_handler())
         self.directory = None
         self.failed_files = []
         self.threads = []
         self.stop_events = []
+        # None lets the engine pick one worker per CPU but one
+        self.workers = None
+        self.files_done = 0
+        self.files_found = 0
+        self.files_resumed = 0
+        self.journaled = False
+        self.poll_updates()
+        threading.Thread(target=preload_analysis, daemon=True).start()
+
+    def poll_updates(self):
+        # the worker thread only queues log lines and counts files; the
+        # widgets are updated here, on the Tk thread, a batch at a time
+        self.text_handler.drain()
+        self.progress["maximum"] = max(self.files_found, 1)
+        self.progress["value"] = self.files_done
+        self.root.after(LOG_POLL_MS, self.poll_updates)
 
 
     def browse_directory(self):
         self.directory = filedialog.askdirectory()
         if self.directory:
+            # one run per window: a second one would share this process's journal worker id
+            # and begin() would clear the running one's jobs
+            self.browse_button.config(state=tk.DISABLED)
             self.status_label.config(text="Processing files...")
             stop_event = threading.Event()
             thread = threading.Thread(target=self.process_files_thread, args=(stop_event,))
@@ -205,8 +189,13 @@ class App:
             thread.start()
 
     def process_files_thread(self, stop_event):
-        while not stop_event.is_set():
-            self.process_files()
+        # one pass per selection; the journal takes care of resuming and retries
+        try:
+            self.process_files(stop_event)
+        finally:
+            if not stop_event.is_set():
+                self.root.after(0, lambda: self.browse_button.config(state=tk.NORMAL))
+        if not stop_event.is_set():
             self.root.after(0, self.update_gui_after_processing)
 
     def update_gui_after_processing(self):
@@ -215,107 +204,89 @@ class App:
             messagebox.showwarning("Processing complete with errors", f"Failed to process {len(self.failed_files)} files. Check log for details.")
             self.log_text.config(state=tk.NORMAL)
             failed_files_str = "\n".join(self.failed_files)
+            if getattr(self.failed_files, 'spilled', 0):
+                failed_files_str += f"\n... and {self.failed_files.spilled} more, see {self.failed_files.path}"
             self.log_text.insert(tk.END, f"Failed to process the following files:\n{failed_files_str}\n")
             self.log_text.config(state=tk.DISABLED)
 
-    def process_files(self):
+    def process_files(self, stop_event=None):
+        # already imported by preload_analysis unless a directory was picked very quickly
+        from analysis import profile_params
+        from beatgrid import BeatStore
+        from cache import AnalysisCache
+        from engine import run_batch
+        from fingerprint import DuplicateGroups
+        from journal import JobJournal, JournalInUseError
+        from memory import MemoryBudget, SpillList
+        from metrics import Metrics
+        from scanner import scan
+        from tagging import TagWriter
+
         if self.directory:
-            
-            mp3_paths = process_directory(self.directory)
-            total_files = len(mp3_paths)
-            wav_path = get_temp_file()
-
-            self.progress["maximum"] = total_files
-            self.failed_files = []
-
-            for i, mp3_path in enumerate(mp3_paths):                
-                
-                if not has_permission(mp3_path):
-                    log_error(f"File does not exist or permission denied for file: {mp3_path}")
-                    self.log_text.insert(tk.END, f"File does not exist or permission denied for file: {mp3_path}\n")
-                    self.failed_files.append(mp3_path)
-                    continue
-                
+
+            # bounded in memory, the full list is written to FAILED_FILES
+            self.failed_files = SpillList(FAILED_FILES, MAX_LISTED_FAILURES)
+            self.files_done = 0
+            self.files_resumed = 0
+            self.files_found = 0
+            # analysis starts while the directory is still being scanned
+            paths = self.count_found(scan([self.directory], stop_event=stop_event))
+
+            tag_writer = TagWriter()
+            metrics = Metrics()
+            duplicates = DuplicateGroups()
+            with AnalysisCache() as cache, JobJournal() as journal, BeatStore() as beat_store:
                 try:
-                    logger.info('Converting mp3 to wav')
-                    #  check if file can still be accessed locally
-                    if not ensure_local(mp3_path):
-                        logger.error(f"File {mp3_path} is not available locally or cannot be accessed.")
-                        self.log_text.insert(tk.END, f"File {mp3_path} is not available locally or cannot be accessed.\n")
-                        self.failed_files.append(mp3_path)
-                        continue
-                    #  get the audio file
-                    convert_mp3_to_wav(mp3_paths[i], wav_path)
-                    logger.info('Creating aubio source')
-                    try:
-                        s = aubio.source(wav_path)
-                        sample_rate = s.samplerate
-                    
-                        task = 'beat'
-                        win_s, hop_s = set_window_and_hop_sizes(sample_rate, task)
-                    
-                        logger.info('Creating aubio tempo')
-                        tempo_o = aubio.tempo("default", win_s, hop_s, sample_rate)
-                    
-                        s = aubio.source(wav_path, sample_rate, hop_s)
-                    except Exception as e:
-                        logger.error(f"aubio error processing {mp3_path}: {e}")
-                        self.log_text.insert(tk.END, f"aubio error processing {mp3_path}: {e}\n")
-                        self.failed_files.append(mp3_path)
-                        continue
-
-                    total_frames = 0
-                    beats = []
-                
-                    logger.info('Starting beat detection loop')
-                    while True:
-                        samples, read = s()
-                        if tempo_o(samples):
-                            this_beat = tempo_o.get_last_s()
-                            beats.append(this_beat)
-                        total_frames += read
-                        if read < hop_s:
-                            break
-                
-                    del s  # Delete the aubio.source object to close the file
-                
-                    beats = np.array(beats)
-                
-                    if len(beats) > 1:
-                        logger.info('Calculating BPM')
-                        intervals = np.diff(beats)
-                        bpm = np.median(60.0 / intervals)
-                        compute(mp3_path, bpm)
-                    else:
-                        logger.info('No beats detected')
-                        self.failed_files.append('\\'.join(mp3_path.split('\\')[-2:])) 
-                except ffmpeg.Error as e:
-                    logger.error(f"ffmpeg error processing {mp3_path}: {e}")
-                    self.log_text.insert(tk.END, f"ffmpeg error processing {mp3_path}: {e}\n")
-                    self.failed_files.append('\\'.join(mp3_path.split('\\')[-2:]))
-
-                except Exception as e:
-                    logger.error(f"General error processing {mp3_path}: {e}")
-                    self.log_text.insert(tk.END, f"General error processing {mp3_path}: {e}\n")
-                    self.failed_files.append('\\'.join(mp3_path.split('\\')[-2:]))
-                finally:
-                    logger.info('Deleting temp file')
-                    delete_temp_file(wav_path)
-
-                self.progress["value"] = i + 1
-                self.root.update_idletasks()
-            
-            self.progress["value"] = total_files
-            # set stop event to stop the thread
-            self.status_label.config(text="Processing complete!")
-            self.stop_events[-1].set()
-            if self.failed_files:
-                messagebox.showwarning("Processing complete with errors", f"Failed to process {len(self.failed_files)} files. Check log for details.")
-                self.log_text.config(state=tk.NORMAL)
-                failed_files_str = "\n".join(self.failed_files)
-                self.log_text.insert(tk.END, f"Failed to process the following files:\n{failed_files_str}\n")
-                self.log_text.config(state=tk.DISABLED)
-        self.root.update_idletasks()
+                    if journal.begin([self.directory]):
+                        counts = journal.counts()
+                        logger.info(f"Resuming interrupted run: {counts['done']} files already done, "
+                                    f"{counts['pending'] + counts['running']} left")
+                        self.files_resumed = counts['done']
+                except JournalInUseError as e:
+                    # another window is working through the journal; run without it
+                    logger.error(f"{e}. This run cannot be resumed if interrupted.")
+                    journal.close()
+                    journal = None
+                self.journaled = journal is not None
+                run_batch(paths, workers=self.workers, progress_callback=self.on_file_processed,
+                          stop_event=stop_event, params=profile_params(self.profile_var.get(), detect_key=self.key_var.get()),
+                          cache=cache, tag_writer=tag_writer, metrics=metrics, journal=journal,
+                          beat_store=beat_store, duplicates=duplicates, budget=MemoryBudget.default())
+                # errors are retried by the journal; report the files that never succeeded
+                if journal is not None:
+                    self.failed_files.extend(journal.failures())
+            self.failed_files.close()
+            stats = tag_writer.stats()
+            logger.info(f"Tag writes: {stats['written']} written, {stats['skipped']} already current, {stats['failed']} failed")
+            logger.info("Run summary:\n" + metrics.summary_table())
+            summary = duplicates.summary()
+            if summary['copies']:
+                logger.info(f"Duplicates: {summary['copies']} copies in {summary['groups']} groups were analyzed once per group")
+
+            self.files_done = self.files_found
+
+    def count_found(self, paths):
+        for path in paths:
+            self.files_found += 1
+            yield path
+
+    def on_file_processed(self, done, total, result):
+        self.files_done = self.files_resumed + done
+        if result.ok:
+            logger.info(f"{result.path}: {result.bpm} BPM" + (f", key {result.key}" if result.key else "")
+                        + (f" (copy of {result.duplicate_of})" if result.duplicate_of
+                           else " (cached)" if result.cached else ""))
+        elif result.status == 'no_beats':
+            logger.info(f"No beats detected in {result.path}")
+            self.failed_files.append(result.path)
+        elif result.status == 'low_confidence':
+            logger.warning(f"{result.path}: {result.bpm} BPM has low confidence ({result.confidence}), not tagged")
+            self.failed_files.append(result.path)
+        else:
+            logger.error(f"Error processing {result.path}: {result.error}")
+            # the journal lists the files that failed every retry once the run ends
+            if not self.journaled:
+                self.failed_files.append(result.path)
 
     def on_closing(self):
         # Set all stop events
@@ -330,6 +301,7 @@ class App:
         self.root.destroy()
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # required for process pools in PyInstaller builds
     if check_dependencies():
         root = tk.Tk()
         app = App(root)
@@ -337,4 +309,4 @@ if __name__ == "__main__":
         root.protocol("WM_DELETE_WINDOW", app.on_closing)
         root.mainloop()
     else:
-        log_error("Failed to start application due to missing dependencies.")
+        logger.error("Failed to start application due to missing dependencies.")
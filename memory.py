@@ -0,0 +1,224 @@
+"""
+Memory accounting for the memory-bounded mode.
+
+`MemoryBudget` measures the resident memory of this process and all of
+its descendants (pool workers and the ffmpeg decoders they start), from
+/proc on Linux and through psutil elsewhere when it is installed. The
+descendants are read from /proc/<pid>/task/*/children where the kernel
+has it (CONFIG_PROC_CHILDREN), otherwise from the parent pid of every
+/proc/<pid>/stat. The
+engine checks it before starting another file: while the run is over
+budget, no new file is submitted until in-flight ones finish, so the run
+narrows to fewer concurrent files instead of growing. A file that is
+already running cannot be preempted, which is why the decode streams
+fixed-size buffers and the beat times go into a float32 buffer.
+
+`SpillList` keeps the first entries of a list that can grow with the
+batch (failed files) in memory and writes all of them to a file.
+"""
+
+import logging
+import os
+import re
+import time
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# /proc is read at most this often; submissions in between reuse the reading
+CHECK_INTERVAL = 0.5
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+# share of physical memory the GUI allows a run to use
+DEFAULT_SHARE = 0.5
+SIZE_UNITS = {'': 1 << 20, 'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30}
+
+
+def parse_size(value: str) -> int:
+    """'512M', '2G', '800k' or a plain number of MB, in bytes."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([kmg]?)i?b?\s*", value.lower())
+    if not match:
+        raise ValueError(f"Not a size: {value!r}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
+def _proc_children(pid: int) -> List[int]:
+    children = []
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                children.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return children
+
+
+def _has_children_files(pid: int) -> bool:
+    # the main thread's task id is the pid
+    return os.path.exists(f"/proc/{pid}/task/{pid}/children")
+
+
+def _ppid_children() -> Optional[Dict[int, List[int]]]:
+    """{parent pid: child pids} of every process in /proc, or None when /proc cannot be listed."""
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return None
+    children: Dict[int, List[int]] = {}
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue  # exited in the meantime
+        # the command name in parentheses may contain spaces and ')' itself
+        fields = stat[stat.rfind(')') + 2:].split()
+        try:
+            children.setdefault(int(fields[1]), []).append(int(entry))
+        except (IndexError, ValueError):
+            continue
+    return children
+
+
+def _proc_rss(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def _proc_tree_rss(pid: int, children: Callable[[int], List[int]]) -> int:
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        total += _proc_rss(current)
+        stack.extend(children(current))
+    return total
+
+
+_warned_children = False
+
+
+def tree_rss(pid: Optional[int] = None) -> Optional[int]:
+    """Resident bytes of `pid` (default: this process) and all its descendants, or None if unknown."""
+    global _warned_children
+    pid = pid or os.getpid()
+    proc = os.path.exists(f"/proc/{pid}/statm")
+    if proc:
+        if _has_children_files(pid):
+            return _proc_tree_rss(pid, _proc_children)
+        tree = _ppid_children()
+        if tree is not None:
+            return _proc_tree_rss(pid, lambda parent: tree.get(parent, []))
+    if psutil is not None:
+        try:
+            process = psutil.Process(pid)
+            processes = [process] + process.children(recursive=True)
+        except psutil.Error:
+            return None
+        total = 0
+        for process in processes:
+            try:
+                total += process.memory_info().rss
+            except psutil.Error:
+                pass
+        return total
+    if proc:
+        if not _warned_children:
+            logging.warning("Cannot list child processes on this system (install psutil); "
+                            "the memory budget only counts the main process")
+            _warned_children = True
+        return _proc_rss(pid)
+    return None
+
+
+def physical_memory() -> Optional[int]:
+    try:
+        return os.sysconf('SC_PHYS_PAGES') * PAGE_SIZE
+    except (AttributeError, ValueError, OSError):
+        pass
+    if psutil is not None:
+        return psutil.virtual_memory().total
+    return None
+
+
+class MemoryBudget:
+    def __init__(self, limit: int, interval: float = CHECK_INTERVAL):
+        self.limit = limit
+        self.interval = interval
+        self.peak = 0
+        # times a submission was held back
+        self.throttled = 0
+        self._usage: Optional[int] = None
+        self._checked = float('-inf')
+        if tree_rss() is None:
+            logging.warning("Cannot measure memory use on this system (install psutil); "
+                            "the memory budget is not enforced")
+
+    @classmethod
+    def default(cls) -> Optional['MemoryBudget']:
+        """A budget of DEFAULT_SHARE of physical memory, or None where that is unknown."""
+        total = physical_memory()
+        return cls(int(total * DEFAULT_SHARE)) if total else None
+
+    def usage(self) -> Optional[int]:
+        now = time.monotonic()
+        if now - self._checked >= self.interval:
+            self._usage = tree_rss()
+            self._checked = now
+            if self._usage is not None:
+                self.peak = max(self.peak, self._usage)
+        return self._usage
+
+    def exceeded(self) -> bool:
+        usage = self.usage()
+        if usage is None or usage <= self.limit:
+            return False
+        self.throttled += 1
+        return True
+
+
+class SpillList:
+    """
+    A list that keeps only its first `limit` items in memory and appends
+    every item to `path`; `len()` counts them all.
+    """
+
+    def __init__(self, path: str, limit: int = 1000):
+        self.path = path
+        self.limit = limit
+        self.head: List[str] = []
+        self.count = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # truncated per run, so the file lists this run's items only
+        self._file = open(path, 'w', encoding='utf-8')
+
+    def append(self, item: str):
+        if len(self.head) < self.limit:
+            self.head.append(item)
+        self._file.write(item + "\n")
+        self._file.flush()
+        self.count += 1
+
+    def extend(self, items: Iterable[str]):
+        for item in items:
+            self.append(item)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.head)
+
+    @property
+    def spilled(self) -> int:
+        """Items that are only in the file."""
+        return self.count - len(self.head)
+
+    def close(self):
+        self._file.close()
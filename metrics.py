@@ -0,0 +1,137 @@
+"""
+Timers and counters for batch runs.
+
+The engine feeds every FileResult into a `Metrics` object, which keeps
+per-stage durations (decode, beat tracking, tempo estimate, tagging)
+and counters (files by status, cache hits, tag writes). At the end of a
+run it can print a summary table and write the numbers as JSON or in
+the Prometheus text format. `profile()` wraps a run in cProfile.
+"""
+
+import cProfile
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+import numpy as np
+
+PROMETHEUS_PREFIX = "bpm_tagger"
+
+
+class Metrics:
+    def __init__(self):
+        self.counters: Dict[str, int] = {}
+        self.timers: Dict[str, List[float]] = {}
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def incr(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def add_time(self, name: str, seconds: float):
+        with self._lock:
+            self.timers.setdefault(name, []).append(seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def record_result(self, result):
+        """Count one FileResult and add its stage timings."""
+        self.incr('files')
+        self.incr(f'files_{result.status}')
+        if result.cached:
+            self.incr('cache_hits')
+        if result.duplicate_of:
+            self.incr('duplicates')
+        if result.error:
+            self.incr('failures')
+        if result.tag_written is True:
+            self.incr('tags_written')
+        elif result.tag_written is False:
+            self.incr('tags_skipped')
+        for stage, seconds in result.timings.items():
+            self.add_time(stage, seconds)
+        if result.seconds:
+            self.add_time('file', result.seconds)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            timers = {
+                name: {
+                    'count': len(values),
+                    'total_s': float(np.sum(values)),
+                    'p50_s': float(np.percentile(values, 50)),
+                    'p95_s': float(np.percentile(values, 95)),
+                }
+                for name, values in self.timers.items() if values
+            }
+            counters = dict(self.counters)
+        elapsed = self.elapsed()
+        return {
+            'elapsed_s': elapsed,
+            'files_per_sec': counters.get('files', 0) / elapsed if elapsed else 0.0,
+            'counters': counters,
+            'timers': timers,
+        }
+
+    def summary_table(self) -> str:
+        snap = self.snapshot()
+        lines = [f"{snap['counters'].get('files', 0)} files in {snap['elapsed_s']:.1f}s "
+                 f"({snap['files_per_sec']:.2f} files/sec)",
+                 f"{'stage':<16}{'count':>8}{'total s':>10}{'p50 ms':>10}{'p95 ms':>10}"]
+        for name, stats in sorted(snap['timers'].items()):
+            lines.append(f"{name:<16}{stats['count']:>8}{stats['total_s']:>10.1f}"
+                         f"{stats['p50_s'] * 1000:>10.1f}{stats['p95_s'] * 1000:>10.1f}")
+        lines.append("  ".join(f"{name}={value}" for name, value in sorted(snap['counters'].items())))
+        return "\n".join(lines)
+
+    def to_prometheus(self) -> str:
+        snap = self.snapshot()
+        lines = []
+        for name, value in sorted(snap['counters'].items()):
+            metric = f"{PROMETHEUS_PREFIX}_{name}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        metric = f"{PROMETHEUS_PREFIX}_stage_seconds"
+        lines.append(f"# TYPE {metric} summary")
+        for name, stats in sorted(snap['timers'].items()):
+            lines += [f'{metric}{{stage="{name}",quantile="0.5"}} {stats["p50_s"]:.6f}',
+                      f'{metric}{{stage="{name}",quantile="0.95"}} {stats["p95_s"]:.6f}',
+                      f'{metric}_sum{{stage="{name}"}} {stats["total_s"]:.6f}',
+                      f'{metric}_count{{stage="{name}"}} {stats["count"]}']
+        lines += [f"# TYPE {PROMETHEUS_PREFIX}_run_seconds gauge",
+                  f"{PROMETHEUS_PREFIX}_run_seconds {snap['elapsed_s']:.3f}"]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        """Write metrics to `path`: Prometheus text for .prom/.txt, JSON otherwise."""
+        with open(path, 'w') as f:
+            if path.endswith(('.prom', '.txt')):
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.snapshot(), f, indent=2)
+
+
+@contextmanager
+def profile(path: Optional[str]):
+    """Profile the enclosed block with cProfile and dump the stats to `path` (no-op when None)."""
+    if not path:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
@@ -5,64 +5,54 @@ Then we get the bpm, key from mixxx's database.
 The mixxx database is a sqlite database located at:
 "C:/Users/{username}/AppData/Local/Mixxx/mixxxdb.sqlite"
 
-The tables we are interested in is "Library" and "Track".
-
-The "Library" table contains:
-- id
-- key
-- bpm
-- artist
-- title
-- album
-- genre
-- comment
-
- Algorithm to extract to use:
-
-- from track_locations' Table, fetch first 20 rows
-- for each row, pick location column
-- split the location column text to get the song title from the path and split by "/" to get the artist name
-- use song title and artist name  to find the song in Library table
-- if song is found and response instance is a list or tuple
-  Loop:
-    - loop through the list to see if all are the same
-  Tuple:
-    - if tuple:
-- get the bpm and key from the response
-- use the location column data(file path) to extract the metadata of the song
-- update metadata of the song with the bpm and key
-- save the metadata back to the file.
+The sync reads `library` joined with `track_locations` in primary-key
+order (keyset pagination, only the synced columns) and hands each row
+to a thread pool that writes the tags, so the DB cursor never waits on
+file I/O. Files whose tags already match the library are not saved.
+
+Stored locations are turned into local paths once per row by a
+`PathResolver` (pathmap.py): a prefix-mapping table (--map FROM=TO, WSL
+drives by default) and, with --search-root, an index of the files on disk
+that also finds moved tracks by name and size. The sync reports how many
+tracks were resolved, remapped or missing, and how many only matched a
+file by name (those are logged and left alone).
+
+A local state store remembers what each track was synced with and the
+file's mtime afterwards; later runs only open files whose library values
+or on-disk file changed. Pass --full to resync everything.
+
+--export-beats goes the other way: beat grids kept by the analyzer
+(beatgrid.py) are written into `library.beats` as Mixxx BeatMap or
+BeatGrid blobs; grids from a windowed or converged analysis always go
+as BeatGrid. Tracks with a locked BPM, and (unless --overwrite-beats)
+tracks Mixxx already analyzed, are left alone. Close Mixxx first.
 """
 
 
 import argparse
+import logging
 import os
-import platform
+import sqlite3
 import tkinter as tk
-from tkinter import filedialog, messagebox
+from tkinter import filedialog
 from tkinter import ttk
-from typing import Generator, Dict
-from sqlalchemy import create_engine, Integer, String, Column, ForeignKey, Float
-from sqlalchemy.engine.base import Engine
-from sqlalchemy.orm import sessionmaker, Session, declarative_base, relationship
+from typing import Generator, Dict, Optional, Tuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from sqlalchemy import func, select, update
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import sessionmaker, Session
 from contextlib import contextmanager
 import taglib
 import threading
 
+from beatgrid import MIXXX_BEATGRID, MIXXX_BEATMAP, BeatStore, mixxx_beatgrid, mixxx_beatmap
+from mixxxdb import Library, Track_Locations, get_db_engine, process_path
+from pathmap import PathResolver, parse_mapping
+from tagging import changed_fields
+
 # Global variable to manage thread termination
 terminate_thread = False
 
-def get_db_engine(url: str) -> Engine:
-    return create_engine(url, connect_args={"check_same_thread": False})
-
-def is_wsl() -> bool:
-    return 'microsoft' in platform.uname().release.lower()
-
-def process_path(path: str) -> str:
-    if is_wsl():
-        path = path.replace("\\", "/").replace("C:", "/mnt/c")
-    return path if os.path.isfile(path) else None
-
 @contextmanager
 def get_db() -> Generator[Session, None, None]:
     database: Session = SessionLocal()
@@ -71,31 +61,6 @@ def get_db() -> Generator[Session, None, None]:
     finally:
         database.close()
 
-Base = declarative_base()
-
-class Track_Locations(Base):
-    __tablename__ = "track_locations"
-    id = Column(Integer, primary_key=True)
-    location = Column(String, unique=True)
-    filename = Column(String)
-    directory = Column(String)
-
-    library = relationship("Library", back_populates="track_locations")
-
-class Library(Base):
-    __tablename__ = "library"
-    id = Column(Integer, primary_key=True)
-    artist = Column(String)
-    album = Column(String)
-    genre = Column(String)
-    title = Column(String)
-    year = Column(String)
-    location = Column(Integer, ForeignKey("track_locations.id"))
-    key = Column(String)
-    bpm = Column(Float)
-
-    track_locations = relationship("Track_Locations", back_populates="library")
-
 def get_metadata(file_path: str) -> tuple:
     try:
         with taglib.File(file_path) as f:
@@ -110,16 +75,148 @@ def get_metadata(file_path: str) -> tuple:
     except Exception as e:
         return None, None, None, None, {}
 
-def tag_music_file(file_path: str, metadata: Dict) -> None:
+SYNC_COLUMNS = (Library.id, Track_Locations.location, Track_Locations.filesize, Library.bpm, Library.key,
+                Library.artist, Library.title, Library.album, Library.genre, Library.year)
+
+
+def iter_library_rows(db: Session, page_size: int = 1000) -> Generator[Row, None, None]:
+    """
+    Stream library rows joined with their file location, paging on the
+    primary key (keyset pagination) so every page costs the same.
+    """
+    last_id = 0
+    while not terminate_thread:
+        rows = db.execute(
+            select(*SYNC_COLUMNS)
+            .join(Track_Locations, Library.location == Track_Locations.id)
+            .where(Library.id > last_id)
+            .order_by(Library.id)
+            .limit(page_size)
+        ).all()
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1].id
+
+
+def track_fields(row: Row) -> Dict[str, str]:
+    fields = {
+        "BPM": str(round(float(row.bpm), 2)) if row.bpm else None,
+        "KEY": row.key,
+        "ARTIST": row.artist,
+        "TITLE": row.title,
+        "ALBUMARTIST": row.artist,
+        "GENRE": row.genre,
+        "ALBUM": row.album,
+        "YEAR": row.year,
+    }
+    return {key: str(value) for key, value in fields.items() if value not in (None, "")}
+
+
+# library fields remembered by the sync state; ALBUMARTIST is derived from ARTIST
+STATE_FIELDS = ("BPM", "KEY", "ARTIST", "TITLE", "ALBUM", "GENRE", "YEAR")
+
+
+def default_state_path() -> str:
+    return os.path.join(os.path.expanduser("~"), ".bpm_tagger", "mixxx_sync_state.sqlite")
+
+
+def row_signature(row: Row) -> tuple:
+    fields = track_fields(row)
+    return (row.location,) + tuple(fields.get(key) for key in STATE_FIELDS)
+
+
+class SyncState:
+    """
+    Local record of what the last successful sync wrote for each library id,
+    together with the file's mtime afterwards, so unchanged tracks can be
+    skipped without opening the file.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or default_state_path()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS synced (
+                library_id INTEGER PRIMARY KEY,
+                location TEXT,
+                bpm TEXT,
+                key TEXT,
+                artist TEXT,
+                title TEXT,
+                album TEXT,
+                genre TEXT,
+                year TEXT,
+                mtime_ns INTEGER
+            )"""
+        )
+        self.conn.commit()
+
+    def load(self) -> Dict[int, tuple]:
+        """Return {library_id: (signature, mtime_ns)} for every synced track."""
+        return {
+            row[0]: (tuple(row[1:-1]), row[-1])
+            for row in self.conn.execute(
+                "SELECT library_id, location, bpm, key, artist, title, album, genre, year, mtime_ns FROM synced"
+            )
+        }
+
+    def record(self, entries: list):
+        """Store `(library_id, signature, mtime_ns)` entries."""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO synced VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(library_id,) + signature + (mtime_ns,) for library_id, signature, mtime_ns in entries],
+        )
+        self.conn.commit()
+
+    def clear(self):
+        self.conn.execute("DELETE FROM synced")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def sync_track(row: Row, file_path: str, mtime_ns: Optional[int] = None,
+               previous: tuple = None) -> Tuple[str, Optional[int]]:
+    """
+    Write the library values of one row to its file at `file_path`, whose
+    current mtime (if known from the file index) is `mtime_ns`.
+    Returns the outcome ('written', 'unchanged', 'skipped', 'missing' or
+    'failed') and the file's mtime afterwards. With `previous` state
+    matching the row and the file's mtime, the file is not opened at all.
+    """
+    if previous is not None:
+        signature, synced_mtime_ns = previous
+        if signature == row_signature(row):
+            try:
+                if mtime_ns is None:
+                    mtime_ns = os.stat(file_path).st_mtime_ns
+            except OSError:
+                return "missing", None
+            if mtime_ns == synced_mtime_ns:
+                return "skipped", mtime_ns
     try:
-        with taglib.File(file_path, save_on_exit=True) as f:
-            for key, value in metadata.items():
-                f.tags[key] = value
-            f.save()
+        with taglib.File(file_path) as f:
+            changes = changed_fields(f.tags, track_fields(row))
+            if changes:
+                for key, value in changes.items():
+                    f.tags[key] = [value]
+                f.save()
+        return ("written" if changes else "unchanged"), os.stat(file_path).st_mtime_ns
     except Exception as e:
-        print("Error tagging file:", e)
+        # taglib raises a plain OSError for a missing file as well as for
+        # permissions, read-only media or a file it cannot parse or save
+        if isinstance(e, OSError) and not os.path.exists(file_path):
+            return "missing", None
+        logging.error(f"Failed to tag {file_path}: {e}")
+        return "failed", None
+
 
-def main(database_path: str, progress_var: tk.DoubleVar = None, progress_label: tk.Label = None):
+def main(database_path: str, progress_var: tk.DoubleVar = None, progress_label: tk.Label = None,
+         workers: int = 8, full: bool = False, state_path: str = None,
+         mappings: list = None, search_roots: list = ()) -> Dict[str, int]:
     global terminate_thread
     terminate_thread = False
 
@@ -127,44 +224,130 @@ def main(database_path: str, progress_var: tk.DoubleVar = None, progress_label:
     if not processed_path:
         if progress_label:
             progress_label.config(text="Invalid database path.")
-        return
+        return {}
 
     db_engine = get_db_engine(f"sqlite:///{processed_path}")
     global SessionLocal
     SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
 
-    with get_db() as db:
-        count = 0
-        total = db.query(Library).count()
-        offset = 0
-        limit = 20
-
-        while count < total and not terminate_thread:
-            data = db.query(Library).limit(limit).offset(offset).all()
-            for i in data:
-                file_path = process_path(i.track_locations.location)
-                if not file_path:
-                    continue
+    if progress_label and search_roots:
+        progress_label.config(text="Indexing music folders...")
+    resolver = PathResolver(mappings, search_roots)
+    stats = {"written": 0, "unchanged": 0, "skipped": 0, "missing": 0, "failed": 0}
+    max_pending = workers * 4
+
+    state = SyncState(state_path)
+    if full:
+        state.clear()
+    previous = state.load()
+    synced = []
 
-                _, _, _, _, metadata = get_metadata(file_path)
-                if metadata:
-                    metadata["BPM"] = [str(round(float(i.bpm), 2))]
-                    metadata["KEY"] = [i.key]
-                    metadata["ARTIST"] = [i.artist]
-                    metadata["TITLE"] = [i.title]
-                    metadata["ALBUMARTIST"] = [i.artist]
-                    metadata['GENRE'] = [i.genre]
-                    metadata['ALBUM'] = [i.album]
-                    metadata['YEAR'] = [i.year]
-                    tag_music_file(file_path, metadata)
-            offset += limit
-            count = offset
-            if progress_var:
+    with get_db() as db, ThreadPoolExecutor(max_workers=workers) as executor:
+        total = db.execute(select(func.count()).select_from(Library)).scalar() or 0
+        count = 0
+        pending = {}
+
+        def collect(done):
+            nonlocal count
+            for future in done:
+                row = pending.pop(future)
+                status, mtime_ns = future.result()
+                stats[status] += 1
+                count += 1
+                if status in ("written", "unchanged"):
+                    synced.append((row.id, row_signature(row), mtime_ns))
+            if len(synced) >= 1000:
+                state.record(synced)
+                synced.clear()
+            if progress_var and total:
                 progress_var.set((count / total) * 100)
                 progress_label.config(text=f"Processing... {count} of {total}")
 
-        if progress_label:
-            progress_label.config(text="Done" if not terminate_thread else "Process terminated")
+        # the DB cursor only reads; tagging runs on the pool so SQLite never waits on file I/O
+        for row in iter_library_rows(db):
+            if terminate_thread:
+                break
+            file_path, mtime_ns = resolver.resolve(row.location, row.filesize)
+            if file_path is None:
+                # counted by the resolver as missing or name_only
+                count += 1
+                continue
+            future = executor.submit(sync_track, row, file_path, mtime_ns, previous.get(row.id))
+            pending[future] = row
+            if len(pending) >= max_pending:
+                collect(wait(pending, return_when=FIRST_COMPLETED).done)
+
+        if terminate_thread:
+            for future in list(pending):
+                if future.cancel():
+                    del pending[future]
+        collect(wait(pending).done)
+
+    state.record(synced)
+    state.close()
+    stats["resolved"] = resolver.stats["resolved"]
+    stats["remapped"] = resolver.stats["remapped"]
+    stats["missing"] += resolver.stats["missing"]
+    stats["name_only"] = resolver.stats["name_only"]
+    for location, candidate in resolver.name_only:
+        logging.warning(f"Not syncing {location}: {candidate} has the same name but another size")
+    if progress_label:
+        progress_label.config(text="Done" if not terminate_thread else "Process terminated")
+    return stats
+
+BEAT_COLUMNS = (Library.id, Track_Locations.location, Track_Locations.filesize, Library.samplerate,
+                Library.bpm_lock, Library.beats_version)
+
+
+def export_beat_grids(database_path: str, store_path: str = None, grid_format: str = MIXXX_BEATMAP,
+                      overwrite: bool = False, page_size: int = 1000,
+                      resolver: PathResolver = None) -> Dict[str, int]:
+    """Write stored beat grids into the Mixxx library; returns counts per outcome."""
+    processed_path = process_path(database_path)
+    if not processed_path:
+        return {}
+    db_engine = get_db_engine(f"sqlite:///{processed_path}")
+    resolver = resolver or PathResolver()
+    stats = {"exported": 0, "as_beatgrid": 0, "kept": 0, "locked": 0, "not_analyzed": 0}
+    with Session(db_engine) as db, BeatStore(store_path) as store:
+        last_id = 0
+        while True:
+            rows = db.execute(
+                select(*BEAT_COLUMNS)
+                .join(Track_Locations, Library.location == Track_Locations.id)
+                .where(Library.id > last_id)
+                .order_by(Library.id)
+                .limit(page_size)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            for row in rows:
+                file_path, _ = resolver.resolve(row.location, row.filesize)
+                grid = store.get(file_path) if file_path else None
+                # beats found in a few windows (or the start) of the track leave gaps
+                # a beat map would keep; a constant grid at their BPM spans the track
+                track_format = MIXXX_BEATGRID if grid is not None and grid.partial else grid_format
+                if grid is None or not row.samplerate or (track_format == MIXXX_BEATGRID and grid.bpm is None):
+                    stats["not_analyzed"] += 1
+                    continue
+                if row.bpm_lock:
+                    stats["locked"] += 1
+                    continue
+                if row.beats_version and not overwrite:
+                    stats["kept"] += 1
+                    continue
+                if track_format == MIXXX_BEATGRID:
+                    blob = mixxx_beatgrid(grid, row.samplerate)
+                else:
+                    blob = mixxx_beatmap(grid.beats, row.samplerate)
+                db.execute(update(Library).where(Library.id == row.id)
+                           .values(beats=blob, beats_version=track_format, beats_sub_version=""))
+                stats["exported"] += 1
+                if track_format != grid_format:
+                    stats["as_beatgrid"] += 1
+            db.commit()
+    return stats
 
 def choose_directory():
     root = tk.Tk()
@@ -211,9 +394,29 @@ def run_with_gui():
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process Mixxx DB path.")
     parser.add_argument("database_path", type=str, nargs='?', help="The path to the Mixxx DB file")
+    parser.add_argument("--workers", type=int, default=8, help="Number of threads writing tags")
+    parser.add_argument("--full", action="store_true", help="Resync every track, ignoring the last sync state")
+    parser.add_argument("--state", dest="state_path", default=None, help="Path of the sync state database")
+    parser.add_argument("--map", dest="mappings", action="append", type=parse_mapping, default=[],
+                        metavar="FROM=TO", help="Rewrite library locations starting with FROM to start with TO; "
+                                                "repeatable (WSL drive letters are mapped by default)")
+    parser.add_argument("--search-root", dest="search_roots", action="append", default=[],
+                        help="Index the audio files under this folder once and use it to find moved tracks; "
+                             "repeatable")
+    parser.add_argument("--export-beats", dest="beat_store_path", nargs="?", const="", default=None,
+                        help="Write the analyzer's beat grids into the Mixxx library instead of syncing tags "
+                             "(optionally from this beat store)")
+    parser.add_argument("--beat-format", choices=(MIXXX_BEATMAP, MIXXX_BEATGRID), default=MIXXX_BEATMAP,
+                        help="Export every beat (BeatMap) or a constant grid (BeatGrid)")
+    parser.add_argument("--overwrite-beats", action="store_true",
+                        help="Replace beats Mixxx already detected (locked tracks are never touched)")
     args = parser.parse_args()
 
-    if args.database_path:
-        main(args.database_path)
+    if args.database_path and args.beat_store_path is not None:
+        print(export_beat_grids(args.database_path, args.beat_store_path or None, args.beat_format,
+                                args.overwrite_beats, resolver=PathResolver(args.mappings, args.search_roots)))
+    elif args.database_path:
+        print(main(args.database_path, workers=args.workers, full=args.full, state_path=args.state_path,
+                   mappings=args.mappings, search_roots=args.search_roots))
     else:
         run_with_gui()
@@ -0,0 +1,58 @@
+"""
+The parts of the Mixxx library database the tools here read and write:
+the `library` and `track_locations` tables as SQLAlchemy models, and how
+to open the database file. Kept free of tkinter so reconcile.py and
+other headless tools can import it.
+"""
+
+import os
+
+from sqlalchemy import create_engine, Integer, String, Column, ForeignKey, Float, LargeBinary
+from sqlalchemy.engine.base import Engine
+from sqlalchemy.orm import declarative_base, relationship
+
+from pathmap import is_wsl
+
+
+def get_db_engine(url: str) -> Engine:
+    return create_engine(url, connect_args={"check_same_thread": False})
+
+def to_local_path(path: str, wsl: bool) -> str:
+    if wsl:
+        path = path.replace("\\", "/").replace("C:", "/mnt/c")
+    return path
+
+def process_path(path: str) -> str:
+    path = to_local_path(path, is_wsl())
+    return path if os.path.isfile(path) else None
+
+Base = declarative_base()
+
+class Track_Locations(Base):
+    __tablename__ = "track_locations"
+    id = Column(Integer, primary_key=True)
+    location = Column(String, unique=True)
+    filename = Column(String)
+    directory = Column(String)
+    filesize = Column(Integer)
+
+    library = relationship("Library", back_populates="track_locations")
+
+class Library(Base):
+    __tablename__ = "library"
+    id = Column(Integer, primary_key=True)
+    artist = Column(String)
+    album = Column(String)
+    genre = Column(String)
+    title = Column(String)
+    year = Column(String)
+    location = Column(Integer, ForeignKey("track_locations.id"))
+    key = Column(String)
+    bpm = Column(Float)
+    bpm_lock = Column(Integer)
+    samplerate = Column(Integer)
+    beats = Column(LargeBinary)
+    beats_version = Column(String)
+    beats_sub_version = Column(String)
+
+    track_locations = relationship("Track_Locations", back_populates="library")
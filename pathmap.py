@@ -0,0 +1,126 @@
+"""
+Map track locations stored by another machine (e.g. Mixxx on Windows) to
+local files.
+
+A `PathResolver` is set up once per run. The prefix-mapping table turns
+each stored location into a local path (by default, under WSL,
+`X:/...` becomes `/mnt/x/...`; other drives, network shares or moved
+music roots are added with `--map FROM=TO`). When search roots are
+given, the files under them are indexed once, with their size and mtime,
+so resolving a row is a dict lookup instead of a stat call. Tracks that
+are not where the table says are looked up by basename and size in that
+index, which finds tracks whose folder was moved or renamed. A file
+with the right name but another size may be a different track, so it is
+never used; such tracks are counted as name_only and listed in
+`name_only` for the caller to report. Every other resolution is counted
+as resolved, remapped or missing.
+"""
+
+import logging
+import os
+import platform
+import string
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from scanner import AUDIO_EXTENSIONS, scan
+
+# everything Mixxx can play that the index should know about
+INDEX_EXTENSIONS = AUDIO_EXTENSIONS + ('.aiff', '.aif', '.opus', '.wv', '.mp4', '.m4v', '.caf')
+
+
+def is_wsl() -> bool:
+    return 'microsoft' in platform.uname().release.lower()
+
+
+def default_mappings(wsl: Optional[bool] = None) -> List[Tuple[str, str]]:
+    """Drive letters to their /mnt mount points under WSL, nothing elsewhere."""
+    if wsl is None:
+        wsl = is_wsl()
+    if not wsl:
+        return []
+    return [(f"{letter}:/", f"/mnt/{letter.lower()}/") for letter in string.ascii_uppercase]
+
+
+def parse_mapping(value: str) -> Tuple[str, str]:
+    """'FROM=TO' as given on the command line."""
+    source, sep, target = value.partition("=")
+    if not sep or not source:
+        raise ValueError(f"Path mapping must look like FROM=TO, got {value!r}")
+    return source, target
+
+
+def _slashes(path: str) -> str:
+    return path.replace("\\", "/")
+
+
+class PathResolver:
+    def __init__(self, mappings: Optional[Sequence[Tuple[str, str]]] = None,
+                 search_roots: Iterable[str] = (), wsl: Optional[bool] = None):
+        mappings = list(mappings or []) + default_mappings(wsl)
+        # longest prefix first; stored locations are compared case-insensitively with '/' separators
+        self.mappings = sorted(((_slashes(source).lower(), target) for source, target in mappings),
+                               key=lambda mapping: len(mapping[0]), reverse=True)
+        self.roots = []
+        for root in search_roots:
+            root = os.path.normpath(os.path.abspath(os.path.expanduser(root)))
+            if os.path.isdir(root):
+                self.roots.append(root)
+            else:
+                logging.warning(f"Search root {root} is not a directory, skipping it")
+        self.files: Dict[str, Tuple[int, int]] = {}
+        self.by_name: Dict[str, List[str]] = {}
+        if self.roots:
+            for path, size, mtime_ns in scan(self.roots, INDEX_EXTENSIONS, excludes=(), with_stat=True):
+                self.files[path] = (size, mtime_ns)
+                self.by_name.setdefault(os.path.basename(path).lower(), []).append(path)
+        self.stats = {"resolved": 0, "remapped": 0, "name_only": 0, "missing": 0}
+        # (stored location, indexed file of the same name but another size)
+        self.name_only: List[Tuple[str, str]] = []
+
+    def map(self, location: str) -> str:
+        """The local path the mapping table gives for `location` (it may not exist)."""
+        location = _slashes(location)
+        lowered = location.lower()
+        for source, target in self.mappings:
+            if lowered.startswith(source):
+                location = target + location[len(source):]
+                break
+        return os.path.normpath(location)
+
+    def _indexed(self, path: str) -> bool:
+        return any(path == root or path.startswith(root + os.sep) for root in self.roots)
+
+    def lookup(self, path: str) -> Optional[Tuple[int, int]]:
+        """(size, mtime_ns) of a local file, from the index when it covers `path`."""
+        if self._indexed(path):
+            return self.files.get(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_size, st.st_mtime_ns
+
+    def resolve(self, location: str, size: Optional[int] = None) -> Tuple[Optional[str], Optional[int]]:
+        """
+        Local path and mtime_ns of the track stored at `location`, or
+        (None, None) when it cannot be found. In the fallback a file must
+        have the same name and `size` to count as the moved track.
+        """
+        path = self.map(location)
+        found = self.lookup(path)
+        if found is not None:
+            self.stats["resolved"] += 1
+            return path, found[1]
+        candidates = self.by_name.get(os.path.basename(path).lower(), [])
+        same_size = [candidate for candidate in candidates if self.files[candidate][0] == size]
+        if len(same_size) == 1:
+            self.stats["remapped"] += 1
+            return same_size[0], self.files[same_size[0]][1]
+        if not same_size and len(candidates) == 1:
+            # maybe the track with its tags rewritten, maybe an unrelated file
+            # that shares the name; writing to it could clobber another track
+            self.stats["name_only"] += 1
+            self.name_only.append((location, candidates[0]))
+            return None, None
+        self.stats["missing"] += 1
+        return None, None
@@ -0,0 +1,14 @@
+"""
+Analysis profiles: the decode rate used for beat tracking.
+
+Kept apart from analysis.py, which pulls in NumPy, aubio and taglib, so
+the GUI can build its profile menu before any of those are loaded.
+"""
+
+# decode rates for each analysis profile; beat tracking does not need full
+# bandwidth, and lower rates mean proportionally less decode and FFT work
+ANALYSIS_PROFILES = {
+    'full': 44100,
+    'balanced': 22050,
+    'fast': 11025,
+}
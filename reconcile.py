@@ -0,0 +1,281 @@
+"""
+Reconcile the BPM found by the analyzer with the BPM in the Mixxx library.
+
+    python reconcile.py /path/to/mixxxdb.sqlite --report disagreements.csv
+    python reconcile.py /path/to/mixxxdb.sqlite --policy confidence --apply
+
+The Mixxx side is read with a single query (`library` joined with
+`track_locations`); the analyzer side is the analysis cache, loaded in one
+query into a dict keyed by path, optionally falling back to the files'
+BPM tags. Each track is classified as agreeing, half/double (or 3:2)
+tempo, another disagreement, or known to only one side.
+
+A priority policy decides who wins a disagreement:
+
+- `mixxx`: the Mixxx value always wins
+- `aubio`: the analyzer wins unless the track's BPM is locked in Mixxx
+- `confidence` (default): locked tracks keep Mixxx's value; an octave
+  disagreement goes to whichever value lies in the BPM range; otherwise
+  the analyzer wins when its confidence is high enough
+
+Tracks the policy cannot settle are re-analyzed (only those) and decided
+again with the fresh result; what is still open is left for review. With
+--apply the winner is written to the loser: the file's BPM tag when Mixxx
+wins, `library.bpm` (plus a constant beat grid when the beat store has
+the track) when the analyzer wins. Close Mixxx before applying.
+
+Tracks only Mixxx has a BPM for are not disagreements and are kept as
+they are; --push-mixxx-only writes their Mixxx BPM into the files too.
+"""
+
+import argparse
+import csv
+import logging
+import os
+import sys
+from dataclasses import asdict, dataclass
+from typing import Dict, Iterator, List, Optional
+
+import taglib
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from analysis import analysis_params
+from beatgrid import MIXXX_BEATGRID, BeatGrid, BeatStore, default_store_path, mixxx_beatgrid
+from cache import AnalysisCache
+from engine import iter_batch
+from mixxxdb import Library, Track_Locations, get_db_engine, process_path
+from pathmap import PathResolver, parse_mapping
+from tagging import TagWriter
+from tempo import MAX_BPM, MIN_BPM, MIN_CONFIDENCE, SAME_TEMPO, tempo_relation
+
+POLICIES = ('mixxx', 'aubio', 'confidence')
+# analyzer confidence needed to overrule Mixxx on a non-octave disagreement
+STRONG_CONFIDENCE = 0.5
+
+
+@dataclass
+class TrackBpm:
+    library_id: int
+    path: str
+    mixxx_bpm: Optional[float]
+    locked: bool
+    samplerate: Optional[int]
+    aubio_bpm: Optional[float] = None
+    confidence: Optional[float] = None
+    # 'same', 'double', 'half', 'three_halves', 'two_thirds', 'other', 'mixxx_only', 'aubio_only', 'neither'
+    relation: str = 'neither'
+    # 'agree', 'keep' (left alone), 'mixxx', 'aubio', 'reanalyze' or 'review'
+    decision: str = 'agree'
+    reanalyzed: bool = False
+
+
+def read_bpm_tag(path: str) -> Optional[float]:
+    try:
+        with taglib.File(path) as f:
+            return float(next(iter(f.tags.get('BPM', [])), None))
+    except Exception:
+        return None
+
+
+def load_tracks(db: Session, resolver: PathResolver) -> Iterator[TrackBpm]:
+    """Every library track with its local path, in one query."""
+    rows = db.execute(
+        select(Library.id, Track_Locations.location, Track_Locations.filesize, Library.bpm, Library.bpm_lock,
+               Library.samplerate)
+        .join(Track_Locations, Library.location == Track_Locations.id)
+        .order_by(Library.id)
+    )
+    for row in rows:
+        path, _ = resolver.resolve(row.location, row.filesize)
+        yield TrackBpm(row.id, path or resolver.map(row.location), row.bpm or None, bool(row.bpm_lock),
+                       row.samplerate)
+
+
+def classify(track: TrackBpm, tolerance: float = SAME_TEMPO) -> str:
+    if track.mixxx_bpm and track.aubio_bpm:
+        return tempo_relation(track.mixxx_bpm, track.aubio_bpm, tolerance)
+    if track.mixxx_bpm:
+        return 'mixxx_only'
+    return 'aubio_only' if track.aubio_bpm else 'neither'
+
+
+def decide(track: TrackBpm, policy: str, min_bpm: float = MIN_BPM, max_bpm: float = MAX_BPM,
+           strong: float = STRONG_CONFIDENCE, push_mixxx_only: bool = False) -> str:
+    """
+    Who wins `track`'s disagreement under `policy`: 'mixxx', 'aubio',
+    'reanalyze', or 'agree'/'keep' when there is nothing to settle.
+    """
+    if track.relation in ('same', 'aubio_only', 'neither'):
+        return 'agree'
+    if track.relation == 'mixxx_only':
+        # the analyzer never saw the file; only write to it when asked to
+        return 'mixxx' if push_mixxx_only else 'keep'
+    if policy == 'mixxx' or track.locked:
+        return 'mixxx'
+    if policy == 'aubio':
+        return 'aubio'
+    mixxx_in_range = min_bpm <= track.mixxx_bpm <= max_bpm
+    aubio_in_range = min_bpm <= track.aubio_bpm <= max_bpm
+    if track.relation != 'other' and mixxx_in_range != aubio_in_range:
+        return 'mixxx' if mixxx_in_range else 'aubio'
+    if track.confidence is not None and track.confidence >= strong:
+        return 'aubio'
+    return 'reanalyze'
+
+
+def reconcile(database_path: str, policy: str = 'confidence', cache_path: Optional[str] = None,
+              use_tags: bool = False, reanalyze: bool = True, workers: Optional[int] = None,
+              min_bpm: float = MIN_BPM, max_bpm: float = MAX_BPM,
+              tolerance: float = SAME_TEMPO, resolver: Optional[PathResolver] = None,
+              push_mixxx_only: bool = False) -> List[TrackBpm]:
+    """Classify every library track and decide each disagreement; nothing is written."""
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown policy {policy!r}")
+    processed_path = process_path(database_path)
+    if not processed_path:
+        raise FileNotFoundError(database_path)
+    with AnalysisCache(cache_path, readonly=True) as cache:
+        index = cache.bpm_index()
+    with Session(get_db_engine(f"sqlite:///{processed_path}")) as db:
+        tracks = list(load_tracks(db, resolver or PathResolver()))
+
+    for track in tracks:
+        status, bpm, confidence = index.get(track.path, (None, None, None))
+        if bpm is not None and status in ('ok', 'low_confidence'):
+            track.aubio_bpm, track.confidence = bpm, confidence
+        elif use_tags:
+            track.aubio_bpm = read_bpm_tag(track.path)
+        track.relation = classify(track, tolerance)
+        track.decision = decide(track, policy, min_bpm, max_bpm, push_mixxx_only=push_mixxx_only)
+
+    pending = {track.path: track for track in tracks if track.decision == 'reanalyze'}
+    if pending and reanalyze:
+        logging.info(f"re-analyzing {len(pending)} disputed files")
+        # a fresh full-length analysis, so a cached windowed or low-rate result is not reused
+        params = analysis_params(min_bpm=min_bpm, max_bpm=max_bpm)
+        for result in iter_batch(list(pending), workers, write_tags=False, params=params):
+            track = pending[result.path]
+            track.reanalyzed = True
+            if result.bpm is not None:
+                track.aubio_bpm, track.confidence = result.bpm, result.confidence
+                track.relation = classify(track, tolerance)
+                # a full-length analysis is trusted at the analyzer's usual threshold
+                track.decision = decide(track, policy, min_bpm, max_bpm, strong=MIN_CONFIDENCE)
+    for track in tracks:
+        if track.decision == 'reanalyze':
+            track.decision = 'review'
+    return tracks
+
+
+def apply(database_path: str, tracks: List[TrackBpm], beat_store_path: Optional[str] = None,
+          cache_path: Optional[str] = None) -> Dict[str, int]:
+    """
+    Write each winner's BPM to the losing side. A file tagged with Mixxx's
+    BPM gets it in its analysis cache entry too, or the next analysis run
+    would find the file changed and tag it with the analyzer's BPM again.
+    """
+    stats = {'tags_written': 0, 'tags_current': 0, 'tags_failed': 0, 'files_missing': 0,
+             'mixxx_updated': 0, 'grids_written': 0}
+    tag_writer = TagWriter()
+    with AnalysisCache(cache_path) as cache:
+        for track in tracks:
+            if track.decision == 'mixxx' and track.mixxx_bpm:
+                if not os.path.isfile(track.path):
+                    stats['files_missing'] += 1
+                    continue
+                written = tag_writer.update_bpm(track.path, track.mixxx_bpm)
+                stats['tags_written' if written else 'tags_current' if written is False else 'tags_failed'] += 1
+                if written is not None:
+                    cache.settle(track.path, track.mixxx_bpm)
+
+    winners = [track for track in tracks if track.decision == 'aubio' and not track.locked]
+    if not winners:
+        return stats
+    store = BeatStore(beat_store_path) if beat_store_path is not None else None
+    try:
+        with Session(get_db_engine(f"sqlite:///{process_path(database_path)}")) as db:
+            for track in winners:
+                values = {'bpm': track.aubio_bpm}
+                grid = store.get(track.path) if store is not None else None
+                if grid is not None and track.samplerate:
+                    grid = BeatGrid(track.path, track.aubio_bpm, grid.first_beat, grid.beats)
+                    values.update(beats=mixxx_beatgrid(grid, track.samplerate), beats_version=MIXXX_BEATGRID,
+                                  beats_sub_version="")
+                    stats['grids_written'] += 1
+                db.execute(update(Library).where(Library.id == track.library_id).values(**values))
+                stats['mixxx_updated'] += 1
+            db.commit()
+    finally:
+        if store is not None:
+            store.close()
+    return stats
+
+
+def summarize(tracks: List[TrackBpm]) -> Dict[str, Dict[str, int]]:
+    relations, decisions = {}, {}
+    for track in tracks:
+        relations[track.relation] = relations.get(track.relation, 0) + 1
+        decisions[track.decision] = decisions.get(track.decision, 0) + 1
+    return {'tracks': len(tracks), 'relations': relations, 'decisions': decisions,
+            'reanalyzed': sum(track.reanalyzed for track in tracks)}
+
+
+def write_report(tracks: List[TrackBpm], path: str):
+    """CSV of every track whose two BPMs do not agree."""
+    fields = list(TrackBpm.__dataclass_fields__)
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for track in tracks:
+            if track.decision not in ('agree', 'keep'):
+                writer.writerow(asdict(track))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Compare analyzer and Mixxx BPMs and settle disagreements.")
+    parser.add_argument("database_path", help="The path to the Mixxx DB file")
+    parser.add_argument("--policy", choices=POLICIES, default='confidence',
+                        help="Who wins a disagreement (default: %(default)s)")
+    parser.add_argument("--cache", dest="cache_path", default=None, help="Path of the analysis cache database")
+    parser.add_argument("--tags", dest="use_tags", action="store_true",
+                        help="Use the file's BPM tag for tracks missing from the analysis cache")
+    parser.add_argument("--no-reanalyze", dest="reanalyze", action="store_false",
+                        help="Leave undecided tracks for review instead of re-analyzing them")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Worker processes for re-analysis")
+    parser.add_argument("--min-bpm", type=float, default=MIN_BPM)
+    parser.add_argument("--max-bpm", type=float, default=MAX_BPM)
+    parser.add_argument("--tolerance", type=float, default=SAME_TEMPO,
+                        help="BPM difference still counted as agreement (default: %(default)s)")
+    parser.add_argument("--map", dest="mappings", action="append", type=parse_mapping, default=[],
+                        metavar="FROM=TO", help="Rewrite library locations starting with FROM to start with TO")
+    parser.add_argument("--search-root", dest="search_roots", action="append", default=[],
+                        help="Index the audio files under this folder to find moved tracks")
+    parser.add_argument("--report", default=None, help="Write the disagreements to this CSV file")
+    parser.add_argument("--apply", action="store_true", help="Write the winning BPMs (close Mixxx first)")
+    parser.add_argument("--push-mixxx-only", action="store_true",
+                        help="Also decide for Mixxx on tracks the analyzer has no BPM for, so --apply "
+                             "writes their Mixxx BPM into the files")
+    parser.add_argument("--beat-store", dest="beat_store_path", nargs="?", const=default_store_path(), default=None,
+                        help="Also write the analyzer's beat grid to Mixxx when the analyzer wins")
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(stream=sys.stderr, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    resolver = PathResolver(args.mappings, args.search_roots)
+    tracks = reconcile(args.database_path, args.policy, args.cache_path, args.use_tags, args.reanalyze,
+                       args.workers, args.min_bpm, args.max_bpm, args.tolerance, resolver,
+                       args.push_mixxx_only)
+    logging.info(f"paths: {resolver.stats}")
+    print(summarize(tracks))
+    if args.report:
+        write_report(tracks, args.report)
+    if args.apply:
+        print(apply(args.database_path, tracks, args.beat_store_path, args.cache_path))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
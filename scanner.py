@@ -0,0 +1,102 @@
+"""
+Streaming directory scanner for audio libraries.
+
+Directories are listed with `os.scandir` on a thread pool, so several
+subtrees of a (network) library are walked at once, and matching files
+are yielded as soon as their directory has been listed. Callers can
+start analyzing while the scan is still running. Per-file permission
+checks are left to the analysis step, which has to open the file anyway.
+Paths are yielded absolute, so the cache, journal and beat store key a
+file the same way whatever the working directory.
+"""
+
+import fnmatch
+import logging
+import os
+import re
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterable, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger()
+
+AUDIO_EXTENSIONS = ('.mp3', '.flac', '.m4a', '.wav', '.ogg')
+# the file names process_directory always skipped, as globs; like there,
+# they apply to files only, so a folder called 'Border Songs' is still walked
+DEFAULT_EXCLUDES = ('*desktop*', '*Thumbs*', '*order*', '*Videos - Shortcut*')
+SCAN_WORKERS = 8
+
+
+def compile_excludes(excludes: Sequence[str]) -> Optional[re.Pattern]:
+    if not excludes:
+        return None
+    return re.compile("|".join(fnmatch.translate(pattern) for pattern in excludes))
+
+
+def _scan_dir(path: str, extensions: Tuple[str, ...], excluded: Optional[re.Pattern],
+              excluded_dirs: Optional[re.Pattern] = None, with_stat: bool = False) -> Tuple[List, List[str]]:
+    files, subdirs = [], []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if excluded_dirs is None or not excluded_dirs.match(entry.name):
+                            subdirs.append(entry.path)
+                    elif excluded is not None and excluded.match(entry.name):
+                        continue
+                    elif entry.name.lower().endswith(extensions) and entry.is_file():
+                        if with_stat:
+                            # free on Windows, where scandir already has it
+                            st = entry.stat()
+                            files.append((os.path.normpath(entry.path), st.st_size, st.st_mtime_ns))
+                        else:
+                            files.append(os.path.normpath(entry.path))
+                except OSError:
+                    continue
+    except OSError as e:
+        logger.error(f"Cannot scan {path}: {e}")
+    files.sort()
+    return files, subdirs
+
+
+def scan(roots: Iterable[str], extensions: Sequence[str] = AUDIO_EXTENSIONS,
+         excludes: Sequence[str] = DEFAULT_EXCLUDES, workers: int = SCAN_WORKERS,
+         stop_event: Optional[threading.Event] = None, with_stat: bool = False,
+         dir_excludes: Sequence[str] = ()) -> Iterator:
+    """
+    Yield audio files under `roots` while the walk is still in progress.
+    Files given directly in `roots` are yielded as they are. `excludes`
+    are globs of file names to skip, `dir_excludes` of directory names
+    whose whole subtree is skipped. Setting
+    `stop_event` stops the walk. With `with_stat`, `(path, size, mtime_ns)`
+    tuples are yielded instead of paths.
+    """
+    extensions = tuple(extension.lower() for extension in extensions)
+    excluded = compile_excludes(excludes)
+    excluded_dirs = compile_excludes(dir_excludes)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        try:
+            for root in roots:
+                root = os.path.abspath(os.path.expanduser(root))
+                if os.path.isdir(root):
+                    pending.add(pool.submit(_scan_dir, root, extensions, excluded, excluded_dirs, with_stat))
+                elif with_stat:
+                    st = os.stat(root)
+                    yield root, st.st_size, st.st_mtime_ns
+                else:
+                    yield root
+            while pending:
+                if stop_event is not None and stop_event.is_set():
+                    return
+                done, pending = wait(pending, timeout=0.5, return_when=FIRST_COMPLETED)
+                for future in done:
+                    files, subdirs = future.result()
+                    for subdir in subdirs:
+                        pending.add(pool.submit(_scan_dir, subdir, extensions, excluded, excluded_dirs,
+                                                with_stat))
+                    yield from files
+        finally:
+            for future in pending:
+                future.cancel()
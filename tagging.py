@@ -0,0 +1,120 @@
+"""
+Tag writing that only touches files whose tags actually change.
+
+A file's tags are read once and compared with the new values; BPM is
+compared numerically within a tolerance so "128.0" and "128" count as
+equal. Only changed fields are written, and nothing is saved when
+nothing changed, which keeps the audio file (and its checksum) intact.
+In batch mode the writes are queued and done together by `flush()`.
+"""
+
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import taglib
+
+logger = logging.getLogger()
+
+# BPM tags are written with two decimals, so this means "same value after rounding"
+BPM_TOLERANCE = 0.005
+
+
+def format_bpm(bpm: float) -> str:
+    return str(round(bpm, 2))
+
+
+def _bpm_equal(current: Optional[str], new: str, tolerance: float) -> bool:
+    try:
+        return abs(float(current) - float(new)) <= tolerance
+    except (TypeError, ValueError):
+        return False
+
+
+def changed_fields(current_tags: Dict, fields: Dict[str, str], tolerance: float = BPM_TOLERANCE) -> Dict[str, str]:
+    """Return the subset of `fields` that differ from `current_tags`."""
+    changes = {}
+    for key, value in fields.items():
+        key = key.upper()
+        current = next(iter(current_tags.get(key, [])), None)
+        if key == 'BPM':
+            if _bpm_equal(current, value, tolerance):
+                continue
+        elif current == value:
+            continue
+        changes[key] = value
+    return changes
+
+
+def _write(file_path: str, changes: Dict[str, str]):
+    with taglib.File(file_path) as f:
+        for key, value in changes.items():
+            f.tags[key] = [value]
+        f.save()
+
+
+class TagWriter:
+    def __init__(self, tolerance: float = BPM_TOLERANCE, batch: bool = False):
+        self.tolerance = tolerance
+        self.batch = batch
+        self.written = 0
+        self.skipped = 0
+        self.failed = 0
+        self._queue: List[Tuple[str, Dict[str, str]]] = []
+
+    def update(self, file_path: str, fields: Dict[str, str]) -> Optional[bool]:
+        """
+        Write `fields` to `file_path` if any of them changed.
+        Returns True when written (or queued in batch mode), False when
+        skipped and None on failure.
+        """
+        try:
+            with taglib.File(file_path) as f:
+                changes = changed_fields(f.tags, fields, self.tolerance)
+                if changes and not self.batch:
+                    for key, value in changes.items():
+                        f.tags[key] = [value]
+                    f.save()
+        except Exception as e:
+            logger.error(f"Failed to tag {file_path}: {e}")
+            self.failed += 1
+            return None
+
+        if not changes:
+            self.skipped += 1
+            return False
+        if self.batch:
+            self._queue.append((file_path, changes))
+        else:
+            self.written += 1
+        return True
+
+    def update_bpm(self, file_path: str, bpm: float) -> Optional[bool]:
+        return self.update(file_path, {'BPM': format_bpm(bpm)})
+
+    def record(self, written: Optional[bool]):
+        """Count the outcome of an update done elsewhere (e.g. in a pool worker)."""
+        if written is None:
+            self.failed += 1
+        elif written:
+            self.written += 1
+        else:
+            self.skipped += 1
+
+    def flush(self) -> List[str]:
+        """Write all queued changes; returns the paths that were written."""
+        done = []
+        queue, self._queue = self._queue, []
+        for file_path, changes in queue:
+            try:
+                _write(file_path, changes)
+            except Exception as e:
+                logger.error(f"Failed to tag {file_path}: {e}")
+                self.failed += 1
+                continue
+            self.written += 1
+            done.append(file_path)
+        return done
+
+    def stats(self) -> Dict[str, int]:
+        return {'written': self.written, 'skipped': self.skipped,
+                'failed': self.failed, 'queued': len(self._queue)}
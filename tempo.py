@@ -0,0 +1,148 @@
+"""
+Tempo estimation from a whole array of beat (or onset) times.
+
+Intervals between each beat and its next few neighbours (spanning k
+beats) are converted to BPM, folded by octaves into a plausible range
+and accumulated in a weighted histogram. Folding makes half/double-tempo detections vote for
+the same bin instead of pulling a median around. The strongest peaks are
+returned as candidates, and the share of all votes that landed near the
+best peak is its confidence. Everything is done with NumPy array
+operations, so the cost does not depend on Python loops over beats.
+Intervals that span a gap longer than MAX_BEAT_GAP (a breakdown, or the
+jump between separately analyzed windows) do not vote. For long mixes
+`tempo_curve` runs the same estimate over consecutive segments.
+"""
+
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+MIN_BPM = 70.0
+MAX_BPM = 180.0
+MIN_CONFIDENCE = 0.25
+BIN_WIDTH = 0.5
+NEIGHBOURS = 4
+# votes within this fraction of a peak's tempo count towards it
+PEAK_SPREAD = 0.02
+# seconds without a beat after which the beat sequence is treated as broken
+MAX_BEAT_GAP = 2.0
+TOP_CANDIDATES = 3
+
+
+# tracks at least this long (seconds of beats) get a tempo curve
+LONG_MIX_SECONDS = 20 * 60.0
+CURVE_SEGMENT_SECONDS = 60.0
+
+
+# how two tempo readings of the same track can relate: other / reference
+TEMPO_RELATIONS = (('double', 2.0), ('half', 0.5), ('three_halves', 1.5), ('two_thirds', 2.0 / 3))
+# BPM difference below which two readings count as the same tempo
+SAME_TEMPO = 0.5
+# relative tolerance for the octave relations
+RELATION_TOLERANCE = 0.02
+
+
+@dataclass
+class TempoEstimate:
+    bpm: float = None
+    confidence: float = 0.0
+    candidates: List[Tuple[float, float]] = field(default_factory=list)
+
+    def is_confident(self, min_confidence: float = MIN_CONFIDENCE) -> bool:
+        return self.bpm is not None and self.confidence >= min_confidence
+
+
+def fold_bpm(bpm: np.ndarray, min_bpm: float = MIN_BPM, max_bpm: float = MAX_BPM) -> np.ndarray:
+    """Halve or double each value until it lies in [min_bpm, max_bpm] (if the range allows)."""
+    bpm = np.asarray(bpm, dtype=np.float64)
+    down = np.maximum(np.ceil(np.log2(bpm / max_bpm)), 0)
+    bpm = bpm / np.exp2(down)
+    up = np.maximum(np.ceil(np.log2(min_bpm / bpm)), 0)
+    return bpm * np.exp2(up)
+
+
+def interval_bpms(beats: np.ndarray, neighbours: int = NEIGHBOURS) -> Tuple[np.ndarray, np.ndarray]:
+    """BPM implied by the interval to each of the next `neighbours` beats, weighted 1/k."""
+    beats = np.asarray(beats, dtype=np.float64)
+    # gaps_before[i] counts the gaps up to beat i, so a span i..i+k crosses one iff the counts differ
+    gaps_before = np.concatenate(([0], np.cumsum(np.diff(beats) > MAX_BEAT_GAP)))
+    values, weights = [], []
+    for k in range(1, min(neighbours, len(beats) - 1) + 1):
+        intervals = beats[k:] - beats[:-k]
+        valid = (intervals > 0) & (gaps_before[k:] == gaps_before[:-k])
+        intervals = intervals[valid]
+        values.append(60.0 * k / intervals)
+        weights.append(np.full(len(intervals), 1.0 / k))
+    if not values:
+        return np.empty(0), np.empty(0)
+    return np.concatenate(values), np.concatenate(weights)
+
+
+def estimate_tempo(beats: np.ndarray, min_bpm: float = MIN_BPM, max_bpm: float = MAX_BPM,
+                   top: int = TOP_CANDIDATES, bin_width: float = BIN_WIDTH) -> TempoEstimate:
+    bpms, weights = interval_bpms(beats)
+    if len(bpms) == 0:
+        return TempoEstimate()
+
+    folded = fold_bpm(bpms, min_bpm, max_bpm)
+    in_range = (folded >= min_bpm) & (folded <= max_bpm)
+    folded, weights = folded[in_range], weights[in_range]
+    total = weights.sum()
+    if total == 0:
+        return TempoEstimate()
+
+    edges = np.arange(min_bpm, max_bpm + bin_width, bin_width)
+    hist, _ = np.histogram(folded, bins=edges, weights=weights)
+    # spread each vote over its neighbouring bins so near-identical tempi reinforce each other
+    smooth = np.convolve(hist, [0.25, 0.5, 0.25], mode='same')
+
+    padded = np.concatenate(([-np.inf], smooth, [-np.inf]))
+    peaks = np.flatnonzero((smooth >= padded[:-2]) & (smooth > padded[2:]) & (smooth > 0))
+    peaks = peaks[np.argsort(smooth[peaks])[::-1][:top * 4]]
+
+    # refine each peak to the weighted mean of the votes close to it
+    centres = (edges[peaks] + edges[peaks + 1]) / 2
+    spread = np.maximum(1.5 * bin_width, centres * PEAK_SPREAD)
+    near = np.abs(folded[None, :] - centres[:, None]) <= spread[:, None]
+    mass = near @ weights
+    refined = (near * folded[None, :]) @ weights / np.where(mass > 0, mass, 1)
+    scores = mass / total
+
+    # keep the strongest peak of each cluster (only a handful of peaks, not beats)
+    candidates = []
+    for i in np.argsort(scores)[::-1]:
+        if all(abs(refined[i] - bpm) > spread[i] for bpm, _ in candidates):
+            candidates.append((round(float(refined[i]), 2), round(float(scores[i]), 3)))
+        if len(candidates) == top:
+            break
+    if not candidates:
+        return TempoEstimate()
+    best_bpm, best_score = candidates[0]
+    return TempoEstimate(best_bpm, best_score, candidates)
+
+
+def tempo_relation(reference: float, other: float, tolerance: float = SAME_TEMPO) -> str:
+    """'same', one of the TEMPO_RELATIONS names (e.g. 'double' when other is ~2x reference) or 'other'."""
+    if abs(other - reference) <= tolerance:
+        return 'same'
+    ratio = other / reference
+    for name, factor in TEMPO_RELATIONS:
+        if abs(ratio - factor) <= factor * RELATION_TOLERANCE:
+            return name
+    return 'other'
+
+
+def tempo_curve(beats: np.ndarray, segment_s: float = CURVE_SEGMENT_SECONDS, min_bpm: float = MIN_BPM,
+                max_bpm: float = MAX_BPM) -> List[Tuple[float, Optional[float]]]:
+    """`(segment start in seconds, BPM or None)` for each `segment_s` stretch of beats."""
+    beats = np.asarray(beats, dtype=np.float64)
+    if len(beats) == 0:
+        return []
+    edges = np.arange(0.0, beats[-1] + segment_s, segment_s)
+    bounds = np.searchsorted(beats, edges)
+    curve = []
+    for start, lo, hi in zip(edges[:-1], bounds[:-1], bounds[1:]):
+        bpm = estimate_tempo(beats[lo:hi], min_bpm, max_bpm).bpm
+        curve.append((float(start), round(bpm, 2) if bpm is not None else None))
+    return curve
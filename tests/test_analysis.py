@@ -0,0 +1,83 @@
+import subprocess
+import threading
+
+import numpy as np
+import pytest
+
+from analysis import (STDERR_TAIL, BeatBuffer, DecodeError, analysis_params, ffmpeg_path, stream_pcm,
+                      window_segments)
+from benchmark import synth_fixture, write_wav
+
+HOP = 256
+RATE = 22050
+
+
+def test_window_segments_are_evenly_spaced():
+    assert window_segments(300.0, 30.0, 3) == [(67.5, 30.0), (135.0, 30.0), (202.5, 30.0)]
+
+
+@pytest.mark.parametrize("duration", [None, 60.0, 90.0])
+def test_short_or_unknown_tracks_are_decoded_whole(duration):
+    assert window_segments(duration, 30.0, 3) == [(None, None)]
+
+
+def test_mode_params_only_carry_their_options():
+    assert 'window_s' not in analysis_params()
+    assert analysis_params(mode='windows', window_s=5)['window_s'] == 5
+    assert 'converge_tolerance' in analysis_params(mode='converge')
+    with pytest.raises(ValueError):
+        analysis_params(mode='sometimes')
+
+
+def test_beat_buffer_grows_and_trims():
+    buffer = BeatBuffer(capacity=2)
+    for i in range(5):
+        buffer.append(i * 0.5)
+    buffer.extend(np.array([3.0, 3.5]))
+    beats = buffer.array()
+    assert beats.dtype == np.float32 and beats.tolist() == [0.0, 0.5, 1.0, 1.5, 2.0, 3.0, 3.5]
+
+
+@pytest.fixture
+def corrupt_mp3(tmp_path):
+    """An MP3 with garbage every 20 bytes: ffmpeg still decodes it, but with ~80 KB of errors."""
+    wav, mp3 = str(tmp_path / "clicks.wav"), str(tmp_path / "corrupt.mp3")
+    write_wav(wav, synth_fixture('click', 120, 30))
+    subprocess.run([ffmpeg_path, "-v", "error", "-y", "-i", wav, "-b:a", "32k", mp3], check=True)
+    with open(mp3, 'r+b') as f:
+        data = bytearray(f.read())
+        rng = np.random.default_rng(1)
+        for i in range(1000, len(data), 20):
+            data[i:i + 6] = rng.integers(0, 256, 6, dtype=np.uint8).tobytes()
+        f.seek(0)
+        f.write(data)
+    return mp3
+
+
+def decoded_samples(path):
+    return sum(read for _, read in stream_pcm(path, RATE, HOP))
+
+
+def test_stream_pcm_buffers(tmp_path):
+    path = str(tmp_path / "clicks.wav")
+    write_wav(path, synth_fixture('click', 120, 5))
+    buffers = list(stream_pcm(path, RATE, HOP))
+    assert all(len(samples) == HOP for samples, _ in buffers)
+    assert sum(read for _, read in buffers) == pytest.approx(5 * RATE, abs=HOP)
+
+
+def test_stream_pcm_survives_a_flood_of_decoder_errors(corrupt_mp3):
+    # more error output than a pipe holds used to block ffmpeg, and the decode with it
+    decoded = []
+    thread = threading.Thread(target=lambda: decoded.append(decoded_samples(corrupt_mp3)), daemon=True)
+    thread.start()
+    thread.join(60)
+    assert not thread.is_alive() and decoded[0] > 0
+
+
+def test_undecodable_file_reports_the_end_of_ffmpeg_errors(tmp_path):
+    path = tmp_path / "noise.mp3"
+    path.write_bytes(np.random.default_rng(2).integers(0, 256, 1 << 16, dtype=np.uint8).tobytes())
+    with pytest.raises(DecodeError) as error:
+        decoded_samples(str(path))
+    assert 0 < len(str(error.value)) <= STDERR_TAIL
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+import backends
+from backends import (BACKENDS, DEFAULT_BACKEND, ArrayBackend, Backend, StreamingBackend, app_excludes,
+                      best_backend, get_backend, parse_genre_rule, register_backend, select_backend)
+
+
+class Incomplete(StreamingBackend):
+    name = 'incomplete'
+
+
+class Fixed(ArrayBackend):
+    name = 'fixed'
+
+    def beats(self, audio, params):
+        return np.arange(0.0, len(audio) / params['samplerate'], 0.5, dtype=np.float32)
+
+
+class Unnamed(ArrayBackend):
+    def beats(self, audio, params):
+        return np.zeros(0, dtype=np.float32)
+
+
+class Neither(Backend):
+    name = 'neither'
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(backends, 'BACKENDS', dict(BACKENDS))
+    return backends.BACKENDS
+
+
+def test_incomplete_backend_fails_before_registration():
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_register_checks_kind_and_name(registry):
+    with pytest.raises(TypeError):
+        register_backend(Neither())
+    with pytest.raises(ValueError):
+        register_backend(Unnamed())
+    register_backend(Fixed())
+    assert registry['fixed'].streaming is False
+
+
+def test_app_excludes_follow_registered_backends(registry):
+    excludes = app_excludes()
+    assert 'librosa' in excludes and 'numba' in excludes
+    assert not set(get_backend(DEFAULT_BACKEND).requires) & set(excludes)
+    fixed = Fixed()
+    fixed.requires = ('madmom',)
+    register_backend(fixed)
+    assert 'madmom' in app_excludes()
+
+
+def test_builtin_backends():
+    assert get_backend(DEFAULT_BACKEND).streaming
+    assert get_backend('aubio-hfc').method == 'hfc'
+    assert not get_backend('librosa').streaming
+    with pytest.raises(ValueError):
+        get_backend('nope')
+
+
+def test_genre_rule_parsing():
+    assert parse_genre_rule('Jazz=aubio-hfc') == ('jazz', 'aubio-hfc')
+    for value in ('jazz', '=aubio', 'jazz=nope'):
+        with pytest.raises(ValueError):
+            parse_genre_rule(value)
+
+
+def test_select_backend_by_genre(monkeypatch):
+    monkeypatch.setattr(backends, 'read_genre', lambda path: 'acid jazz')
+    params = {'backend': 'aubio-hfc', 'genre_backends': [['techno', 'aubio-kl'], ['jazz', 'aubio-mkl']]}
+    assert select_backend('x.mp3', params).name == 'aubio-mkl'
+    monkeypatch.setattr(backends, 'read_genre', lambda path: 'rock')
+    assert select_backend('x.mp3', params).name == 'aubio-hfc'
+    assert select_backend('x.mp3', {}).name == DEFAULT_BACKEND
+
+
+def test_best_backend_respects_speed_floor():
+    reports = {
+        'aubio': {'speedup': 1.0, 'bpm_error': {'within_1bpm': 8, 'octave_errors': 1}},
+        'aubio-hfc': {'speedup': 0.5, 'bpm_error': {'within_1bpm': 10, 'octave_errors': 0}},
+        'aubio-kl': {'speedup': 1.2, 'bpm_error': {'within_1bpm': 9, 'octave_errors': 0}},
+        'missing': {'speedup': 5.0, 'bpm_error': {'within_1bpm': 12, 'octave_errors': 0}},
+    }
+    assert best_backend(reports) == 'aubio-hfc'
+    assert best_backend(reports, min_speedup=0.9) == 'aubio-kl'
+    assert best_backend(reports, min_speedup=10) == DEFAULT_BACKEND
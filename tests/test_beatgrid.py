@@ -0,0 +1,176 @@
+import io
+import multiprocessing
+import sqlite3
+import struct
+
+import numpy as np
+import pytest
+
+import beatgrid
+from beatgrid import BeatGrid, BeatStore, mixxx_beatgrid, mixxx_beatmap, write_csv
+
+# Hand-encoded from Mixxx's src/proto/beats.proto:
+#   message Beat { optional int32 frame_position = 1; ... }
+#   message Bpm { optional double bpm = 1; ... }
+#   message BeatMap { repeated Beat beat = 1; }
+#   message BeatGrid { optional Bpm bpm = 1; optional Beat first_beat = 2; }
+# Positions are interleaved stereo samples: 0.5 s at 44100 Hz is 44100 * 2 * 0.5 = 44100.
+BEATGRID_120_AT_HALF_SECOND = bytes.fromhex("0a09" "09" "0000000000005e40" "1204" "08c4d802")
+# beats at 0 s, 0.5 s and 1 s at 48000 Hz: positions 0, 48000, 96000
+BEATMAP_48K = bytes.fromhex("0a02" "0800" "0a04" "0880f702" "0a04" "0880ee05")
+
+
+def read_varint(data, position):
+    value = shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        shift += 7
+        if not byte & 0x80:
+            return value, position
+
+
+def read_fields(data):
+    """(field number, value) pairs of one protobuf message; length-delimited values as bytes."""
+    fields, position = [], 0
+    while position < len(data):
+        key, position = read_varint(data, position)
+        field, wire = key >> 3, key & 7
+        if wire == 0:
+            value, position = read_varint(data, position)
+            value = value - (1 << 64) if value >= 1 << 63 else value
+        elif wire == 1:
+            value, position = struct.unpack('<d', data[position:position + 8])[0], position + 8
+        elif wire == 2:
+            length, position = read_varint(data, position)
+            value, position = data[position:position + length], position + length
+        else:
+            raise ValueError(f"unexpected wire type {wire}")
+        fields.append((field, value))
+    return fields
+
+
+def decode_beatmap(blob, sample_rate):
+    positions = [dict(read_fields(beat))[1] for field, beat in read_fields(blob) if field == 1]
+    return [position / 2 / sample_rate for position in positions]
+
+
+def decode_beatgrid(blob, sample_rate):
+    fields = dict(read_fields(blob))
+    return dict(read_fields(fields[1]))[1], dict(read_fields(fields[2]))[1] / 2 / sample_rate
+
+
+def test_beatgrid_matches_known_blob():
+    grid = BeatGrid("a.mp3", 120.0, 0.5, np.zeros(0, dtype=np.float32))
+    assert mixxx_beatgrid(grid, 44100) == BEATGRID_120_AT_HALF_SECOND
+
+
+def test_beatmap_matches_known_blob():
+    assert mixxx_beatmap([0.0, 0.5, 1.0], 48000) == BEATMAP_48K
+
+
+def test_beatmap_round_trip():
+    beats = np.arange(0.37, 300.0, 0.4839, dtype=np.float32)
+    decoded = decode_beatmap(mixxx_beatmap(beats, 44100), 44100)
+    # positions are whole frames
+    assert np.allclose(decoded, beats, atol=1 / 44100)
+
+
+def test_beatgrid_round_trip_with_negative_first_beat():
+    grid = BeatGrid("a.mp3", 127.98, -0.012, np.zeros(0, dtype=np.float32))
+    blob = mixxx_beatgrid(grid, 48000)
+    bpm, first_beat = decode_beatgrid(blob, 48000)
+    assert bpm == 127.98 and first_beat == pytest.approx(-0.012, abs=1 / 48000)
+    # negative int32 is a ten-byte varint, like protobuf writes it
+    assert len(read_fields(blob)[1][1]) == 11
+
+
+def test_beatgrid_needs_bpm():
+    with pytest.raises(ValueError):
+        mixxx_beatgrid(BeatGrid("a.mp3", None, 0.0, np.zeros(0, dtype=np.float32)), 44100)
+
+
+def test_store_put_get_replace_compact(tmp_path):
+    with BeatStore(str(tmp_path)) as store:
+        store.put("/a.mp3", 120.0, np.array([0.5, 1.0, 1.5]), "f1")
+        store.put("/b.mp3", 90.0, np.array([0.1, 0.7]))
+        store.put("/a.mp3", 121.0, np.array([0.6, 1.1]))
+        assert len(store) == 2 and "/a.mp3" in store
+        assert store.get("/a.mp3").beats.tolist() == pytest.approx([0.6, 1.1])
+        assert store.find("f1") is None
+        assert store.get("/a.mp3").between(1.0, 2.0).tolist() == pytest.approx([1.1])
+        assert store.compact() == 3 * 4
+        assert store.get("/b.mp3").beats.tolist() == pytest.approx([0.1, 0.7])
+        store.put("/c.mp3", None, np.array([2.0]))
+        assert [grid.path for grid in store.grids("/a")] == ["/a.mp3"]
+        out = io.StringIO()
+        assert write_csv(store.grids(), out) == 5
+    with BeatStore(str(tmp_path)) as store:
+        assert store.get("/c.mp3").beats.tolist() == [2.0]
+
+
+def _writer(directory, name, count):
+    with BeatStore(directory) as store:
+        for i in range(count):
+            beats = np.full(i % 7 + 1, (1000 if name == 'y' else 0) + i, dtype=np.float32)
+            store.put(f"/{name}/{i}.mp3", float(i), beats)
+
+
+def test_two_processes_share_a_store(tmp_path):
+    directory = str(tmp_path)
+    BeatStore(directory).close()
+    context = multiprocessing.get_context('spawn')
+    writers = [context.Process(target=_writer, args=(directory, name, 200)) for name in ("x", "y")]
+    for process in writers:
+        process.start()
+    for process in writers:
+        process.join()
+        assert process.exitcode == 0
+    with BeatStore(directory) as store:
+        assert len(store) == 400
+        for name in ("x", "y"):
+            for i in range(200):
+                beats = store.get(f"/{name}/{i}.mp3").beats
+                assert beats.tolist() == [float((1000 if name == 'y' else 0) + i)] * (i % 7 + 1)
+
+
+def test_put_waiting_on_a_compact_appends_to_the_new_file(tmp_path, monkeypatch):
+    directory = str(tmp_path / "beats")
+    with BeatStore(directory) as writer, BeatStore(directory) as compactor:
+        writer.put("/x", 120.0, np.arange(4, dtype=np.float32))
+        writer.put("/x", 120.0, np.arange(8, dtype=np.float32))
+        locked = beatgrid._locked
+        compacted = []
+
+        def compact_first(f):
+            # the compact runs after the writer checked its file, while it waits for the lock
+            if not compacted:
+                compacted.append(None)
+                compacted[0] = compactor.compact()
+            return locked(f)
+
+        monkeypatch.setattr(beatgrid, '_locked', compact_first)
+        writer.put("/y", 128.0, np.arange(3, dtype=np.float32) + 10)
+        monkeypatch.setattr(beatgrid, '_locked', locked)
+        assert compacted[0] > 0
+    with BeatStore(directory) as store:
+        assert store.get("/x").beats.tolist() == list(range(8))
+        assert store.get("/y").beats.tolist() == [10.0, 11.0, 12.0]
+
+
+
+def test_store_keeps_the_analysis_mode_and_upgrades_old_indexes(tmp_path):
+    directory = tmp_path / "beats"
+    directory.mkdir()
+    # an index written before grids recorded their mode
+    conn = sqlite3.connect(str(directory / "index.sqlite"))
+    conn.execute("CREATE TABLE grids (path TEXT PRIMARY KEY, fingerprint TEXT, offset INTEGER NOT NULL, "
+                 "count INTEGER NOT NULL, bpm REAL, first_beat REAL, updated REAL)")
+    conn.execute("INSERT INTO grids VALUES ('/old', NULL, 0, 0, 120.0, 0.0, 0.0)")
+    conn.commit()
+    conn.close()
+    with BeatStore(str(directory)) as store:
+        assert store.get("/old").mode == 'full' and not store.get("/old").partial
+        store.put("/new", 120.0, np.arange(4, dtype=np.float32), mode='windows')
+        assert store.get("/new").partial
@@ -0,0 +1,184 @@
+import os
+from concurrent.futures import Future
+
+import numpy as np
+import pytest
+import taglib
+
+import cli
+import tagging
+from analysis import FileResult, analysis_params, analyze_file, apply_cached_beats, profile_params, same_detection
+from benchmark import synth_fixture, write_wav
+from cache import AnalysisCache
+from engine import _submit, iter_batch
+from tagging import TagWriter
+
+BEATS = np.arange(0.0, 60.0, 0.5, dtype=np.float32)
+
+
+class RecordingExecutor:
+    """Stands in for the process pool and records which stage was submitted."""
+
+    def __init__(self):
+        self.calls = []
+
+    def submit(self, fn, *args):
+        self.calls.append(fn)
+        future = Future()
+        future.set_result(FileResult(args[0]))
+        return future
+
+
+@pytest.fixture
+def track(tmp_path):
+    path = tmp_path / "track.wav"
+    path.write_bytes(b"\0" * 1024)
+    return str(path)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    with AnalysisCache(str(tmp_path / "cache.sqlite")) as cache:
+        yield cache
+
+
+def stored(cache, track, params, tagged=True):
+    cache.store(FileResult(track, bpm=120.0, confidence=0.9, beats=BEATS), params, tagged=tagged)
+
+
+def submitted(cache, track, params, write_tags=True):
+    executor = RecordingExecutor()
+    future = _submit(executor, track, write_tags, write_tags, params, cache, 0.05)
+    return executor.calls[0] if executor.calls else future.result()
+
+
+def test_detection_params_split():
+    params = analysis_params()
+    assert same_detection(params, analysis_params(min_bpm=60, max_bpm=120, min_confidence=0.5))
+    assert same_detection(params, analysis_params(detect_key=True, min_key_confidence=0.9))
+    assert not same_detection(params, profile_params('fast'))
+    assert not same_detection(params, analysis_params(method='hfc'))
+    assert not same_detection(params, analysis_params(mode='windows'))
+    assert not same_detection(analysis_params(mode='windows'), analysis_params(mode='windows', window_s=5))
+    assert not same_detection(params, analysis_params(mode='converge'))
+    assert not same_detection(params, analysis_params(backend='aubio-hfc'))
+    assert not same_detection(params, analysis_params(genre_backends=[('jazz', 'aubio-hfc')]))
+
+
+def test_unchanged_file_is_a_cache_hit(cache, track):
+    params = analysis_params()
+    stored(cache, track, params)
+    result = submitted(cache, track, params)
+    assert isinstance(result, FileResult) and result.cached and result.bpm == 120.0
+
+
+def test_modified_file_is_analyzed_again(cache, track):
+    params = analysis_params()
+    stored(cache, track, params)
+    with open(track, 'ab') as f:
+        f.write(b"\0")
+    assert submitted(cache, track, params) is analyze_file
+
+
+def test_untagged_file_reuses_beats(cache, track):
+    params = analysis_params()
+    stored(cache, track, params, tagged=False)
+    assert submitted(cache, track, params) is apply_cached_beats
+
+
+@pytest.mark.parametrize("changed", [
+    {'min_bpm': 60.0, 'max_bpm': 120.0},
+    {'min_confidence': 0.8},
+])
+def test_postprocessing_change_reuses_beats(cache, track, changed):
+    stored(cache, track, analysis_params())
+    assert submitted(cache, track, analysis_params(**changed)) is apply_cached_beats
+
+
+@pytest.mark.parametrize("params", [
+    profile_params('fast'),
+    profile_params('balanced'),
+    analysis_params(method='hfc'),
+    analysis_params(mode='windows', window_s=5),
+    analysis_params(mode='converge'),
+    analysis_params(backend='aubio-hfc'),
+    analysis_params(genre_backends=[('jazz', 'aubio-hfc')]),
+])
+def test_detection_change_decodes_again(cache, track, params):
+    stored(cache, track, analysis_params())
+    assert submitted(cache, track, params) is analyze_file
+
+
+def test_mode_switch_decodes_again_both_ways(cache, track):
+    stored(cache, track, analysis_params(mode='windows'))
+    assert submitted(cache, track, analysis_params()) is analyze_file
+    stored(cache, track, analysis_params())
+    assert submitted(cache, track, analysis_params(mode='windows')) is analyze_file
+
+
+def test_key_needs_audio_unless_cached_the_same_way(cache, track):
+    stored(cache, track, analysis_params())
+    assert submitted(cache, track, analysis_params(detect_key=True)) is analyze_file
+    stored(cache, track, analysis_params(detect_key=True))
+    assert submitted(cache, track, analysis_params(detect_key=True, min_bpm=60)) is apply_cached_beats
+
+
+def test_readonly_cache_records_nothing(tmp_path, track):
+    with AnalysisCache(str(tmp_path / "ro.sqlite"), readonly=True) as cache:
+        stored(cache, track, analysis_params())
+        assert cache.lookup(track) is None
+
+
+def test_touched_file_matches_by_content_hash(tmp_path, track):
+    with AnalysisCache(str(tmp_path / "hash.sqlite"), use_content_hash=True) as cache:
+        stored(cache, track, analysis_params())
+        st = os.stat(track)
+        os.utime(track, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        entry = cache.lookup(track)
+        assert entry is not None and np.array_equal(entry.beats, BEATS)
+
+
+@pytest.fixture
+def clicks(tmp_path):
+    path = str(tmp_path / "clicks.wav")
+    write_wav(path, synth_fixture('click', 124, 10))
+    return path
+
+
+def run(cache, path, tag_writer):
+    return list(iter_batch([path], workers=1, cache=cache, tag_writer=tag_writer))[0]
+
+
+def test_flushed_batch_write_marks_entry_tagged(cache, clicks):
+    assert run(cache, clicks, TagWriter(batch=True)).ok
+    assert cache.lookup(clicks).tagged
+
+
+@pytest.mark.parametrize("broken", ['update', 'flush'])
+def test_failed_tag_write_leaves_entry_untagged(cache, clicks, monkeypatch, broken):
+    def fail(*args):
+        raise OSError("read-only file system")
+
+    # the parent writes batched tags: it reads them in update() and saves them in flush()
+    if broken == 'update':
+        monkeypatch.setattr(tagging.taglib, 'File', fail)
+    else:
+        monkeypatch.setattr(tagging, '_write', fail)
+    tag_writer = TagWriter(batch=True)
+    assert run(cache, clicks, tag_writer).ok
+    assert tag_writer.stats()['failed'] == 1
+    assert not cache.lookup(clicks).tagged
+    # the next run retries the write from the cached beats instead of calling it a hit
+    assert submitted(cache, clicks, analysis_params()) is apply_cached_beats
+
+
+def test_stopping_a_cli_run_early_still_flushes_into_the_open_cache(tmp_path, clicks):
+    cache_path = str(tmp_path / "cli.sqlite")
+    records = cli.analyze([clicks, clicks], workers=1, batch_tags=True, cache_path=cache_path)
+    assert next(records)['status'] == 'ok'
+    # what a caller's `break` does once the generator is collected
+    records.close()
+    with taglib.File(clicks) as f:
+        assert f.tags['BPM']
+    with AnalysisCache(cache_path) as cache:
+        assert cache.lookup(clicks).tagged
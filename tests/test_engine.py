@@ -0,0 +1,50 @@
+import shutil
+import threading
+
+import taglib
+
+import engine
+from benchmark import synth_fixture, write_wav
+from engine import iter_batch, run_batch
+from fingerprint import DuplicateGroups, audio_fingerprint
+
+
+def test_run_batch_streams_results_to_the_callback(tmp_path):
+    paths = []
+    for bpm in (100, 124):
+        paths.append(str(tmp_path / f"{bpm}.wav"))
+        write_wav(paths[-1], synth_fixture('click', bpm, 10))
+    calls = []
+    done = run_batch(paths, workers=1, write_tags=False,
+                     progress_callback=lambda done, total, result: calls.append((done, total, result.path)))
+    assert done == 2
+    assert calls == [(1, 2, paths[0]), (2, 2, paths[1])]
+
+
+def write_tagged_copies(tmp_path):
+    """Two copies of one track with different tags, and another track."""
+    paths = [str(tmp_path / name) for name in ("a.wav", "a copy.wav", "b.wav")]
+    write_wav(paths[0], synth_fixture('click', 124, 10))
+    shutil.copy(paths[0], paths[1])
+    with taglib.File(paths[1]) as f:
+        f.tags['TITLE'] = ['copy']
+        f.save()
+    write_wav(paths[2], synth_fixture('click', 100, 10))
+    return paths
+
+
+def test_fingerprints_are_read_off_the_submitting_thread(tmp_path, monkeypatch):
+    paths = write_tagged_copies(tmp_path)
+    threads = []
+
+    def recording(path):
+        threads.append(threading.current_thread())
+        return audio_fingerprint(path)
+
+    monkeypatch.setattr(engine, 'audio_fingerprint', recording)
+    duplicates = DuplicateGroups()
+    results = list(iter_batch(paths, workers=1, write_tags=False, duplicates=duplicates))
+    assert len(threads) == 3 and threading.main_thread() not in threads
+    assert [result.duplicate_of for result in results] == [None, paths[0], None]
+    assert duplicates.summary() == {'groups': 1, 'copies': 1}
+
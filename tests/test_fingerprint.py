@@ -0,0 +1,114 @@
+import io
+import struct
+from concurrent.futures import Future
+
+import pytest
+
+from fingerprint import DuplicateGroups, audio_fingerprint, audio_range
+
+AUDIO = bytes(range(256)) * 8
+
+
+def syncsafe(n):
+    return bytes((n >> shift) & 0x7f for shift in (21, 14, 7, 0))
+
+
+def id3v2(body=b"\0" * 50, footer=False):
+    tag = b"ID3\x04\x00" + bytes([0x10 if footer else 0]) + syncsafe(len(body)) + body
+    return tag + (b"3DI\x04\x00\x10" + syncsafe(len(body)) if footer else b"")
+
+
+def id3v1():
+    return b"TAG" + b"\0" * 125
+
+
+def apev2(items=b"\0" * 40, header=True):
+    size = len(items) + 32
+    flags = 0x80000000 if header else 0
+    footer = b"APETAGEX" + struct.pack('<IIII', 2000, size, 1, flags) + b"\0" * 8
+    return (b"APETAGEX" + struct.pack('<IIII', 2000, size, 1, flags | 0x20000000) + b"\0" * 8
+            if header else b"") + items + footer
+
+
+def flac_block(kind, body, last=False):
+    return bytes([kind | (0x80 if last else 0)]) + len(body).to_bytes(3, 'big') + body
+
+
+def riff_chunk(name, body):
+    return name + struct.pack('<I', len(body)) + body + (b"\0" if len(body) & 1 else b"")
+
+
+def atom(name, body):
+    return struct.pack('>I', len(body) + 8) + name + body
+
+
+def located(data, prefix_len, audio=AUDIO):
+    """The audio range found in `data`, checked to hold exactly `audio` after `prefix_len` bytes."""
+    start, end = audio_range(io.BytesIO(data), len(data))
+    assert (start, end) == (prefix_len, prefix_len + len(audio))
+    assert data[start:end] == audio
+    return start, end
+
+
+@pytest.mark.parametrize("head, tail", [
+    (id3v2(), b""),
+    (id3v2(footer=True), b""),
+    (id3v2() + id3v2(b"\0" * 7, footer=True), b""),
+    (b"", id3v1()),
+    (b"", apev2()),
+    (b"", apev2(header=False)),
+    (id3v2(footer=True), apev2() + id3v1()),
+])
+def test_mp3_tags_are_skipped(head, tail):
+    located(head + AUDIO + tail, len(head))
+
+
+def test_flac_metadata_blocks_are_skipped():
+    head = b"fLaC" + flac_block(0, b"\0" * 34) + flac_block(4, b"comments") + flac_block(1, b"\0" * 100, last=True)
+    located(head + AUDIO, len(head))
+    # an ID3v2 tag in front of the FLAC stream is skipped too
+    located(id3v2() + head + AUDIO, len(id3v2()) + len(head))
+
+
+def test_wav_data_chunk():
+    head = b"RIFF" + struct.pack('<I', 0) + b"WAVE" + riff_chunk(b"fmt ", b"\0" * 16) + riff_chunk(b"LIST", b"odd")
+    data = head + b"data" + struct.pack('<I', len(AUDIO)) + AUDIO + riff_chunk(b"id3 ", id3v2())
+    located(data, len(head) + 8)
+
+
+def test_mp4_mdat_with_64_bit_size():
+    head = atom(b"ftyp", b"M4A \0\0\0\0") + atom(b"free", b"\0" * 8)
+    mdat = struct.pack('>I', 1) + b"mdat" + struct.pack('>Q', len(AUDIO) + 16)
+    data = head + mdat + AUDIO + atom(b"moov", b"\0" * 64)
+    located(data, len(head) + 16)
+
+
+def test_mp4_mdat_to_end_of_file():
+    head = atom(b"ftyp", b"M4A \0\0\0\0")
+    located(head + struct.pack('>I', 0) + b"mdat" + AUDIO, len(head) + 8)
+
+
+def test_retagged_copies_share_a_fingerprint(tmp_path):
+    a, b, c = tmp_path / "a.mp3", tmp_path / "b.mp3", tmp_path / "c.mp3"
+    a.write_bytes(id3v2() + AUDIO + id3v1())
+    b.write_bytes(id3v2(b"\1" * 300, footer=True) + AUDIO + apev2())
+    c.write_bytes(id3v2() + AUDIO[:-1] + b"\0" + id3v1())
+    assert audio_fingerprint(str(a)) == audio_fingerprint(str(b)) != audio_fingerprint(str(c))
+    assert audio_fingerprint(str(tmp_path / "missing.mp3")) is None
+
+
+def test_finished_files_without_copies_are_forgotten():
+    groups = DuplicateGroups()
+    for path, fingerprint in (("a", "x"), ("b", "y"), ("c", "x")):
+        groups.add(fingerprint, path)
+        groups.lead(fingerprint, Future())
+    groups.finish("a")
+    groups.finish("b")
+    assert groups.paths == {"x": ["a", "c"]}
+    assert groups.fingerprints == {"a": "x", "c": "x"}
+    assert groups.leader("x") is None and groups.leader("y") is None
+    # a copy of "b" found later in the cache brings its group back
+    groups.add("y", "b")
+    groups.add("y", "d")
+    assert groups.groups() == {"x": ["a", "c"], "y": ["b", "d"]}
+    assert groups.summary() == {'groups': 2, 'copies': 2}
@@ -0,0 +1,142 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from analysis import FileResult
+from journal import JobJournal, JournalInUseError
+
+
+@pytest.fixture
+def journal_path(tmp_path):
+    return str(tmp_path / "jobs.sqlite")
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def as_worker(journal, pid):
+    journal.worker = f"{journal.worker.rsplit(':', 1)[0]}:{pid}"
+    return journal
+
+
+def test_claims_each_job_once(journal_path):
+    with JobJournal(journal_path) as first, as_worker(JobJournal(journal_path), os.getppid()) as second:
+        first.begin(["/music"])
+        first.add(["/music/a.mp3", "/music/b.mp3", "/music/c.mp3"])
+        claimed = [first.claim(), second.claim(), first.claim(), second.claim()]
+        assert sorted(filter(None, claimed)) == ["/music/a.mp3", "/music/b.mp3", "/music/c.mp3"]
+        assert claimed[-1] is None
+
+
+def test_failures_back_off_then_give_up(journal_path):
+    with JobJournal(journal_path, max_attempts=2, backoff=0.0) as journal:
+        journal.begin(["/music"])
+        journal.add(["/music/a.mp3"])
+        for attempt in range(2):
+            assert journal.claim() == "/music/a.mp3"
+            journal.record(FileResult("/music/a.mp3", status='error', error=f"boom {attempt}"))
+        assert journal.claim() is None
+        assert journal.failures() == {"/music/a.mp3": "boom 1"}
+        assert journal.next_retry() is None
+
+
+def test_backoff_delays_the_retry(journal_path):
+    with JobJournal(journal_path, backoff=60.0) as journal:
+        journal.begin(["/music"])
+        journal.add(["/music/a.mp3"])
+        journal.claim()
+        journal.record(FileResult("/music/a.mp3", status='unreadable'))
+        assert journal.claim() is None
+        assert 55 < journal.next_retry() <= 60
+
+
+def test_final_statuses_are_done(journal_path):
+    with JobJournal(journal_path) as journal:
+        journal.begin(["/music"])
+        journal.add(["/music/a.mp3"])
+        journal.claim()
+        journal.record(FileResult("/music/a.mp3", status='low_confidence'))
+        assert journal.counts()['done'] == 1
+
+
+def test_resume_recovers_jobs_of_a_dead_worker(journal_path):
+    with as_worker(JobJournal(journal_path), dead_pid()) as crashed:
+        crashed.begin(["/music"])
+        crashed.add(["/music/a.mp3", "/music/b.mp3"])
+        assert crashed.claim() == "/music/a.mp3"
+        crashed.record(FileResult("/music/a.mp3"))
+        assert crashed.claim() == "/music/b.mp3"
+        # the process died: nothing released, its runs row stays behind
+        crashed.conn.close()
+        crashed.conn = None
+    with JobJournal(journal_path) as journal:
+        assert journal.begin(["/music"]) is True
+        assert journal.counts() == {'pending': 1, 'running': 0, 'done': 1, 'failed': 0}
+        assert journal.claim() == "/music/b.mp3"
+
+
+def test_expired_lease_is_claimed_again(journal_path):
+    with JobJournal(journal_path, lease=0.0) as journal:
+        journal.worker = "remote-host:1"
+        journal.begin(["/music"])
+        journal.add(["/music/a.mp3"])
+        assert journal.claim() == "/music/a.mp3"
+        time.sleep(0.01)
+        journal.worker = "other-host:2"
+        assert journal.claim() == "/music/a.mp3"
+
+
+def test_release_returns_claimed_jobs(journal_path):
+    with JobJournal(journal_path) as journal:
+        journal.begin(["/music"])
+        journal.add(["/music/a.mp3"])
+        journal.claim()
+        journal.release()
+        assert journal.counts()['pending'] == 1
+
+
+def test_other_roots_clear_a_finished_journal(journal_path):
+    with JobJournal(journal_path) as journal:
+        journal.begin(["/music"])
+        journal.add(["/music/a.mp3"])
+    with JobJournal(journal_path) as journal:
+        assert journal.begin(["/other"]) is False
+        assert sum(journal.counts().values()) == 0
+
+
+def test_other_roots_are_refused_while_a_live_run_works(journal_path):
+    with as_worker(JobJournal(journal_path), os.getppid()) as running:
+        running.begin(["/music"])
+        running.add(["/music/a.mp3", "/music/b.mp3"])
+        running.claim()
+        with JobJournal(journal_path) as second:
+            with pytest.raises(JournalInUseError):
+                second.begin(["/other"])
+            # joining the same run is fine and keeps its queue
+            assert second.begin(["/music"]) is True
+        assert running.counts() == {'pending': 1, 'running': 1, 'done': 0, 'failed': 0}
+
+
+def test_stale_run_from_another_host_does_not_block(journal_path):
+    with JobJournal(journal_path, lease=0.0) as remote:
+        remote.worker = "remote-host:1"
+        remote.begin(["/music"])
+        remote.add(["/music/a.mp3"])
+        remote.conn.close()
+        remote.conn = None
+    time.sleep(0.01)
+    with JobJournal(journal_path, lease=0.0) as journal:
+        assert journal.begin(["/other"]) is False
+
+
+def test_jobs_queue_while_claiming(journal_path):
+    with JobJournal(journal_path) as journal:
+        journal.begin(["/music"])
+        paths = [f"/music/{i}.mp3" for i in range(10)]
+        assert list(journal.jobs(paths, chunk=3)) == paths
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from key import MAJOR_PROFILE, MINOR_PROFILE, ChromaAccumulator, estimate_key, key_name
+
+SAMPLE_RATE = 22050
+
+
+def midi_hz(note):
+    return 440.0 * 2 ** ((note - 69) / 12)
+
+
+def scale_audio(notes, seconds=6.0):
+    """The seven scale tones at once, tonic triad loudest: tonic, third, fifth, then the rest."""
+    weights = (3.0, 2.0, 2.5, 1.0, 1.0, 1.0, 1.0)
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    audio = sum(weight * np.sin(2 * np.pi * midi_hz(note) * t) for note, weight in zip(notes, weights))
+    return (audio / sum(weights)).astype(np.float32)
+
+
+@pytest.mark.parametrize("chroma, key", [
+    (MAJOR_PROFILE, 'C'),
+    (np.roll(MINOR_PROFILE, 9), 'Am'),
+    (np.roll(MINOR_PROFILE, 6), 'F#m'),
+    (np.roll(MAJOR_PROFILE, 8), 'Ab'),
+])
+def test_profiles_match_their_own_key(chroma, key):
+    estimate = estimate_key(np.asarray(chroma))
+    assert estimate.key == key and estimate.confidence == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize("notes, key", [
+    ((60, 64, 67, 62, 65, 69, 71), 'C'),
+    ((57, 60, 64, 59, 62, 65, 67), 'Am'),
+    ((54, 57, 61, 56, 59, 62, 64), 'F#m'),
+])
+def test_keys_of_synthetic_audio(notes, key):
+    chroma = ChromaAccumulator(SAMPLE_RATE)
+    audio = scale_audio(notes)
+    # buffers of the beat tracker's hop size, as the decode delivers them
+    for start in range(0, len(audio), 512):
+        chroma.add(audio[start:start + 512])
+    estimate = estimate_key(chroma.chroma)
+    assert estimate.key == key
+    assert estimate.is_confident()
+    # the relative major/minor shares the notes but ranks lower
+    assert estimate.candidates[0][1] > estimate.candidates[1][1]
+
+
+def test_silence_and_flat_chroma_give_no_key():
+    chroma = ChromaAccumulator(SAMPLE_RATE)
+    chroma.add(np.zeros(SAMPLE_RATE * 2, dtype=np.float32))
+    assert chroma.frames == 0
+    assert estimate_key(None).key is None
+    assert estimate_key(np.ones(12)).key is None
+    assert not estimate_key(np.ones(12)).is_confident()
+
+
+def test_key_names():
+    assert key_name(0, False) == 'C' and key_name(9, True) == 'Am' and key_name(13, False) == 'C#'
@@ -0,0 +1,53 @@
+import logging
+import os
+import subprocess
+import sys
+
+import pytest
+
+import memory
+from memory import parse_size, tree_rss
+
+pytestmark = pytest.mark.skipif(not os.path.exists("/proc/self/statm"), reason="needs /proc")
+
+CHILD_BYTES = 64 << 20
+
+
+@pytest.fixture
+def child():
+    # holds CHILD_BYTES resident until its stdin closes
+    code = (f"import sys; data = bytearray({CHILD_BYTES}); data[::4096] = b'x' * len(data[::4096]); "
+            "print(flush=True); sys.stdin.read()")
+    process = subprocess.Popen([sys.executable, "-c", code], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    process.stdout.readline()
+    yield process
+    process.stdin.close()
+    process.wait()
+
+
+def test_parse_size():
+    assert parse_size("512M") == 512 << 20
+    assert parse_size("2g") == 2 << 30
+    assert parse_size("800k") == 800 << 10
+    assert parse_size("100") == 100 << 20
+    with pytest.raises(ValueError):
+        parse_size("lots")
+
+
+def test_children_counted_without_children_files(child, monkeypatch):
+    own = memory._proc_rss(os.getpid())
+    assert tree_rss() >= own + CHILD_BYTES
+    # kernels built without CONFIG_PROC_CHILDREN: the parent pids in /proc/*/stat
+    monkeypatch.setattr(memory, '_has_children_files', lambda pid: False)
+    assert tree_rss() >= own + CHILD_BYTES
+
+
+def test_warns_when_children_cannot_be_listed(child, monkeypatch, caplog):
+    monkeypatch.setattr(memory, '_has_children_files', lambda pid: False)
+    monkeypatch.setattr(memory, '_ppid_children', lambda: None)
+    monkeypatch.setattr(memory, 'psutil', None)
+    monkeypatch.setattr(memory, '_warned_children', False)
+    with caplog.at_level(logging.WARNING):
+        assert 0 < tree_rss() < memory._proc_rss(os.getpid()) + CHILD_BYTES
+        tree_rss()
+    assert sum("child processes" in message for message in caplog.messages) == 1
@@ -0,0 +1,72 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import taglib
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+import mixxx_tempo_extractor
+from beatgrid import MIXXX_BEATGRID, MIXXX_BEATMAP, BeatStore
+from benchmark import write_wav
+from mixxx_tempo_extractor import export_beat_grids, row_signature, sync_track
+from mixxxdb import Base, Library, Track_Locations, get_db_engine
+
+
+def library_row(location, bpm=128.0):
+    return SimpleNamespace(id=1, location=location, filesize=0, bpm=bpm, key="Am", artist="Artist",
+                           title="Title", album="Album", genre="House", year="2020")
+
+
+@pytest.fixture
+def track(tmp_path):
+    path = str(tmp_path / "a.wav")
+    write_wav(path, np.zeros(4410, dtype=np.float32))
+    return path
+
+
+def test_written_then_unchanged_then_skipped(track):
+    row = library_row(track)
+    status, mtime_ns = sync_track(row, track)
+    assert status == "written"
+    with taglib.File(track) as f:
+        assert f.tags["BPM"] == ["128.0"] and f.tags["KEY"] == ["Am"]
+    assert sync_track(row, track)[0] == "unchanged"
+    assert sync_track(row, track, previous=(row_signature(row), mtime_ns)) == ("skipped", mtime_ns)
+    # a changed library value is written even with a previous sync on record
+    assert sync_track(library_row(track, 130.0), track, previous=(row_signature(row), mtime_ns))[0] == "written"
+
+
+def test_missing_file(tmp_path):
+    path = str(tmp_path / "gone.wav")
+    assert sync_track(library_row(path), path) == ("missing", None)
+
+
+@pytest.mark.parametrize("error", [PermissionError("read-only"), OSError("cannot save"), RuntimeError("bad")])
+def test_tag_failures_are_not_missing(track, monkeypatch, caplog, error):
+    def broken(path):
+        raise error
+    monkeypatch.setattr(mixxx_tempo_extractor.taglib, "File", broken)
+    assert sync_track(library_row(track), track) == ("failed", None)
+    assert "Failed to tag" in caplog.text
+
+
+def test_partial_grids_are_exported_as_constant_grids(tmp_path):
+    database = str(tmp_path / "mixxxdb.sqlite")
+    engine = get_db_engine(f"sqlite:///{database}")
+    Base.metadata.create_all(engine)
+    beats = np.arange(0.5, 30.0, 0.5, dtype=np.float32)
+    with Session(engine) as db, BeatStore(str(tmp_path / "beats")) as store:
+        for track_id, mode in ((1, 'full'), (2, 'windows')):
+            path = str(tmp_path / f"{mode}.wav")
+            write_wav(path, np.zeros(4410, dtype=np.float32))
+            store.put(path, 120.0, beats, mode=mode)
+            db.add(Track_Locations(id=track_id, location=path, filesize=os.path.getsize(path)))
+            db.add(Library(id=track_id, location=track_id, samplerate=44100, bpm_lock=0))
+        db.commit()
+    stats = export_beat_grids(database, str(tmp_path / "beats"))
+    assert stats["exported"] == 2 and stats["as_beatgrid"] == 1
+    with Session(engine) as db:
+        versions = dict(db.execute(select(Library.id, Library.beats_version)).all())
+    assert versions == {1: MIXXX_BEATMAP, 2: MIXXX_BEATGRID}
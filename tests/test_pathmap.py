@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from pathmap import PathResolver, default_mappings, parse_mapping
+
+
+def touch(path, size=0):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b"\0" * size)
+    return path
+
+
+def test_wsl_drive_mappings():
+    assert ("C:/", "/mnt/c/") in default_mappings(wsl=True)
+    assert default_mappings(wsl=False) == []
+    resolver = PathResolver(wsl=True)
+    assert resolver.map("C:\\Music\\a.mp3") == os.path.normpath("/mnt/c/Music/a.mp3")
+    assert resolver.map("d:/Music/a.mp3") == os.path.normpath("/mnt/d/Music/a.mp3")
+
+
+def test_longest_prefix_wins(tmp_path):
+    resolver = PathResolver([("D:/", "/mnt/d/"), ("D:/Music/", str(tmp_path) + "/")], wsl=False)
+    assert resolver.map("D:\\Music\\a.mp3") == str(tmp_path / "a.mp3")
+    assert resolver.map("D:/Other/a.mp3") == os.path.normpath("/mnt/d/Other/a.mp3")
+
+
+def test_parse_mapping():
+    assert parse_mapping("D:/Music=/mnt/nas") == ("D:/Music", "/mnt/nas")
+    with pytest.raises(ValueError):
+        parse_mapping("/mnt/nas")
+
+
+def test_direct_hit_is_resolved(tmp_path):
+    path = touch(str(tmp_path / "a.mp3"), 3)
+    resolver = PathResolver(search_roots=[str(tmp_path)], wsl=False)
+    assert resolver.resolve(path, 3) == (path, os.stat(path).st_mtime_ns)
+    assert resolver.stats["resolved"] == 1
+
+
+def test_moved_track_is_found_by_name_and_size(tmp_path):
+    moved = touch(str(tmp_path / "new" / "Song.mp3"), 5)
+    touch(str(tmp_path / "other" / "Song.mp3"), 7)
+    resolver = PathResolver(search_roots=[str(tmp_path)], wsl=False)
+    assert resolver.resolve("/old/place/song.mp3", 5)[0] == moved
+    assert resolver.stats["remapped"] == 1
+
+
+def test_same_name_other_size_is_not_used(tmp_path):
+    other = touch(str(tmp_path / "x" / "intro.mp3"), 9)
+    resolver = PathResolver(search_roots=[str(tmp_path)], wsl=False)
+    assert resolver.resolve("/old/intro.mp3", 4) == (None, None)
+    assert resolver.stats["name_only"] == 1 and resolver.stats["remapped"] == 0
+    assert resolver.name_only == [("/old/intro.mp3", other)]
+
+
+def test_ambiguous_names_stay_missing(tmp_path):
+    touch(str(tmp_path / "a" / "intro.mp3"), 1)
+    touch(str(tmp_path / "b" / "intro.mp3"), 2)
+    resolver = PathResolver(search_roots=[str(tmp_path)], wsl=False)
+    assert resolver.resolve("/old/intro.mp3", 3) == (None, None)
+    assert resolver.stats["missing"] == 1
+
+
+def test_missing_search_root_is_skipped(tmp_path, caplog):
+    resolver = PathResolver(search_roots=[str(tmp_path / "nope"), str(tmp_path)], wsl=False)
+    assert resolver.roots == [str(tmp_path)]
+    assert "not a directory" in caplog.text
+
+
+def test_paths_outside_the_index_are_stat_directly(tmp_path):
+    indexed, outside = tmp_path / "lib", tmp_path / "elsewhere"
+    touch(str(indexed / "a.mp3"))
+    path = touch(str(outside / "b.mp3"), 2)
+    resolver = PathResolver(search_roots=[str(indexed)], wsl=False)
+    assert resolver.lookup(path)[0] == 2
+    # a file appearing in the index root after indexing is not seen
+    late = touch(str(indexed / "late.mp3"))
+    assert resolver.lookup(late) is None
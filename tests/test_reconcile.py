@@ -0,0 +1,73 @@
+import os
+import subprocess
+import sys
+
+import pytest
+import taglib
+
+from benchmark import synth_fixture, write_wav
+from cache import AnalysisCache
+from engine import iter_batch
+from reconcile import TrackBpm, apply, classify, decide
+
+
+def track(mixxx_bpm=None, aubio_bpm=None, locked=False, confidence=None):
+    t = TrackBpm(1, "/music/a.mp3", mixxx_bpm, locked, 44100, aubio_bpm, confidence)
+    t.relation = classify(t)
+    return t
+
+
+def test_importing_needs_no_tk():
+    # in a fresh interpreter, other tests may have imported the GUI modules
+    code = "import sys, reconcile; sys.exit('tkinter' in sys.modules)"
+    assert subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.dirname(__file__))).returncode == 0
+
+
+@pytest.mark.parametrize("mixxx_bpm, aubio_bpm, relation", [
+    (128.0, 128.2, 'same'),
+    (128.0, 64.0, 'half'),
+    (87.0, 174.0, 'double'),
+    (128.0, None, 'mixxx_only'),
+    (None, 128.0, 'aubio_only'),
+    (None, None, 'neither'),
+])
+def test_classify(mixxx_bpm, aubio_bpm, relation):
+    assert track(mixxx_bpm, aubio_bpm).relation == relation
+
+
+def test_mixxx_only_is_kept_unless_pushed():
+    t = track(128.0)
+    for policy in ('mixxx', 'aubio', 'confidence'):
+        assert decide(t, policy) == 'keep'
+        assert decide(t, policy, push_mixxx_only=True) == 'mixxx'
+
+
+def test_policies():
+    assert decide(track(128.0, 130.0, confidence=0.9), 'mixxx') == 'mixxx'
+    assert decide(track(128.0, 130.0, confidence=0.1), 'aubio') == 'aubio'
+    # a locked BPM is never overruled
+    assert decide(track(128.0, 130.0, locked=True, confidence=0.9), 'aubio') == 'mixxx'
+    # confidence: the octave inside the BPM range wins, then a confident analyzer, else re-analyze
+    assert decide(track(87.0, 174.0), 'confidence', min_bpm=60, max_bpm=160) == 'mixxx'
+    assert decide(track(128.0, 130.0, confidence=0.9), 'confidence') == 'aubio'
+    assert decide(track(128.0, 130.0, confidence=0.1), 'confidence') == 'reanalyze'
+    assert decide(track(128.0, 128.1), 'confidence') == 'agree'
+
+
+def test_mixxx_bpm_applied_to_a_file_survives_the_next_analysis(tmp_path):
+    path = str(tmp_path / "clicks.wav")
+    write_wav(path, synth_fixture('click', 124, 10))
+    cache_path = str(tmp_path / "cache.sqlite")
+    with AnalysisCache(cache_path) as cache:
+        analyzed = next(iter_batch([path], workers=1, cache=cache))
+    assert analyzed.bpm == pytest.approx(124, abs=1)
+
+    winner = track(62.0, analyzed.bpm, confidence=analyzed.confidence)
+    winner.path, winner.decision = path, 'mixxx'
+    assert apply(str(tmp_path / "unused.sqlite"), [winner], cache_path=cache_path)['tags_written'] == 1
+
+    with AnalysisCache(cache_path) as cache:
+        again = next(iter_batch([path], workers=1, cache=cache))
+    assert again.cached and again.bpm == 62.0
+    with taglib.File(path) as f:
+        assert f.tags['BPM'] == ['62.0']
@@ -0,0 +1,48 @@
+import os
+import threading
+
+from scanner import scan
+
+
+def touch(path, data=b""):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def test_default_excludes_skip_files_not_directories(tmp_path):
+    for name in ("Recorder Sessions/a.wav", "Border Songs/b.mp3", "Other/c.flac", "Other/order.mp3",
+                 "Other/Thumbs.mp3", "Other/notes.txt"):
+        touch(str(tmp_path / name))
+    found = sorted(os.path.relpath(path, tmp_path) for path in scan([str(tmp_path)]))
+    assert found == [os.path.join("Border Songs", "b.mp3"), os.path.join("Other", "c.flac"),
+                     os.path.join("Recorder Sessions", "a.wav")]
+
+
+def test_dir_excludes_skip_subtrees(tmp_path):
+    touch(str(tmp_path / "keep" / "a.mp3"))
+    touch(str(tmp_path / "Samples" / "deep" / "b.mp3"))
+    found = list(scan([str(tmp_path)], dir_excludes=["Samples"]))
+    assert found == [str(tmp_path / "keep" / "a.mp3")]
+
+
+def test_roots_are_made_absolute(tmp_path, monkeypatch):
+    touch(str(tmp_path / "lib" / "a.mp3"))
+    touch(str(tmp_path / "b.mp3"))
+    monkeypatch.chdir(tmp_path)
+    assert sorted(scan(["lib", "b.mp3"])) == [str(tmp_path / "b.mp3"), str(tmp_path / "lib" / "a.mp3")]
+
+
+def test_with_stat_and_extensions(tmp_path):
+    touch(str(tmp_path / "a.MP3"), b"12345")
+    touch(str(tmp_path / "b.wav"))
+    [(path, size, mtime_ns)] = scan([str(tmp_path)], extensions=(".mp3",), with_stat=True)
+    assert path == str(tmp_path / "a.MP3") and size == 5 and mtime_ns == os.stat(path).st_mtime_ns
+
+
+def test_stop_event_ends_the_walk(tmp_path):
+    for i in range(20):
+        touch(str(tmp_path / f"d{i}" / "a.mp3"))
+    stop = threading.Event()
+    stop.set()
+    assert list(scan([str(tmp_path)], stop_event=stop)) == []
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from tempo import MAX_BEAT_GAP, estimate_tempo, fold_bpm, tempo_curve, tempo_relation
+
+
+def beat_times(bpm, seconds=60.0, start=0.0):
+    return np.arange(start, start + seconds, 60.0 / bpm)
+
+
+@pytest.mark.parametrize("bpm, folded", [
+    (128.0, 128.0),
+    (256.0, 128.0),
+    (512.0, 128.0),
+    (64.0, 128.0),
+    (32.0, 128.0),
+    (70.0, 70.0),
+    (180.0, 180.0),
+    (35.0, 70.0),
+    (360.0, 180.0),
+])
+def test_fold_bpm_into_range(bpm, folded):
+    assert fold_bpm(np.array([bpm]))[0] == pytest.approx(folded)
+
+
+def test_fold_bpm_keeps_values_a_narrow_range_cannot_hold():
+    # no power of two puts 150 into 100-110, so it ends up above the range
+    assert fold_bpm(np.array([150.0]), 100, 110)[0] == pytest.approx(150.0)
+
+
+@pytest.mark.parametrize("tracked, expected", [(128.0, 128.0), (64.0, 128.0), (256.0, 128.0), (43.5, 87.0)])
+def test_half_and_double_tempo_beats_fold_to_one_tempo(tracked, expected):
+    estimate = estimate_tempo(beat_times(tracked))
+    assert estimate.bpm == pytest.approx(expected, abs=0.1)
+    assert estimate.is_confident()
+
+
+def test_bpm_range_decides_the_octave():
+    beats = beat_times(150.0)
+    assert estimate_tempo(beats).bpm == pytest.approx(150.0, abs=0.1)
+    assert estimate_tempo(beats, min_bpm=60, max_bpm=140).bpm == pytest.approx(75.0, abs=0.1)
+
+
+def test_skipped_beats_vote_for_the_same_tempo():
+    beats = np.delete(beat_times(120.0), np.arange(3, 120, 7))
+    assert estimate_tempo(beats).bpm == pytest.approx(120.0, abs=0.5)
+
+
+def test_intervals_across_a_gap_do_not_vote():
+    # a breakdown that is 1.25 beats long would vote for an odd tempo if it counted
+    first = beat_times(120.0, 30.0)
+    second = beat_times(120.0, 30.0, start=first[-1] + MAX_BEAT_GAP + 0.625)
+    estimate = estimate_tempo(np.concatenate([first, second]))
+    assert estimate.bpm == pytest.approx(120.0, abs=0.1)
+    assert estimate.confidence == pytest.approx(1.0)
+
+
+def test_too_few_beats():
+    assert estimate_tempo(np.array([])).bpm is None
+    assert estimate_tempo(np.array([1.0])).bpm is None
+    assert not estimate_tempo(np.array([1.0])).is_confident()
+
+
+@pytest.mark.parametrize("other, relation", [
+    (128.3, 'same'),
+    (256.0, 'double'),
+    (64.0, 'half'),
+    (192.0, 'three_halves'),
+    (85.33, 'two_thirds'),
+    (100.0, 'other'),
+])
+def test_tempo_relation(other, relation):
+    assert tempo_relation(128.0, other) == relation
+
+
+def test_tempo_curve_follows_tempo_changes():
+    first = beat_times(120.0, 120.0)
+    second = beat_times(130.0, 60.0, start=180.0)
+    curve = tempo_curve(np.concatenate([first, second]))
+    assert [start for start, _ in curve] == [0.0, 60.0, 120.0, 180.0]
+    assert curve[0][1] == pytest.approx(120.0, abs=0.1) and curve[1][1] == pytest.approx(120.0, abs=0.1)
+    # a minute without beats has no tempo
+    assert curve[2][1] is None
+    assert curve[3][1] == pytest.approx(130.0, abs=0.1)
+    assert tempo_curve(np.array([])) == []